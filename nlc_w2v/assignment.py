@@ -0,0 +1,500 @@
+from collections import Counter
+from itertools import permutations
+import math
+import numpy
+
+ZERO_TOLERANCE = 1e-9
+FLOAT32_ZERO_TOLERANCE = 1e-5
+# Cost matrixes up to this size are minimized over every permutation at once (6! = 720),
+# bigger ones are solved by scipy one by one
+BRUTE_FORCE_SIZE = 6
+_BRUTE_FORCE_ELEMENTS = 2 ** 22
+# Relative lower bound decrease, so rounding never prunes example which is nearest one
+PRUNING_SLACK = 1e-9
+# Smaller cost matrixes (up to 4! permutations) are all minimized faster than lower bounds are sorted
+PRUNING_MIN_SIZE = 5
+# Label of zero vector words (padding and out of vocabulary words) in zero distance trimming
+PAD_LABEL = -1
+_permutation_tables = {}
+
+
+def example_lengths(matrixes):
+    """
+    Get word count of padded sentence matrixes (index of last non-zero row plus one)
+    :param matrixes: sentence matrixes (indexes - exampleNumber, wordNumber, wordVectorComponentNumber)
+    :type matrixes: numpy.ndarray
+    :return: lengths
+    :rtype: numpy.ndarray
+    """
+    nonzero = numpy.any(matrixes != 0, axis=2)
+    lengths = nonzero.shape[1] - numpy.argmax(nonzero[:, ::-1], axis=1)
+    lengths[~nonzero.any(axis=1)] = 0
+    return lengths
+
+
+def permutation_examples(matrixes):
+    """
+    Find examples of permutation-expanded class matrix (configs saved without example word counts store
+    every permutation of every example: first one, then others in itertools.permutations order of it).
+    Out of vocabulary words are zero rows, so trailing ones can't be told from padding:
+    largest word count whose permutations are next rows is used.
+    :param matrixes: expanded sentence matrixes (indexes - rowNumber, wordNumber, wordVectorComponentNumber)
+    :type matrixes: numpy.ndarray
+    :return: indexes of first permutation of every example and example word counts
+    :rtype: tuple[numpy.ndarray, numpy.ndarray]
+    """
+    def expands_to(row, length, rows):
+        """
+        Are rows permutations of first length words of row (in itertools.permutations order)?
+        """
+        for permuted, permutation in zip(rows, permutations(range(length))):
+            if not numpy.array_equal(permuted[:length], row[list(permutation)]) or permuted[length:].any():
+                return False
+        return True
+
+    nonzero_lengths = example_lengths(matrixes)
+    indexes = []
+    lengths = []
+    i = 0
+    while i < len(matrixes):
+        for length in range(matrixes.shape[1], nonzero_lengths[i] - 1, -1):
+            size = math.factorial(length)
+            if size <= len(matrixes) - i and expands_to(matrixes[i], length, matrixes[i:i + size]):
+                break
+        else:
+            length, size = nonzero_lengths[i], 1
+        indexes.append(i)
+        lengths.append(length)
+        i += size
+    return numpy.array(indexes, dtype=int), numpy.array(lengths, dtype=int)
+
+
+def segment_minimums(values, offsets):
+    """
+    Get minimum of every segment (e.g. class) of values, empty segments get infinity
+    (numpy.minimum.reduceat gives next value for them)
+    :param values: values (indexes - valueNumber[, ...])
+    :type values: numpy.ndarray
+    :param offsets: segment offsets (segment i values are offsets[i]:offsets[i+1])
+    :type offsets: numpy.ndarray
+    :return: minimums (indexes - segmentNumber[, ...])
+    :rtype: numpy.ndarray
+    """
+    offsets = numpy.asarray(offsets)
+    nonempty = offsets[1:] > offsets[:-1]
+    if nonempty.all():
+        return numpy.minimum.reduceat(values, offsets[:-1])
+    result = numpy.full((len(nonempty),) + numpy.shape(values)[1:], numpy.inf)
+    if nonempty.any():
+        result[nonempty] = numpy.minimum.reduceat(values, offsets[:-1][nonempty])
+    return result
+
+
+def assignment_cost_matrixes(matrix, examples, lengths, example_norms=None, products=None,
+                             tolerance=ZERO_TOLERANCE):
+    """
+    Build square assignment cost matrixes from phrase words to example rows.
+    Rows - phrase words and phrase padding,
+    columns - example words, example padding and "dropped word" slots
+    (phrase words above sentence matrix length are dropped, like in permutation mode).
+    Matchings which can't be given by any permutation pair are forbidden (infinite cost).
+    :param matrix: phrase matrix (without padding)
+    :type matrix: numpy.ndarray
+    :param examples: class example matrixes (indexes - exampleNumber, wordNumber, wordVectorComponentNumber)
+    :type examples: numpy.ndarray
+    :param lengths: example word counts
+    :type lengths: numpy.ndarray
+    :param example_norms: squared norms of example rows (calculated if not given)
+    :type example_norms: numpy.ndarray|NoneType
+    :param products: dot products of example rows and phrase words (indexes - exampleNumber * wordNumber,
+                     phraseWord), calculated if not given
+    :type products: numpy.ndarray|NoneType
+    :param tolerance: relative distance treated as zero
+    :type tolerance: float
+    :return: cost matrixes (indexes - exampleNumber, phraseRow, exampleColumn)
+    :rtype: numpy.ndarray
+    """
+    example_count, length, vector_size = examples.shape
+    word_count = len(matrix)
+    size = max(word_count, length)
+    query = numpy.zeros((size, vector_size))
+    query[:word_count] = matrix
+    query_norms = (query * query).sum(1)
+    if example_norms is None:
+        example_norms = (examples * examples).sum(2)
+    if products is None:
+        products = examples.reshape((example_count * length, vector_size)).dot(query[:word_count].T)
+    if size > word_count:
+        products = numpy.hstack([products, numpy.zeros((len(products), size - word_count))])
+    pair_costs = query_norms[None, :, None] \
+        - 2.0 * products.reshape((example_count, length, size)).transpose((0, 2, 1)) \
+        + example_norms[:, None, :]
+    # ||a||^2 - 2ab + ||b||^2 isn't exact, so drop rounding noise to keep zero distances zero
+    scale = query_norms[None, :, None] + example_norms[:, None, :]
+    pair_costs[pair_costs <= tolerance * scale] = 0.0
+    word_rows = numpy.arange(size) < word_count
+    word_columns = numpy.arange(length)[None, :] < numpy.asarray(lengths)[:, None]
+    longer = (numpy.asarray(lengths) > word_count)[:, None, None]
+    forbidden = (longer & word_rows[None, :, None] & ~word_columns[:, None, :]) | \
+        (~longer & ~word_rows[None, :, None] & word_columns[:, None, :])
+    pair_costs[forbidden] = numpy.inf
+    costs = numpy.zeros((example_count, size, size))
+    costs[:, :, :length] = pair_costs
+    return costs
+
+
+def _permutation_table(size):
+    """
+    Get every permutation of range(size)
+    :param size: size
+    :type size: int
+    :return: permutations (indexes - permutationNumber, position)
+    :rtype: numpy.ndarray
+    """
+    table = _permutation_tables.get(size)
+    if table is None:
+        table = list(permutations(range(size)))
+        table = numpy.array(table, dtype=numpy.intp).reshape((len(table), size))
+        _permutation_tables[size] = table
+    return table
+
+
+def _brute_force_minimums(costs):
+    """
+    Get minimal assignment cost of every cost matrix by checking every permutation
+    :param costs: cost matrixes (indexes - matrixNumber, row, column)
+    :type costs: numpy.ndarray
+    :return: minimal costs
+    :rtype: numpy.ndarray
+    """
+    size = costs.shape[1]
+    table = _permutation_table(size)
+    rows = numpy.arange(size)
+    result = numpy.zeros(len(costs))
+    chunk_size = max(1, _BRUTE_FORCE_ELEMENTS // max(table.size, 1))
+    for start in range(0, len(costs), chunk_size):
+        result[start:start + chunk_size] = costs[start:start + chunk_size][:, rows, table].sum(2).min(1)
+    return result
+
+
+def assignment_distances(matrix, examples, lengths, example_norms=None, products=None,
+                         tolerance=ZERO_TOLERANCE, brute_force_size=BRUTE_FORCE_SIZE):
+    """
+    Get squared distances from phrase to every example, minimized over word orderings
+    (same value as minimum over all phrase and example permutations)
+    :param matrix: phrase matrix (without padding)
+    :type matrix: numpy.ndarray
+    :param examples: class example matrixes (indexes - exampleNumber, wordNumber, wordVectorComponentNumber)
+    :type examples: numpy.ndarray
+    :param lengths: example word counts
+    :type lengths: numpy.ndarray
+    :param example_norms: squared norms of example rows (calculated if not given)
+    :type example_norms: numpy.ndarray|NoneType
+    :param products: dot products of example rows and phrase words (see assignment_cost_matrixes)
+    :type products: numpy.ndarray|NoneType
+    :param tolerance: relative distance treated as zero
+    :type tolerance: float
+    :param brute_force_size: maximal cost matrix size minimized over every permutation with one vectorized pass
+    :type brute_force_size: int
+    :return: squared distances
+    :rtype: numpy.ndarray
+    """
+    costs = assignment_cost_matrixes(matrix, examples, lengths, example_norms, products, tolerance)
+    return assignment_minimums(costs, brute_force_size)
+
+
+def assignment_minimums(costs, brute_force_size=BRUTE_FORCE_SIZE):
+    """
+    Get minimal assignment cost of every cost matrix
+    :param costs: cost matrixes (indexes - matrixNumber, row, column)
+    :type costs: numpy.ndarray
+    :param brute_force_size: maximal cost matrix size minimized over every permutation with one vectorized pass
+    :type brute_force_size: int
+    :return: minimal costs
+    :rtype: numpy.ndarray
+    """
+    if costs.shape[1] <= brute_force_size:
+        return _brute_force_minimums(costs)
+    # scipy.optimize takes longer to import than the whole package, so it's imported on first use
+    from scipy.optimize import linear_sum_assignment
+    result = numpy.zeros(len(costs))
+    for i, cost in enumerate(costs):
+        rows, columns = linear_sum_assignment(cost)
+        result[i] = cost[rows, columns].sum()
+    return result
+
+
+def assignment_lower_bounds(costs):
+    """
+    Get lower bounds of minimal assignment costs.
+    Every row (and every column) is assigned exactly once,
+    so neither sum of row minimums nor sum of column minimums exceeds minimal cost.
+    :param costs: cost matrixes (indexes - matrixNumber, row, column)
+    :type costs: numpy.ndarray
+    :return: lower bounds
+    :rtype: numpy.ndarray
+    """
+    if costs.shape[1] == 0:
+        return numpy.zeros(len(costs))
+    return numpy.maximum(costs.min(2).sum(1), costs.min(1).sum(1))
+
+
+def pruned_assignment_distances(matrix, examples, lengths, offsets, example_norms=None, products=None,
+                                tolerance=ZERO_TOLERANCE, brute_force_size=BRUTE_FORCE_SIZE):
+    """
+    Get squared distances from phrase to examples which can be nearest non-zero example of their class
+    (see assignment_distances).
+    Examples of every class are solved in lower bound order by rounds (1, 2, 4, ... examples per class),
+    example is abandoned without solving when its lower bound isn't below best non-zero distance of its class.
+    Examples with zero lower bound are always solved (they can be zero distance ones).
+    Cost matrixes smaller than PRUNING_MIN_SIZE are all solved.
+    So minimal non-zero distance of every class (or zero, if all class distances are zeros) is exact.
+    :param matrix: phrase matrix (without padding)
+    :type matrix: numpy.ndarray
+    :param examples: class example matrixes (indexes - exampleNumber, wordNumber, wordVectorComponentNumber)
+    :type examples: numpy.ndarray
+    :param lengths: example word counts
+    :type lengths: numpy.ndarray
+    :param offsets: class i examples are examples[offsets[i]:offsets[i + 1]]
+    :type offsets: numpy.ndarray
+    :param example_norms: squared norms of example rows (calculated if not given)
+    :type example_norms: numpy.ndarray|NoneType
+    :param products: dot products of example rows and phrase words (see assignment_cost_matrixes)
+    :type products: numpy.ndarray|NoneType
+    :param tolerance: relative distance treated as zero
+    :type tolerance: float
+    :param brute_force_size: maximal cost matrix size minimized over every permutation with one vectorized pass
+    :type brute_force_size: int
+    :return: squared distances (infinity for abandoned examples) and solved example count
+    :rtype: tuple[numpy.ndarray, int]
+    """
+    costs = assignment_cost_matrixes(matrix, examples, lengths, example_norms, products, tolerance)
+    if costs.shape[1] < PRUNING_MIN_SIZE:
+        return assignment_minimums(costs, brute_force_size), len(costs)
+    # sums of row minimums and of assigned costs are rounded differently, so bounds are loosened a bit
+    bounds = assignment_lower_bounds(costs) * (1.0 - PRUNING_SLACK)
+    offsets = numpy.asarray(offsets)
+    segments = numpy.repeat(numpy.arange(len(offsets) - 1), numpy.diff(offsets))
+    order = numpy.lexsort((bounds, segments))
+    ranks = numpy.zeros(len(costs), dtype=int)
+    ranks[order] = numpy.arange(len(costs)) - offsets[segments[order]]
+    result = numpy.full(len(costs), numpy.inf)
+    solved = numpy.zeros(len(costs), dtype=bool)
+    best = numpy.full(len(offsets) - 1, numpy.inf)
+    round_size = 1
+    while True:
+        remaining = ~solved & ((bounds < best[segments]) | (bounds <= 0.0))
+        if not remaining.any():
+            break
+        current = remaining & (ranks < round_size)
+        if current.any():
+            result[current] = assignment_minimums(costs[current], brute_force_size)
+            solved |= current
+            nonzero = numpy.where(solved & (result > 0.0), result, numpy.inf)
+            best = segment_minimums(nonzero, offsets)
+        round_size *= 2
+    return result, int(solved.sum())
+
+
+def _positive_minimum(cost, brute_force_size=BRUTE_FORCE_SIZE):
+    """
+    Get minimal non-zero assignment cost of cost matrix.
+    Assignment with non-zero cost has non-zero cost pair, so bigger matrixes are solved
+    without every row and column of non-zero cost pair (pair cost is added).
+    :param cost: cost matrix
+    :type cost: numpy.ndarray
+    :param brute_force_size: maximal cost matrix size minimized over every permutation
+    :type brute_force_size: int
+    :return: minimal non-zero cost (infinity if every assignment costs zero)
+    :rtype: float
+    """
+    size = len(cost)
+    if size <= brute_force_size:
+        sums = cost[numpy.arange(size), _permutation_table(size)].sum(1)
+        sums = sums[sums > 0.0]
+        return float(sums.min()) if len(sums) > 0 else numpy.inf
+    from scipy.optimize import linear_sum_assignment
+    result = numpy.inf
+    indexes = numpy.arange(size)
+    for row, column in zip(*numpy.nonzero((cost > 0.0) & numpy.isfinite(cost))):
+        if cost[row, column] >= result:
+            continue
+        rest = cost[numpy.ix_(indexes != row, indexes != column)]
+        try:
+            rows, columns = linear_sum_assignment(rest)
+        except ValueError:
+            # every assignment of the rest is forbidden
+            continue
+        result = min(result, cost[row, column] + rest[rows, columns].sum())
+    return result
+
+
+def _word_labels(matrix, costs, example_norms, lengths, tolerance):
+    """
+    Label words of phrase and zero distance examples by equality:
+    phrase word gets number of first equal phrase word, example word gets label of equal phrase word,
+    zero vector word (padding or out of vocabulary one) gets PAD_LABEL
+    :param matrix: phrase matrix (without padding)
+    :type matrix: numpy.ndarray
+    :param costs: cost matrixes of examples (see assignment_cost_matrixes)
+    :type costs: numpy.ndarray
+    :param example_norms: squared norms of example rows
+    :type example_norms: numpy.ndarray
+    :param lengths: example word counts
+    :type lengths: numpy.ndarray
+    :param tolerance: relative distance treated as zero
+    :type tolerance: float
+    :return: word labels of every example (in stored word order)
+    :rtype: list[tuple[int]]
+    """
+    word_count = len(matrix)
+    norms = (matrix * matrix).sum(1)
+    distances = norms[:, None] - 2.0 * matrix.dot(matrix.T) + norms[None, :]
+    equal = distances <= tolerance * (norms[:, None] + norms[None, :])
+    phrase_labels = numpy.where(norms > 0.0, numpy.argmax(equal, 1) if word_count > 0 else 0, PAD_LABEL)
+    result = []
+    for i, length in enumerate(lengths):
+        labels = []
+        for j in range(length):
+            words = numpy.nonzero(costs[i, :word_count, j] == 0.0)[0]
+            if example_norms[i, j] == 0.0:
+                labels.append(PAD_LABEL)
+            elif len(words) > 0:
+                labels.append(int(phrase_labels[words[0]]))
+            else:
+                # word isn't equal to any phrase word, so its label differs from every other one
+                labels.append(word_count + i * costs.shape[2] + j)
+        result.append(tuple(labels))
+    return result
+
+
+def _same_sequence_count(labels):
+    """
+    Count permutations of labels giving same label sequence
+    :param labels: labels
+    :type labels: list[int]|tuple[int]
+    :rtype: int
+    """
+    result = 1
+    for count in Counter(labels).values():
+        result *= math.factorial(count)
+    return result
+
+
+def _keeps_zero(labels, lengths, word_count, length):
+    """
+    Does class keep zero distance after permutation mode trimming?
+    Permutation mode compares every phrase permutation (cut to sentence matrix length) with every example permutation
+    (examples in class order, permutations of every example in itertools.permutations order),
+    leading and trailing zero distances of class are trimmed for every phrase permutation.
+    Phrase permutation is zero distance to example permutations with same word labels, so it's enough to check
+    distinct label sequences of zero distance examples: any sequence, which isn't sequence of first or last
+    class permutation, has zero distance in the middle of class. Example with 3 or more distinct sequences always
+    has such one, fewer sequences are checked by counting permutations with them.
+    :param labels: word labels of zero distance examples (by example number in class)
+    :type labels: dict[int, tuple[int]]
+    :param lengths: word counts of every class example
+    :type lengths: numpy.ndarray
+    :param word_count: phrase word count
+    :type word_count: int
+    :param length: sentence matrix length
+    :type length: int
+    :rtype: bool
+    """
+    sequences = set()
+    for example_labels in labels.values():
+        # example words above phrase length can be matched with phrase padding only
+        padding = max(0, len(example_labels) - word_count)
+        words = [label for label in example_labels if label != PAD_LABEL]
+        words += [PAD_LABEL] * max(0, len(example_labels) - len(words) - padding)
+        if math.factorial(len(words)) // _same_sequence_count(words) > 2:
+            return True
+        for sequence in set(permutations(words)) if len(set(words)) > 1 else [tuple(words)]:
+            sequences.add(sequence + (PAD_LABEL,) * (length - len(words)))
+    if len(sequences) > 2:
+        return True
+    rows = [math.factorial(example_length) for example_length in lengths]
+
+    def matches(example, sequence):
+        """
+        Count example permutations with given label sequence
+        """
+        example_labels = labels.get(example)
+        if example_labels is None or any(label != PAD_LABEL for label in sequence[len(example_labels):]) or \
+                sorted(sequence[:len(example_labels)]) != sorted(example_labels):
+            return 0
+        return _same_sequence_count(example_labels)
+
+    def run(examples, sequence, reverse):
+        """
+        Count permutations with given label sequence at start (or end) of class
+        """
+        result = 0
+        for example in examples:
+            count = matches(example, sequence)
+            if count == rows[example]:
+                result += count
+                continue
+            if count > 0:
+                # first permutations reorder last words of example only, last permutations - first words only
+                ordered = labels[example][::-1] if reverse else labels[example]
+                if ordered + (PAD_LABEL,) * (length - len(ordered)) == sequence:
+                    same = 1
+                    while same < len(ordered) and ordered[-same - 1] == ordered[-1]:
+                        same += 1
+                    result += math.factorial(same)
+            break
+        return result
+
+    for sequence in sequences:
+        total = sum(matches(example, sequence) for example in labels.keys())
+        if total == sum(rows) or \
+                total > run(range(len(lengths)), sequence, False) + run(reversed(range(len(lengths))), sequence, True):
+            return True
+    return False
+
+
+def trimmed_zero_distances(matrix, distances, examples, lengths, offsets, example_norms=None,
+                           tolerance=ZERO_TOLERANCE, brute_force_size=BRUTE_FORCE_SIZE):
+    """
+    Trim zero assignment distances like permutation mode trims zero distances (leading and trailing
+    zeros of every class, see ClassMatrixStack.class_distances), so minimal distance of every class
+    is same as in permutation mode: zero distances of class are kept (see _keeps_zero) or replaced by
+    minimal non-zero assignment cost of their examples (minimal non-zero distance of permutation pair).
+    :param matrix: phrase matrix (without padding)
+    :type matrix: numpy.ndarray
+    :param distances: squared distances to every example (see assignment_distances)
+    :type distances: numpy.ndarray
+    :param examples: matrixes of zero distance examples (in example order)
+    :type examples: numpy.ndarray
+    :param lengths: word counts of every example
+    :type lengths: numpy.ndarray
+    :param offsets: class i examples are examples[offsets[i]:offsets[i + 1]]
+    :type offsets: numpy.ndarray
+    :param example_norms: squared norms of zero distance example rows (calculated if not given)
+    :type example_norms: numpy.ndarray|NoneType
+    :param tolerance: relative distance treated as zero
+    :type tolerance: float
+    :param brute_force_size: maximal cost matrix size minimized over every permutation with one vectorized pass
+    :type brute_force_size: int
+    :return: trimmed distances
+    :rtype: numpy.ndarray
+    """
+    result = numpy.array(distances, dtype=numpy.float64)
+    zero = numpy.nonzero(result == 0.0)[0]
+    if len(zero) == 0:
+        return result
+    if example_norms is None:
+        example_norms = (examples * examples).sum(2)
+    zero_lengths = numpy.asarray(lengths)[zero]
+    costs = assignment_cost_matrixes(matrix, examples, zero_lengths, example_norms, tolerance=tolerance)
+    labels = _word_labels(matrix, costs, example_norms, zero_lengths, tolerance)
+    classes = numpy.searchsorted(offsets, zero, side='right') - 1
+    for class_index in numpy.unique(classes):
+        members = numpy.nonzero(classes == class_index)[0]
+        start, end = offsets[class_index], offsets[class_index + 1]
+        class_labels = {int(zero[i] - start): labels[i] for i in members}
+        if not _keeps_zero(class_labels, lengths[start:end], len(matrix), examples.shape[1]):
+            for i in members:
+                result[zero[i]] = _positive_minimum(costs[i], brute_force_size)
+    return result
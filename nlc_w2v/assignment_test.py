@@ -0,0 +1,141 @@
+from itertools import permutations
+from unittest import TestCase
+import numpy
+from .assignment import assignment_distances, pruned_assignment_distances, assignment_cost_matrixes, \
+    assignment_lower_bounds, example_lengths, trimmed_zero_distances, BRUTE_FORCE_SIZE
+
+
+class AssignmentTest(TestCase):
+    @staticmethod
+    def _permutation_distance(matrix, example, length):
+        """
+        Minimal squared distance over every phrase and example permutation (like permutation mode)
+        """
+        best = numpy.inf
+        vector_size = example.shape[1]
+        for example_permutation in permutations(example):
+            example_matrix = numpy.zeros((length, vector_size))
+            example_matrix[:len(example)] = numpy.array(example_permutation).reshape((-1, vector_size))
+            for permutation in permutations(matrix):
+                part = numpy.array(permutation[:length]).reshape((-1, vector_size))
+                phrase_matrix = numpy.zeros((length, vector_size))
+                phrase_matrix[:len(part)] = part
+                diff = phrase_matrix - example_matrix
+                best = min(best, (diff * diff).sum())
+        return best
+
+    def testSameAsPermutations(self):
+        random = numpy.random.RandomState(0)
+        for _ in range(200):
+            length = random.randint(1, 5)
+            word_count = random.randint(0, 6)
+            example_length = random.randint(0, length + 1)
+            matrix = random.normal(size=(word_count, 3))
+            example = random.normal(size=(example_length, 3))
+            examples = numpy.zeros((1, length, 3))
+            examples[0, :example_length] = example
+            distance = assignment_distances(matrix, examples, numpy.array([example_length]))[0]
+            self.assertAlmostEqual(distance, self._permutation_distance(matrix, example, length))
+
+    def testBruteForceSameAsSolver(self):
+        random = numpy.random.RandomState(1)
+        for size in range(0, BRUTE_FORCE_SIZE + 1):
+            for word_count in range(0, size + 1):
+                examples = random.normal(size=(20, size, 3))
+                lengths = random.randint(0, size + 1, 20)
+                examples[numpy.arange(size)[None, :] >= lengths[:, None]] = 0.0
+                examples[0:2] = 0.0
+                examples[1, :word_count] = random.normal(size=(word_count, 3))
+                matrix = examples[1, :word_count][::-1]
+                lengths[0:2] = [0, word_count]
+                brute_force = assignment_distances(matrix, examples, lengths)
+                solved = assignment_distances(matrix, examples, lengths, brute_force_size=-1)
+                numpy.testing.assert_allclose(brute_force, solved)
+                self.assertEqual(brute_force[1], 0.0)
+
+    def testLowerBounds(self):
+        random = numpy.random.RandomState(2)
+        examples = random.normal(size=(50, 4, 3))
+        lengths = random.randint(0, 5, 50)
+        examples[numpy.arange(4)[None, :] >= lengths[:, None]] = 0.0
+        matrix = random.normal(size=(3, 3))
+        costs = assignment_cost_matrixes(matrix, examples, lengths)
+        bounds = assignment_lower_bounds(costs)
+        self.assertTrue(numpy.all(bounds <= assignment_distances(matrix, examples, lengths)))
+
+    def testPrunedSameAsExact(self):
+        random = numpy.random.RandomState(3)
+        for size in [5, 8]:
+            examples = random.normal(size=(60, size, 3))
+            lengths = random.randint(0, size + 1, 60)
+            examples[numpy.arange(size)[None, :] >= lengths[:, None]] = 0.0
+            offsets = numpy.array([0, 1, 10, 30, 60])
+            matrix = examples[12, :lengths[12]][::-1]
+            # class 0 has zero distance only, class 2 has zero and non-zero distances
+            examples[0] = examples[12]
+            lengths[0] = lengths[12]
+            exact = assignment_distances(matrix, examples, lengths)
+            pruned, solved = pruned_assignment_distances(matrix, examples, lengths, offsets)
+            self.assertLess(solved, len(examples))
+            self.assertEqual(solved, numpy.isfinite(pruned).sum())
+            numpy.testing.assert_array_equal(pruned[numpy.isfinite(pruned)], exact[numpy.isfinite(pruned)])
+            for start, end in zip(offsets[:-1], offsets[1:]):
+                nonzero = exact[start:end][exact[start:end] > 0]
+                expected = nonzero.min() if len(nonzero) > 0 else 0.0
+                found = pruned[start:end][pruned[start:end] > 0]
+                self.assertEqual(found.min() if len(found) > 0 else 0.0, expected)
+
+    @staticmethod
+    def _trimmed_permutation_distance(matrix, examples, lengths):
+        """
+        Class distance of permutation mode: minimum over phrase permutations of class distances with
+        leading and trailing zeros trimmed (example permutations in itertools.permutations order)
+        """
+        length, vector_size = examples.shape[1:]
+        rows = []
+        for example, example_length in zip(examples, lengths):
+            for example_permutation in permutations(range(example_length)):
+                row = example.copy()
+                row[:example_length] = example[list(example_permutation)]
+                rows.append(row)
+        best = numpy.inf
+        for permutation in permutations(range(len(matrix))):
+            part = numpy.zeros((length, vector_size))
+            part[:min(len(matrix), length)] = matrix[list(permutation[:length])]
+            diff_sums = numpy.trim_zeros(numpy.array([((row - part) ** 2).sum() for row in rows]).round(9))
+            # class with zero distances only isn't trimmed
+            best = min(best, diff_sums.min() if len(diff_sums) > 0 else 0.0)
+        return best
+
+    def testTrimmedSameAsPermutations(self):
+        random = numpy.random.RandomState(4)
+        # few words (with zero vector one), so phrases often equal examples and have repeated words
+        words = numpy.vstack([numpy.zeros((1, 2)), random.normal(size=(3, 2))])
+        for brute_force_size in [BRUTE_FORCE_SIZE, -1]:
+            for _ in range(100):
+                length = random.randint(1, 4)
+                lengths = random.randint(0, length + 1, random.randint(1, 4))
+                examples = words[random.randint(0, len(words), (len(lengths), length))]
+                examples[numpy.arange(length)[None, :] >= lengths[:, None]] = 0.0
+                lengths = example_lengths(examples)
+                example = random.randint(len(lengths))
+                matrix = examples[example, :lengths[example]][random.permutation(lengths[example])]
+                if random.randint(2):
+                    matrix = words[random.randint(0, len(words), random.randint(0, length + 2))]
+                distances = assignment_distances(matrix, examples, lengths)
+                distances = trimmed_zero_distances(
+                    matrix, distances, examples[distances == 0.0], lengths, numpy.array([0, len(lengths)]),
+                    brute_force_size=brute_force_size
+                )
+                self.assertAlmostEqual(distances.min(), self._trimmed_permutation_distance(matrix, examples, lengths))
+
+    def testExactMatchIsZero(self):
+        example = numpy.array([[1.0, 2.0], [3.0, 4.0], [0.0, 0.0]])
+        distance = assignment_distances(example[1::-1], example[None, :, :], numpy.array([2]))[0]
+        self.assertEqual(distance, 0.0)
+
+    def testExampleLengths(self):
+        matrixes = numpy.zeros((3, 4, 2))
+        matrixes[0, :2] = 1.0
+        matrixes[1, 2] = 1.0
+        self.assertEqual(example_lengths(matrixes).tolist(), [2, 3, 0])
@@ -0,0 +1,105 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+
+class AsyncWord2VecClassifier:
+    """
+    Asyncio front end of Word2VecClassifier.
+    Concurrent classify calls are collected for up to max_wait seconds (or until max_batch_size texts are waiting)
+    and classified with one classify_many call in executor, so event loop isn't blocked
+    and distances and confidences of batch are calculated together.
+    """
+
+    def __init__(self, classifier, max_batch_size=32, max_wait=0.002, executor=None):
+        """
+        Initialize front end
+        :param classifier: classifier
+        :type classifier: Word2VecClassifier
+        :param max_batch_size: maximal texts per classify_many call
+        :type max_batch_size: int
+        :param max_wait: maximal seconds text waits for other texts of batch
+        :type max_wait: float
+        :param executor: executor of classify_many calls (one thread executor is created if not given)
+        :type executor: concurrent.futures.Executor|NoneType
+        """
+        if max_batch_size < 1:
+            raise AttributeError("max_batch_size must be positive")
+        self.classifier = classifier
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._own_executor = executor is None
+        self.executor = executor if executor is not None else ThreadPoolExecutor(1)
+        self._pending = []
+        self._flush_handle = None
+
+    async def classify(self, text):
+        """
+        Classify text
+        :param text: text
+        :type text: str
+        :return: classes
+        :rtype: OrderedDict[str, float]
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((text, future))
+        if len(self._pending) >= self.max_batch_size:
+            self._flush(loop)
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.max_wait, self._flush, loop)
+        return await future
+
+    async def classify_many(self, texts):
+        """
+        Classify texts (they are batched with other concurrent calls)
+        :param texts: texts
+        :type texts: list[str]
+        :return: classes of every text
+        :rtype: list[OrderedDict[str, float]]
+        """
+        return list(await asyncio.gather(*[self.classify(text) for text in texts]))
+
+    def _flush(self, loop):
+        """
+        Send waiting texts to executor
+        :param loop: event loop
+        :type loop: asyncio.AbstractEventLoop
+        """
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch = [(text, future) for text, future in self._pending if not future.done()]
+        self._pending = []
+        if len(batch) == 0:
+            return
+        self.classifier.instrumentation.observe('classify.batch_size', len(batch))
+        done = loop.run_in_executor(self.executor, self.classifier.classify_many, [text for text, _ in batch])
+        done.add_done_callback(lambda result: self._resolve(batch, result))
+
+    @staticmethod
+    def _resolve(batch, done):
+        """
+        Give batch results (or error) to waiting calls
+        :param batch: texts and their futures
+        :type batch: list[tuple[str, asyncio.Future]]
+        :param done: classify_many future
+        :type done: asyncio.Future
+        """
+        error = done.exception() if not done.cancelled() else None
+        results = done.result() if not done.cancelled() and error is None else [None] * len(batch)
+        for (_, future), result in zip(batch, results):
+            if future.done():
+                continue
+            if done.cancelled():
+                future.cancel()
+            elif error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    def close(self):
+        """
+        Shut down own executor
+        """
+        if self._own_executor:
+            self.executor.shutdown()
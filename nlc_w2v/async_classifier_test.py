@@ -0,0 +1,60 @@
+import asyncio
+from collections import OrderedDict
+from unittest import TestCase
+from .async_classifier import AsyncWord2VecClassifier
+from .instrumentation import MetricsRegistry
+
+
+class _BatchRecorder:
+    """
+    Classifier stand-in recording classify_many batches
+    """
+
+    def __init__(self):
+        self.batches = []
+        self.instrumentation = MetricsRegistry()
+
+    def classify_many(self, texts):
+        self.batches.append(list(texts))
+        if "fail" in texts:
+            raise ValueError("fail")
+        return [OrderedDict([(text, 1.0)]) for text in texts]
+
+
+class AsyncClassifierTest(TestCase):
+    def _run(self, coroutine):
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(coroutine)
+        finally:
+            loop.close()
+
+    def testBatching(self):
+        recorder = _BatchRecorder()
+        classifier = AsyncWord2VecClassifier(recorder, max_batch_size=4, max_wait=0.05)
+        texts = ["text{0}".format(i) for i in range(10)]
+        results = self._run(classifier.classify_many(texts))
+        classifier.close()
+        self.assertEqual([list(result.keys()) for result in results], [[text] for text in texts])
+        self.assertEqual([len(batch) for batch in recorder.batches], [4, 4, 2])
+        self.assertEqual(recorder.instrumentation.snapshot()['classify.batch_size']['total'], 10)
+
+    def testMaxWait(self):
+        recorder = _BatchRecorder()
+        classifier = AsyncWord2VecClassifier(recorder, max_batch_size=100, max_wait=0.01)
+
+        async def classify_later():
+            first = asyncio.ensure_future(classifier.classify("a"))
+            await asyncio.sleep(0.1)
+            return await first, await classifier.classify("b")
+        first, second = self._run(classify_later())
+        classifier.close()
+        self.assertEqual(list(first.keys()), ["a"])
+        self.assertEqual(list(second.keys()), ["b"])
+        self.assertEqual(recorder.batches, [["a"], ["b"]])
+
+    def testError(self):
+        classifier = AsyncWord2VecClassifier(_BatchRecorder(), max_batch_size=2)
+        with self.assertRaises(ValueError):
+            self._run(classifier.classify_many(["ok", "fail"]))
+        classifier.close()
@@ -0,0 +1,361 @@
+"""
+Offline benchmark: synthetic random word vectors and generated class corpora,
+every stage (explode, embed, distances, solver, classify, train) is timed separately
+for every combination of phrase length, example count, class count and matching mode.
+Every case also compares classification with class matrixes stored in reduced dtypes.
+Usage: python -m nlc_w2v.benchmark [--output results.json] [--baseline old_results.json]
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy
+from .exploder import Exploder
+from .word2vec_loader import MappedWord2Vec
+from .word2vec_classifier import Word2VecClassifier, MATCHING_PERMUTATIONS, MATCHING_ASSIGNMENT
+from .quantization import STORAGE_DTYPES
+
+STAGES = ['explode', 'embed', 'distances', 'solver', 'classify', 'train']
+MATCHINGS = [MATCHING_PERMUTATIONS, MATCHING_ASSIGNMENT]
+DEFAULT_SWEEP = {
+    'phrase_lengths': [2, 4, 8],
+    'example_counts': [10, 50],
+    'class_counts': [5, 20],
+}
+
+
+def synthetic_word2vec(path, word_count=5000, vector_size=50, seed=0):
+    """
+    Write random word vectors (words are w0, w1, ...) in mapped format and open them
+    :param path: model path (without extensions)
+    :type path: str
+    :param word_count: word count
+    :type word_count: int
+    :param vector_size: vector size
+    :type vector_size: int
+    :param seed: random seed
+    :type seed: int
+    :rtype: MappedWord2Vec
+    """
+    random = numpy.random.RandomState(seed)
+    words = ['w{0}'.format(i) for i in range(word_count)]
+    MappedWord2Vec.write(words, random.normal(size=(word_count, vector_size)), path)
+    return MappedWord2Vec(path)
+
+
+def synthetic_classes(word2vec, class_count, example_count, phrase_length, seed=0):
+    """
+    Generate classes: examples of every class mostly consist of class topic words
+    :param word2vec: word vectors
+    :type word2vec: MappedWord2Vec
+    :param class_count: class count
+    :type class_count: int
+    :param example_count: examples per class
+    :type example_count: int
+    :param phrase_length: words per example
+    :type phrase_length: int
+    :param seed: random seed
+    :type seed: int
+    :rtype: dict[str, list[str]]
+    """
+    random = numpy.random.RandomState(seed)
+    words = word2vec.index2word
+    topic_size = max(phrase_length * 2, 10)
+    result = {}
+    for class_index in range(class_count):
+        topic = random.choice(len(words), topic_size, replace=False)
+        examples = []
+        for _ in range(example_count):
+            indexes = random.choice(topic, phrase_length, replace=False)
+            # every fourth word is taken from whole vocabulary
+            noise = random.uniform(size=phrase_length) < 0.25
+            indexes[noise] = random.choice(len(words), int(noise.sum()))
+            examples.append(' '.join(words[i] for i in indexes))
+        result['class{0}'.format(class_index)] = examples
+    return result
+
+
+def synthetic_phrases(word2vec, count, phrase_length, seed=1):
+    """
+    Generate random phrases
+    :param word2vec: word vectors
+    :type word2vec: MappedWord2Vec
+    :param count: phrase count
+    :type count: int
+    :param phrase_length: words per phrase
+    :type phrase_length: int
+    :param seed: random seed
+    :type seed: int
+    :rtype: list[str]
+    """
+    random = numpy.random.RandomState(seed)
+    words = word2vec.index2word
+    return [' '.join(words[i] for i in random.choice(len(words), phrase_length)) for _ in range(count)]
+
+
+def _measure(function, repeats):
+    """
+    Time function and measure its memory peak (with separate traced call)
+    :param function: function
+    :type function: callable
+    :param repeats: timed call count
+    :type repeats: int
+    :return: mean and minimal call time (seconds), allocated memory peak (bytes)
+    :rtype: dict
+    """
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    try:
+        function()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {'mean': float(numpy.mean(times)), 'min': float(numpy.min(times)), 'memory_peak': peak}
+
+
+def _max_rss():
+    """
+    Process resident memory high-water mark in bytes
+    :rtype: int
+    """
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def storage_errors(classifier, texts):
+    """
+    Compare classification of trained classifier with copies storing class matrixes in every reduced dtype
+    (same solver weights)
+    :param classifier: trained classifier (float64 storage)
+    :type classifier: Word2VecClassifier
+    :param texts: texts
+    :type texts: list[str]
+    :return: part of texts with same most confident class, maximal confidence delta and maximal relative error
+             of non-zero class distances for every reduced dtype
+    :rtype: dict[str, dict[str, float]]
+    """
+    builder = classifier.matrix_builder
+    config = dict(classifier._get_config(), word2vec=builder.word2vec, cache_size=0)
+    matrixes = [builder.words_matrix(builder.exploder.explode(text)) for text in texts]
+    expected = classifier.classify_many(texts)
+    expected_distances = classifier._assignment_distances_many(matrixes, exact=True)
+    nonzero = numpy.isfinite(expected_distances) & (expected_distances > 0)
+    result = {}
+    for dtype in STORAGE_DTYPES:
+        if dtype == classifier.storage_dtype:
+            continue
+        stored = Word2VecClassifier(**dict(config, storage_dtype=dtype))
+        actual = stored.classify_many(texts)
+        distances = stored._assignment_distances_many(matrixes, exact=True)
+        errors = numpy.abs(distances - expected_distances)[nonzero] / expected_distances[nonzero]
+        result[dtype] = {
+            'top_class_agreement': float(numpy.mean([
+                next(iter(expected_classes)) == next(iter(actual_classes))
+                for expected_classes, actual_classes in zip(expected, actual)
+            ])),
+            'confidence_delta': max(
+                abs(confidence - actual_classes[class_name])
+                for expected_classes, actual_classes in zip(expected, actual)
+                for class_name, confidence in expected_classes.items()
+            ),
+            'distance_error': float(errors.max()) if len(errors) > 0 else 0.0,
+        }
+    return result
+
+
+def benchmark_case(word2vec, class_count, example_count, phrase_length, phrases=20, repeats=3,
+                   matching=MATCHING_PERMUTATIONS):
+    """
+    Benchmark every stage for one corpus size
+    :param word2vec: word vectors
+    :type word2vec: MappedWord2Vec
+    :param class_count: class count
+    :type class_count: int
+    :param example_count: examples per class
+    :type example_count: int
+    :param phrase_length: words per example and phrase
+    :type phrase_length: int
+    :param phrases: classified phrase count
+    :type phrases: int
+    :param repeats: timed runs of every stage
+    :type repeats: int
+    :param matching: matching mode
+    :type matching: str
+    :return: case parameters, stage measurements (times are per phrase except train)
+             and reduced storage dtype errors (see storage_errors)
+    :rtype: dict
+    """
+    classes = synthetic_classes(word2vec, class_count, example_count, phrase_length)
+    texts = synthetic_phrases(word2vec, phrases, phrase_length)
+    classifier = Word2VecClassifier(word2vec=word2vec, exploder=Exploder([]), matching=matching, cache_size=0)
+    stages = {'train': _measure(lambda: classifier.train(classes), 1)}
+    builder = classifier.matrix_builder
+    exploded = [builder.exploder.explode(text) for text in texts]
+    matrixes = [builder.words_matrix(words) for words in exploded]
+    # same distance path as classify uses for one text
+    distances = [classifier._assignment_distances_many([matrix])[0] for matrix in matrixes]
+    per_phrase = {
+        'explode': lambda: [builder.exploder.explode(text) for text in texts],
+        'embed': lambda: [builder._sentence_matrix(words) for words in exploded],
+        'distances': lambda: [classifier._assignment_distances_many([matrix]) for matrix in matrixes],
+        'solver': lambda: [classifier.confidence_converter.calculate(row) for row in distances],
+        'classify': lambda: [classifier.classify(text) for text in texts],
+    }
+    for stage, function in per_phrase.items():
+        measured = _measure(function, repeats)
+        measured['mean'] /= phrases
+        measured['min'] /= phrases
+        stages[stage] = measured
+    return {
+        'class_count': class_count,
+        'example_count': example_count,
+        'phrase_length': phrase_length,
+        'matching': matching,
+        'stages': stages,
+        'storage_dtypes': storage_errors(classifier, texts),
+        'max_rss': _max_rss(),
+    }
+
+
+def run(sweep=None, word_count=5000, vector_size=50, phrases=20, repeats=3, matchings=None, verbose=False):
+    """
+    Benchmark every combination of sweep parameters
+    :param sweep: phrase_lengths, example_counts and class_counts lists (see DEFAULT_SWEEP)
+    :type sweep: dict[str, list[int]]|NoneType
+    :param word_count: synthetic vocabulary size
+    :type word_count: int
+    :param vector_size: synthetic vector size
+    :type vector_size: int
+    :param phrases: classified phrases per case
+    :type phrases: int
+    :param repeats: timed runs of every stage
+    :type repeats: int
+    :param matchings: matching modes compared side by side (None - every mode, see MATCHINGS)
+    :type matchings: list[str]|NoneType
+    :param verbose: print every case?
+    :type verbose: bool
+    :return: environment and case results
+    :rtype: dict
+    """
+    sweep = dict(DEFAULT_SWEEP, **(sweep or {}))
+    cases = []
+    with tempfile.TemporaryDirectory() as directory:
+        word2vec = synthetic_word2vec(os.path.join(directory, 'vectors'), word_count, vector_size)
+        for phrase_length, example_count, class_count, matching in itertools.product(
+                sweep['phrase_lengths'], sweep['example_counts'], sweep['class_counts'], matchings or MATCHINGS):
+            case = benchmark_case(word2vec, class_count, example_count, phrase_length, phrases, repeats, matching)
+            if verbose:
+                print(format_case(case))
+            cases.append(case)
+        del word2vec
+    return {
+        'environment': {
+            'python': platform.python_version(),
+            'numpy': numpy.__version__,
+            'machine': platform.machine(),
+            'word_count': word_count,
+            'vector_size': vector_size,
+        },
+        'cases': cases,
+    }
+
+
+def format_case(case):
+    """
+    Format case result as one line
+    :param case: case result
+    :type case: dict
+    :rtype: str
+    """
+    stages = ' '.join(
+        '{0}={1:.3g}ms/{2:.3g}MB'.format(stage, case['stages'][stage]['mean'] * 1000.0,
+                                        case['stages'][stage]['memory_peak'] / 2.0 ** 20)
+        for stage in STAGES
+    )
+    dtypes = ' '.join(
+        '{0}=top:{1:.3g}/confidence:{2:.3g}/distance:{3:.3g}'.format(
+            dtype, errors['top_class_agreement'], errors['confidence_delta'], errors['distance_error']
+        )
+        for dtype, errors in case['storage_dtypes'].items()
+    )
+    return 'classes={0} examples={1} length={2} matching={3}: {4} {5}'.format(
+        case['class_count'], case['example_count'], case['phrase_length'], case['matching'], stages, dtypes
+    )
+
+
+def compare(baseline, results, tolerance=0.25):
+    """
+    Find stages slower than in baseline (cases are matched by parameters, minimal times are compared)
+    :param baseline: baseline results (see run)
+    :type baseline: dict
+    :param results: new results
+    :type results: dict
+    :param tolerance: allowed relative slowdown
+    :type tolerance: float
+    :return: regressions (case parameters, stage, baseline and new time)
+    :rtype: list[dict]
+    """
+    def case_key(case):
+        return case['class_count'], case['example_count'], case['phrase_length'], case['matching']
+    baseline_cases = {case_key(case): case for case in baseline['cases']}
+    regressions = []
+    for case in results['cases']:
+        baseline_case = baseline_cases.get(case_key(case))
+        if baseline_case is None:
+            continue
+        for stage in STAGES:
+            old = baseline_case['stages'][stage]['min']
+            new = case['stages'][stage]['min']
+            if new > old * (1.0 + tolerance):
+                class_count, example_count, phrase_length, matching = case_key(case)
+                regressions.append({
+                    'class_count': class_count, 'example_count': example_count,
+                    'phrase_length': phrase_length, 'matching': matching,
+                    'stage': stage, 'baseline': old, 'time': new,
+                })
+    return regressions
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Offline nlc_w2v benchmark')
+    parser.add_argument('--output', help='save results to this JSON file')
+    parser.add_argument('--baseline', help='compare with results saved earlier (exit code 1 on regression)')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed relative slowdown')
+    parser.add_argument('--phrase-lengths', type=int, nargs='+', default=DEFAULT_SWEEP['phrase_lengths'])
+    parser.add_argument('--example-counts', type=int, nargs='+', default=DEFAULT_SWEEP['example_counts'])
+    parser.add_argument('--class-counts', type=int, nargs='+', default=DEFAULT_SWEEP['class_counts'])
+    parser.add_argument('--word-count', type=int, default=5000)
+    parser.add_argument('--vector-size', type=int, default=50)
+    parser.add_argument('--phrases', type=int, default=20)
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--matching', nargs='+', choices=MATCHINGS, default=MATCHINGS)
+    args = parser.parse_args(args)
+    results = run({
+        'phrase_lengths': args.phrase_lengths,
+        'example_counts': args.example_counts,
+        'class_counts': args.class_counts,
+    }, args.word_count, args.vector_size, args.phrases, args.repeats, args.matching, verbose=True)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, indent=2)
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = compare(json.load(baseline_file), results, args.tolerance)
+        for regression in regressions:
+            print('Regression: {0}'.format(regression))
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,27 @@
+import copy
+from unittest import TestCase
+from .benchmark import run, compare, STAGES
+from .word2vec_classifier import MATCHING_PERMUTATIONS, MATCHING_ASSIGNMENT
+
+
+class BenchmarkTest(TestCase):
+    def testRun(self):
+        results = run({'phrase_lengths': [3], 'example_counts': [5], 'class_counts': [2, 3]},
+                      word_count=200, vector_size=10, phrases=3, repeats=1)
+        self.assertEqual([(case['class_count'], case['matching']) for case in results['cases']], [
+            (2, MATCHING_PERMUTATIONS), (2, MATCHING_ASSIGNMENT), (3, MATCHING_PERMUTATIONS), (3, MATCHING_ASSIGNMENT)
+        ])
+        for case in results['cases']:
+            self.assertEqual(sorted(case['stages'].keys()), sorted(STAGES))
+            for stage in case['stages'].values():
+                self.assertGreater(stage['min'], 0.0)
+                self.assertGreaterEqual(stage['memory_peak'], 0)
+            self.assertEqual(sorted(case['storage_dtypes'].keys()), ['float16', 'float32', 'int8'])
+            self.assertEqual(case['storage_dtypes']['float32']['top_class_agreement'], 1.0)
+            self.assertLess(case['storage_dtypes']['float32']['distance_error'], 1e-5)
+        self.assertEqual(compare(results, results), [])
+        slower = copy.deepcopy(results)
+        slower['cases'][3]['stages']['classify']['min'] *= 2.0
+        regressions = compare(results, slower)
+        self.assertEqual([(item['class_count'], item['matching'], item['stage']) for item in regressions],
+                         [(3, MATCHING_ASSIGNMENT, 'classify')])
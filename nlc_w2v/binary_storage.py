@@ -0,0 +1,52 @@
+import json
+import os
+import numpy
+
+HEADER_FILE = 'header.json'
+
+
+def write_arrays(path, header, arrays):
+    """
+    Write JSON header and raw arrays (one .npy file per array) to directory
+    :param path: directory path
+    :type path: str
+    :param header: JSON-able header
+    :type header: dict
+    :param arrays: arrays
+    :type arrays: dict[str, numpy.ndarray]
+    """
+    os.makedirs(path, exist_ok=True)
+    for name, array in arrays.items():
+        numpy.save(os.path.join(path, name + '.npy'), numpy.ascontiguousarray(array))
+    # Header is written last, so directory without header is never read as complete model
+    with open(os.path.join(path, HEADER_FILE + '.tmp'), 'w', encoding='utf-8') as header_file:
+        json.dump(dict(header, arrays=sorted(arrays.keys())), header_file)
+    os.replace(os.path.join(path, HEADER_FILE + '.tmp'), os.path.join(path, HEADER_FILE))
+
+
+def read_header(path):
+    """
+    Read header written by write_arrays (without reading arrays)
+    :param path: directory path
+    :type path: str
+    :rtype: dict
+    """
+    with open(os.path.join(path, HEADER_FILE), encoding='utf-8') as header_file:
+        return json.load(header_file)
+
+
+def read_arrays(path, mmap=True):
+    """
+    Read header and arrays written by write_arrays
+    :param path: directory path
+    :type path: str
+    :param mmap: memory-map arrays read-only instead of reading them
+    :type mmap: bool
+    :return: header and arrays
+    :rtype: tuple[dict, dict[str, numpy.ndarray]]
+    """
+    header = read_header(path)
+    arrays = {}
+    for name in header.pop('arrays'):
+        arrays[name] = numpy.load(os.path.join(path, name + '.npy'), mmap_mode='r' if mmap else None)
+    return header, arrays
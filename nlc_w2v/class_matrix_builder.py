@@ -1,7 +1,24 @@
 from itertools import permutations
+from multiprocessing.pool import ThreadPool
+import multiprocessing
 import numpy
-from gensim.models import Word2Vec
 from .exploder import Exploder
+from .instrumentation import NULL_INSTRUMENTATION
+from .word2vec_loader import MappedWord2Vec
+
+# Index of unknown words and padding: gather gives zero vector for it
+OOV_ID = -1
+_worker_builder = None
+
+
+def _class_examples_ids(examples):
+    """
+    Process pool task: explode class examples with builder of parent process
+    :param examples: examples
+    :type examples: list[str]
+    :rtype: tuple[numpy.ndarray, numpy.ndarray, list[frozenset[str]]]
+    """
+    return _worker_builder._class_examples_ids(examples, False)
 
 
 class ClassMatrixBuilder:
@@ -21,19 +38,25 @@ class ClassMatrixBuilder:
         [SentenceWordVector, 4Vector],
       ],
     }
+    (one matrix per unique example word set, plus example word counts)
     """
+    GATHER_CHUNK_SIZE = 4096
 
     def __init__(self, word2vec, exploder):
         """
         Initialize matrix builder
         :param word2vec: word2vec model
-        :type word2vec: Word2Vec
+        :type word2vec: Word2Vec|MappedWord2Vec
         :param exploder: exploder
         :type exploder: Exploder
         """
         self.word2vec = word2vec
         self.exploder = exploder
         self.sentence_matrix_length = 0
+        self.vocabulary = set()
+        self.statistics = {}
+        self.word_cache = None
+        self.instrumentation = NULL_INSTRUMENTATION
 
     def _sentence_matrix(self, words):
         """
@@ -43,116 +66,252 @@ class ClassMatrixBuilder:
         :return: matrix of [word, wordVectorComponent]
         :rtype: numpy.ndarray
         """
-        result = []
-        for word in words:
-            try:
-                result.append(self.word2vec[word])
-            except KeyError:
-                result.append(numpy.zeros(self.word2vec.vector_size))
-        return numpy.array(result)
-
-    def _class_examples_matrix_normalize_size(self, matrixes, length, verbose):
-        """
-        Chang length of sentence matrixes to same value (by adding leading zero rows)
-        :param matrixes: sentence matrixes
-        :type matrixes: list[numpy.ndarray]
-        :param length: target length
-        :type length: int
-        :param verbose: verbose?
-        :type verbose: bool
-        :return: resized matrix
+        result = numpy.empty((len(words), self.word2vec.vector_size), dtype=self.word2vec.syn0.dtype)
+        if self.word_cache is None:
+            self._gather(self.word_ids(words), result)
+            return result
+        missing = []
+        for i, word in enumerate(words):
+            vector = self.word_cache.get(word)
+            if vector is None:
+                missing.append(i)
+            else:
+                result[i] = vector
+        if len(missing) > 0:
+            # vectors of missing words are gathered at once
+            vectors = numpy.empty((len(missing), self.word2vec.vector_size), dtype=result.dtype)
+            self._gather(self.word_ids([words[i] for i in missing]), vectors)
+            result[missing] = vectors
+            for i, vector in zip(missing, vectors):
+                self.word_cache.put(words[i], vector)
+        return result
+
+    def word_ids(self, words):
+        """
+        Get word row indexes in word2vec matrix with one vocabulary pass
+        :param words: words
+        :type words: list[str]
+        :return: indexes (OOV_ID for unknown words, see _gather)
         :rtype: numpy.ndarray
         """
-        sized_result = []
-        for i, matrix in enumerate(matrixes):
-            add_rows = length - len(matrix)
-            if verbose:
-                print("Resize base matrix for {0}/{1} example".format(i + 1, len(matrixes)))
-            if add_rows > 0:
-                empty_rows = numpy.zeros((add_rows, self.word2vec.vector_size,))
-                matrix_linear = numpy.append(matrix, empty_rows)
-                matrix = matrix_linear.reshape((length, self.word2vec.vector_size,))
-            sized_result.append(matrix)
-        return numpy.array(sized_result)
-
-    def _class_examples_matrix(self, examples, verbose):
-        """
-        Class examples matrix
+        if isinstance(self.word2vec, MappedWord2Vec):
+            vocab = self.word2vec.vocab
+            return numpy.array([vocab.get(word, OOV_ID) for word in words], dtype=numpy.int64)
+        return numpy.array([self._word_id(word) for word in words], dtype=numpy.int64)
+
+    def _word_id(self, word):
+        """
+        Get word row index in word2vec matrix
+        :param word: word
+        :type word: str
+        :return: index (OOV_ID for unknown words)
+        :rtype: int
+        """
+        entry = self.word2vec.vocab.get(word)
+        if entry is None:
+            return OOV_ID
+        elif isinstance(entry, int):
+            return entry
+        return entry.index
+
+    def _class_examples_ids(self, examples, verbose):
+        """
+        Get word indexes of every unique class example word set (words sorted),
+        word order is handled by distance calculation.
         :param examples: examples
         :type examples: list[str]
         :param verbose: verbose
         :type verbose:  bool
-        :return: example matrix (indexes - exampleNumber, wordNumber, wordVectorComponentNumber)
-        :rtype: numpy.ndarray
+        :return: word indexes (indexes - exampleNumber, wordNumber; OOV_ID for unknown words and padding),
+                 example word counts and unique example word sets
+        :rtype: tuple[numpy.ndarray, numpy.ndarray, list[frozenset[str]]]
         """
-        result = []
-        max_length = 0
-        processed = []
+        # dict keeps first occurrence order, so examples are deduplicated by hash lookups
+        processed = {}
         for i, example in enumerate(examples):
-            if verbose:
-                print("Building base matrix for {0}/{1} example".format(i + 1, len(examples)))
-            words = set(self.exploder.explode(example))
-            try:
-                processed.index(words)
-            except ValueError:
-                processed.append(words)
-                word_permutations = list(permutations(words))
-                for word_permutation in word_permutations:
-                    word_permutation_list = list(word_permutation)
-                    matrix = self._sentence_matrix(word_permutation_list)
-                    result.append(matrix)
-                    if len(matrix) > max_length:
-                        max_length = len(matrix)
-        return self._class_examples_matrix_normalize_size(
-            result, max_length, verbose
-        )
-
-    def class_sentence_matrixs(self, classes, verbose):
+            self.instrumentation.log(verbose, "Building base matrix for {0}/{1} example", i + 1, len(examples))
+            processed.setdefault(frozenset(self.exploder.explode(example)), None)
+        processed = list(processed)
+        lengths = numpy.array([len(words) for words in processed], dtype=int)
+        ids = numpy.full((len(processed), max(lengths, default=0)), OOV_ID, dtype=numpy.int64)
+        for i, words in enumerate(processed):
+            ids[i, :len(words)] = self.word_ids(sorted(words))
+        return ids, lengths, processed
+
+    def _gather(self, ids, out):
+        """
+        Write word vectors of word indexes to out with one fancy-index gather (zero rows for OOV_ID)
+        :param ids: word indexes
+        :type ids: numpy.ndarray
+        :param out: output (indexes - ids indexes..., wordVectorComponentNumber)
+        :type out: numpy.ndarray
+        """
+        # OOV_ID is never used as index: it would be last row (or IndexError if model has no words)
+        known = ids != OOV_ID
+        out[~known] = 0
+        out[known] = self.word2vec.syn0[ids[known]]
+
+    def _update_statistics(self, class_names, examples, word_sets):
+        """
+        Count skipped duplicate examples and word sets given for several classes
+        :param class_names: class names
+        :type class_names: list[str]
+        :param examples: examples of every class
+        :type examples: list[list[str]]
+        :param word_sets: unique example word sets of every class
+        :type word_sets: list[list[frozenset[str]]]
+        """
+        labels = {}
+        for class_name, class_word_sets in zip(class_names, word_sets):
+            for word_set in class_word_sets:
+                labels.setdefault(word_set, []).append(class_name)
+        conflicts = [class_labels for class_labels in labels.values() if len(class_labels) > 1]
+        class_duplicates = {
+            class_name: len(class_examples) - len(class_word_sets)
+            for class_name, class_examples, class_word_sets in zip(class_names, examples, word_sets)
+        }
+        self.statistics = {
+            'examples': sum(len(class_examples) for class_examples in examples),
+            'unique_examples': sum(len(class_word_sets) for class_word_sets in word_sets),
+            'duplicates': sum(class_duplicates.values()),
+            'class_duplicates': class_duplicates,
+            'conflicting_word_sets': len(conflicts),
+            'conflicting_examples': sum(len(class_labels) for class_labels in conflicts),
+        }
+
+    def stacked_class_matrix(self, classes, verbose, processes=1, dtype=numpy.float64):
+        """
+        Build all classes matrixes in one preallocated array of final length.
+        Examples are exploded in processes pool (forked, so workers share memory-mapped word2vec),
+        vectors are gathered by blocks of GATHER_CHUNK_SIZE examples in threads pool.
+        Duplicate and conflicting label counts are kept in statistics.
+        :param classes: classes
+        :type classes: dict[str, list[str]]
+        :param verbose: verbose
+        :type verbose: bool
+        :param processes: worker count
+        :type processes: int
+        :param dtype: matrix dtype
+        :type dtype: numpy.dtype|str
+        :return: class names (sorted), stacked example matrixes, example word counts,
+                 class offsets (class i examples are offsets[i]:offsets[i+1])
+        :rtype: tuple[list[str], numpy.ndarray, numpy.ndarray, numpy.ndarray]
+        """
+        global _worker_builder
+        class_names = sorted(classes.keys())
+        examples = [classes[class_name] for class_name in class_names]
+        self.instrumentation.log(verbose, "Exploding examples of {0} classes", len(class_names))
+        with self.instrumentation.stage('train.explode'):
+            if processes > 1:
+                _worker_builder = self
+                try:
+                    with multiprocessing.get_context('fork').Pool(processes) as pool:
+                        class_ids = pool.map(_class_examples_ids, examples)
+                finally:
+                    _worker_builder = None
+            else:
+                class_ids = [self._class_examples_ids(class_examples, verbose) for class_examples in examples]
+        length = max([ids.shape[1] for ids, _, _ in class_ids], default=0)
+        offsets = numpy.cumsum([0] + [len(ids) for ids, _, _ in class_ids])
+        ids = numpy.full((offsets[-1], length), OOV_ID, dtype=numpy.int64)
+        for i, (class_example_ids, _, _) in enumerate(class_ids):
+            ids[offsets[i]:offsets[i + 1], :class_example_ids.shape[1]] = class_example_ids
+        self.instrumentation.log(verbose, "Building matrixes of {0} examples", len(ids))
+        with self.instrumentation.stage('train.embed'):
+            matrixes = numpy.zeros((len(ids), length, self.word2vec.vector_size), dtype=dtype)
+            chunks = [(start, min(start + self.GATHER_CHUNK_SIZE, len(ids)))
+                      for start in range(0, len(ids), self.GATHER_CHUNK_SIZE)]
+            with ThreadPool(max(processes, 1)) as pool:
+                pool.map(lambda chunk: self._gather(ids[chunk[0]:chunk[1]], matrixes[chunk[0]:chunk[1]]), chunks)
+        self.instrumentation.observe('train.examples', len(ids))
+        self.instrumentation.observe('train.matrix_bytes', matrixes.nbytes)
+        self.sentence_matrix_length = length
+        self.vocabulary = set().union(*[word_set for _, _, word_sets in class_ids for word_set in word_sets])
+        self._update_statistics(class_names, examples, [word_sets for _, _, word_sets in class_ids])
+        self.instrumentation.log(verbose, "Skipped {0} duplicate examples, {1} word sets have conflicting labels",
+                                 self.statistics['duplicates'], self.statistics['conflicting_word_sets'])
+        lengths = numpy.concatenate([numpy.zeros(0, dtype=int)] + [lengths for _, lengths, _ in class_ids])
+        return class_names, matrixes, lengths, offsets
+
+    def examples_matrix(self, examples, verbose, dtype=numpy.float64, update_vocabulary=True):
+        """
+        Build matrixes of unique example word sets (for adding or removing examples of trained classes).
+        Sentence matrix length isn't changed.
+        :param examples: examples
+        :type examples: list[str]
+        :param verbose: verbose
+        :type verbose: bool
+        :param dtype: matrix dtype
+        :type dtype: numpy.dtype|str
+        :param update_vocabulary: add example words to vocabulary (e.g. not for looking up removed examples)?
+        :type update_vocabulary: bool
+        :return: example matrixes and word counts
+        :rtype: tuple[numpy.ndarray, numpy.ndarray]
+        """
+        ids, lengths, word_sets = self._class_examples_ids(examples, verbose)
+        matrixes = numpy.zeros(ids.shape + (self.word2vec.vector_size,), dtype=dtype)
+        for start in range(0, len(ids), self.GATHER_CHUNK_SIZE):
+            end = start + self.GATHER_CHUNK_SIZE
+            self._gather(ids[start:end], matrixes[start:end])
+        if update_vocabulary:
+            self.vocabulary.update(*word_sets)
+        return matrixes, lengths
+
+    def class_sentence_matrixs(self, classes, verbose, processes=1):
         """
         Build classes matrixes
         :param classes: classes
         :type classes: dict[str, list[str]]
         :param verbose: verbose
         :type verbose: bool
-        :return: matrixes
-        :rtype: dict[str, numpy.ndarray]
+        :param processes: worker count (see stacked_class_matrix)
+        :type processes: int
+        :return: matrixes and example word counts
+        :rtype: tuple[dict[str, numpy.ndarray], dict[str, numpy.ndarray]]
         """
+        class_names, matrixes, lengths, offsets = self.stacked_class_matrix(classes, verbose, processes)
         result = {}
-        lengths = []
-        for class_name, examples in classes.items():
-            if verbose:
-                print("Building base matrixes for {0}".format(class_name))
-            matrix = self._class_examples_matrix(examples, verbose)
-            shape = list(matrix.shape)[1]
-            lengths.append(shape)
-            result[class_name] = matrix
-        length = max(lengths)
-        self.sentence_matrix_length = length
-        sized_result = {}
-        for class_name, examples in result.items():
-            if verbose:
-                print("Building resized matrixes for {0}".format(class_name))
-            examples_resized = []
-            for example in examples:
-                add_rows = length - len(example)
-                if add_rows == 0:
-                    examples_resized.append(example)
-                else:
-                    empty_rows = numpy.zeros((add_rows, self.word2vec.vector_size,))
-                    example_linear = numpy.append(example, empty_rows)
-                    examples_resized.append(
-                        example_linear.reshape((length, self.word2vec.vector_size,))
-                    )
-            sized_result[class_name] = numpy.array(examples_resized)
-        return sized_result
+        result_lengths = {}
+        for i, class_name in enumerate(class_names):
+            result[class_name] = matrixes[offsets[i]:offsets[i + 1]]
+            result_lengths[class_name] = lengths[offsets[i]:offsets[i + 1]]
+        return result, result_lengths
+
+    @staticmethod
+    def permutation_matrix(matrix, lengths):
+        """
+        Expand class matrix to every word permutation of every example (as it used in permutation matching)
+        :param matrix: class matrix (indexes - exampleNumber, wordNumber, wordVectorComponentNumber)
+        :type matrix: numpy.ndarray
+        :param lengths: example word counts
+        :type lengths: numpy.ndarray
+        :return: expanded matrix
+        :rtype: numpy.ndarray
+        """
+        result = []
+        for example, length in zip(matrix, lengths):
+            for word_permutation in permutations(range(length)):
+                permuted = example.copy()
+                permuted[:length] = example[list(word_permutation)]
+                result.append(permuted)
+        return numpy.array(result).reshape((-1,) + matrix.shape[1:])
+
+    def words_matrix(self, words):
+        """
+        Get phrase matrix of exploded words
+        :param words: words
+        :type words: list[str]
+        :return: matrix of [word, wordVectorComponent]
+        :rtype: numpy.ndarray
+        """
+        return self._sentence_matrix(words)
 
     def phrase_matrix(self, text):
         """
         Get phrase matrix
         :param text: text
         :type text: str
-        :return: matrix
-        :type: list[list[float]]
+        :return: matrix of [word, wordVectorComponent]
+        :rtype: numpy.ndarray
         """
-        words = self.exploder.explode(text)
-        return self._sentence_matrix(words).tolist()
+        return self._sentence_matrix(self.exploder.explode(text))
@@ -0,0 +1,51 @@
+import os
+import tempfile
+from unittest import TestCase
+import numpy
+from .benchmark import synthetic_word2vec
+from .class_matrix_builder import ClassMatrixBuilder, OOV_ID
+from .exploder import Exploder
+from .lru_cache import LRUCache
+from .word2vec_loader import MappedWord2Vec
+
+
+class ClassMatrixBuilderTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.word2vec = synthetic_word2vec(os.path.join(self.directory.name, 'vectors'), 50, 4)
+        self.builder = ClassMatrixBuilder(self.word2vec, Exploder([]))
+
+    def tearDown(self):
+        del self.word2vec, self.builder
+        self.directory.cleanup()
+
+    def testWordIds(self):
+        self.assertEqual(self.builder.word_ids(['w3', 'unknown', 'w0']).tolist(), [3, OOV_ID, 0])
+        self.assertEqual(self.builder.word_ids([]).shape, (0,))
+
+    def testSentenceMatrix(self):
+        words = ['w3', 'unknown', 'w0', 'w3']
+        expected = numpy.zeros((4, 4), dtype=numpy.float32)
+        expected[0] = expected[3] = self.word2vec['w3']
+        expected[2] = self.word2vec['w0']
+        matrix = self.builder.words_matrix(words)
+        numpy.testing.assert_array_equal(matrix, expected)
+        self.builder.word_cache = LRUCache(10)
+        numpy.testing.assert_array_equal(self.builder.words_matrix(words), expected)
+        numpy.testing.assert_array_equal(self.builder.words_matrix(words), expected)
+        self.assertEqual(self.builder.word_cache.misses, 4)
+        self.assertEqual(self.builder.words_matrix([]).shape, (0, 4))
+        phrase = self.builder.phrase_matrix('w3 unknown w0 w3')
+        self.assertIsInstance(phrase, numpy.ndarray)
+        numpy.testing.assert_array_equal(phrase, expected)
+
+    def testEmptyModel(self):
+        path = os.path.join(self.directory.name, 'empty')
+        MappedWord2Vec.write([], numpy.zeros((0, 4)), path)
+        builder = ClassMatrixBuilder(MappedWord2Vec(path), Exploder([]))
+        numpy.testing.assert_array_equal(builder.words_matrix(['w1', 'w2']), numpy.zeros((2, 4)))
+        class_names, matrixes, lengths, _ = builder.stacked_class_matrix({'a': ['w1 w2']}, False)
+        self.assertEqual(class_names, ['a'])
+        numpy.testing.assert_array_equal(matrixes, numpy.zeros((1, 2, 4)))
+        self.assertEqual(lengths.tolist(), [2])
+        del builder
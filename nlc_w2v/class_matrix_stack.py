@@ -0,0 +1,489 @@
+import bisect
+import math
+import numpy
+from .assignment import assignment_distances, pruned_assignment_distances, trimmed_zero_distances, segment_minimums, \
+    ZERO_TOLERANCE, FLOAT32_ZERO_TOLERANCE
+from .quantization import dequantize, compute_dtype
+
+
+class ClassMatrixStack:
+    """
+    All class matrixes stacked into one array, so phrase can be compared with every example
+    of every class at once.
+    Squared distances calculated as ||a||^2 - 2ab + ||b||^2 with precomputed example norms.
+    Matrixes can be stored as float64, float32, float16 or int8 with row scales (see quantization),
+    reduced dtypes are converted to float32 by blocks of CHUNK_SIZE examples while calculating.
+    """
+    CHUNK_SIZE = 4096
+    SPARE_ROWS = 0.25
+
+    def __init__(self, class_names, matrixes, lengths, scales=None):
+        """
+        Initialize stack
+        :param class_names: class names (axis order)
+        :type class_names: list[str]
+        :param matrixes: class matrixes (in class_names order)
+        :type matrixes: list[numpy.ndarray]
+        :param lengths: example word counts (in class_names order)
+        :type lengths: list[numpy.ndarray]
+        :param scales: int8 row scales of class matrixes (in class_names order)
+        :type scales: list[numpy.ndarray]|NoneType
+        """
+        self.class_names = list(class_names)
+        self.matrixes = numpy.concatenate(matrixes)
+        self.lengths = numpy.concatenate(lengths)
+        self.offsets = numpy.cumsum([0] + [len(matrix) for matrix in matrixes])
+        self.scales = numpy.concatenate(scales) if scales is not None else None
+        self._prepare()
+
+    def _prepare(self, row_norms=None):
+        """
+        Precalculate flat view and norms
+        :param row_norms: squared norms of example rows (calculated if not given)
+        :type row_norms: numpy.ndarray|NoneType
+        """
+        self.dtype = compute_dtype(self.matrixes)
+        self.tolerance = ZERO_TOLERANCE if self.dtype == numpy.float64 else FLOAT32_ZERO_TOLERANCE
+        if row_norms is None:
+            row_norms = numpy.zeros(self.matrixes.shape[:2])
+            for start, end, chunk in self._chunks():
+                row_norms[start:end] = (chunk * chunk).sum(2)
+        self.row_norms = row_norms
+        self.norms = numpy.asarray(self.row_norms).sum(1)
+        self._signatures = None
+        self._buffers = None
+
+    @classmethod
+    def from_stacked(cls, class_names, matrixes, lengths, offsets, row_norms=None, scales=None):
+        """
+        Build stack from already stacked arrays without copying them (e.g. memory-mapped ones)
+        :param class_names: class names (axis order)
+        :type class_names: list[str]
+        :param matrixes: stacked example matrixes
+        :type matrixes: numpy.ndarray
+        :param lengths: stacked example word counts
+        :type lengths: numpy.ndarray
+        :param offsets: class offsets (class i examples are offsets[i]:offsets[i+1])
+        :type offsets: numpy.ndarray
+        :param row_norms: squared norms of example rows (calculated if not given)
+        :type row_norms: numpy.ndarray|NoneType
+        :param scales: int8 row scales
+        :type scales: numpy.ndarray|NoneType
+        :rtype: ClassMatrixStack
+        """
+        stack = cls.__new__(cls)
+        stack.class_names = list(class_names)
+        stack.matrixes = matrixes
+        stack.lengths = lengths
+        stack.offsets = numpy.asarray(offsets)
+        stack.scales = scales
+        stack._prepare(row_norms)
+        return stack
+
+    def _chunks(self, start=0, end=None):
+        """
+        Iterate over example blocks converted to compute dtype
+        :param start: first example
+        :type start: int
+        :param end: example after last
+        :type end: int|NoneType
+        :return: iterator of (block start, block end, block)
+        :rtype: collections.Iterable[tuple[int, int, numpy.ndarray]]
+        """
+        if end is None:
+            end = len(self.matrixes)
+        if self.matrixes.dtype == self.dtype:
+            chunk_size = max(end - start, 1)
+        else:
+            chunk_size = self.CHUNK_SIZE
+        for chunk_start in range(start, end, chunk_size):
+            chunk_end = min(chunk_start + chunk_size, end)
+            scales = self.scales[chunk_start:chunk_end] if self.scales is not None else None
+            yield chunk_start, chunk_end, dequantize(self.matrixes[chunk_start:chunk_end], scales)
+
+    def dequantized(self, start=0, end=None):
+        """
+        Get examples in compute dtype
+        :param start: first example
+        :type start: int
+        :param end: example after last
+        :type end: int|NoneType
+        :rtype: numpy.ndarray
+        """
+        scales = self.scales[start:end] if self.scales is not None else None
+        return dequantize(self.matrixes[start:end], scales)
+
+    @property
+    def signatures(self):
+        """
+        Summed word vectors of every example (don't depend on word order, calculated on first use)
+        :return: signatures (indexes - exampleNumber, wordVectorComponentNumber)
+        :rtype: numpy.ndarray
+        """
+        if self._signatures is None:
+            signatures = numpy.zeros((len(self.matrixes), self.matrixes.shape[2]))
+            for start, end, chunk in self._chunks():
+                signatures[start:end] = chunk.sum(1)
+            self._signatures = signatures
+        return self._signatures
+
+    @property
+    def nbytes(self):
+        """
+        Size of stack arrays (memory-mapped ones included)
+        :rtype: int
+        """
+        arrays = [self.matrixes, self.lengths, self.offsets, self.row_norms, self.norms, self.scales, self._signatures]
+        return int(sum(numpy.asarray(array).nbytes for array in arrays if array is not None))
+
+    def shortlist(self, signatures, size):
+        """
+        Get candidate examples of every phrase by summed word vectors:
+        size nearest examples and nearest example of every class (so every class has candidate)
+        :param signatures: phrase signatures (indexes - phraseNumber, wordVectorComponentNumber)
+        :type signatures: numpy.ndarray
+        :param size: nearest example count
+        :type size: int
+        :return: sorted candidate example indexes of every phrase
+        :rtype: list[numpy.ndarray]
+        """
+        example_signatures = self.signatures
+        signature_norms = (example_signatures * example_signatures).sum(1)
+        distances = signature_norms[None, :] - 2.0 * numpy.asarray(signatures, dtype=numpy.float64).dot(example_signatures.T)
+        counts = numpy.diff(self.offsets)
+        result = []
+        for row in distances:
+            if size < len(row):
+                nearest = numpy.argpartition(row, size)[:size]
+            else:
+                nearest = numpy.arange(len(row))
+            class_nearest = numpy.flatnonzero(row <= numpy.repeat(segment_minimums(row, self.offsets), counts))
+            result.append(numpy.union1d(nearest, class_nearest))
+        return result
+
+    def _row_products(self, words):
+        """
+        Get dot products of every example row and every word
+        :param words: words (indexes - wordNumber, wordVectorComponentNumber)
+        :type words: numpy.ndarray
+        :return: products (indexes - exampleNumber * wordNumber, word)
+        :rtype: numpy.ndarray
+        """
+        length, vector_size = self.matrixes.shape[1:]
+        words = numpy.asarray(words, dtype=self.dtype)
+        result = numpy.zeros((len(self.matrixes) * length, len(words)), dtype=self.dtype)
+        for start, end, chunk in self._chunks():
+            result[start * length:end * length] = chunk.reshape((-1, vector_size)).dot(words.T)
+        return result
+
+    def matrix_distances(self, matrix):
+        """
+        Get squared distances from padded sentence matrix (or matrixes) to every example
+        :param matrix: matrix (sentence matrix length rows) or matrixes (indexes - matrixNumber, wordNumber, ...)
+        :type matrix: numpy.ndarray
+        :return: squared distances (indexes - exampleNumber[, matrixNumber])
+        :rtype: numpy.ndarray
+        """
+        row_size = self.matrixes.shape[1] * self.matrixes.shape[2]
+        vectors = numpy.reshape(numpy.asarray(matrix, dtype=self.dtype), (-1, row_size))
+        vector_norms = (vectors * vectors).sum(1, dtype=numpy.float64)
+        products = numpy.zeros((len(self.matrixes), len(vectors)))
+        for start, end, chunk in self._chunks():
+            products[start:end] = chunk.reshape((-1, row_size)).dot(vectors.T)
+        result = self.norms[:, None] - 2.0 * products + vector_norms[None, :]
+        # ||a||^2 - 2ab + ||b||^2 isn't exact, so drop rounding noise to keep zero distances zero
+        result[result <= self.tolerance * (self.norms[:, None] + vector_norms[None, :])] = 0.0
+        if numpy.ndim(matrix) == 2:
+            return result[:, 0]
+        return result
+
+    def assignment_distances(self, matrix):
+        """
+        Get squared distances from phrase matrix to every example, minimized over word orderings
+        :param matrix: phrase matrix (without padding)
+        :type matrix: numpy.ndarray
+        :return: squared distances
+        :rtype: numpy.ndarray
+        """
+        return self.assignment_distances_many([matrix])[:, 0]
+
+    def assignment_distances_many(self, matrixes):
+        """
+        Get squared distances from every phrase matrix to every example, minimized over word orderings.
+        Word products of all phrases are calculated with one matrix-matrix multiplication.
+        :param matrixes: phrase matrixes (without padding)
+        :type matrixes: list[numpy.ndarray]
+        :return: squared distances (indexes - exampleNumber, phraseNumber)
+        :rtype: numpy.ndarray
+        """
+        vector_size = self.matrixes.shape[2]
+        matrixes = [numpy.reshape(numpy.asarray(matrix, dtype=self.dtype), (-1, vector_size)) for matrix in matrixes]
+        products = self._row_products(numpy.concatenate(matrixes))
+        result = numpy.zeros((len(self.matrixes), len(matrixes)))
+        start = 0
+        for i, matrix in enumerate(matrixes):
+            end = start + len(matrix)
+            result[:, i] = assignment_distances(
+                matrix, self.matrixes, self.lengths, self.row_norms, products[:, start:end], self.tolerance
+            )
+            start = end
+        return result
+
+    def pruned_assignment_distances_many(self, matrixes):
+        """
+        Get squared distances from every phrase matrix to examples which can be nearest ones of their classes
+        (see assignment.pruned_assignment_distances): abandoned examples get infinite distance,
+        so trimmed class distances (see trimmed_assignment_distances) are same as with assignment_distances_many.
+        :param matrixes: phrase matrixes (without padding)
+        :type matrixes: list[numpy.ndarray]
+        :return: squared distances (indexes - exampleNumber, phraseNumber) and solved example count of every phrase
+        :rtype: tuple[numpy.ndarray, list[int]]
+        """
+        vector_size = self.matrixes.shape[2]
+        matrixes = [numpy.reshape(numpy.asarray(matrix, dtype=self.dtype), (-1, vector_size)) for matrix in matrixes]
+        products = self._row_products(numpy.concatenate(matrixes))
+        result = numpy.zeros((len(self.matrixes), len(matrixes)))
+        solved = []
+        start = 0
+        for i, matrix in enumerate(matrixes):
+            end = start + len(matrix)
+            result[:, i], count = pruned_assignment_distances(
+                matrix, self.matrixes, self.lengths, self.offsets, self.row_norms, products[:, start:end],
+                self.tolerance
+            )
+            solved.append(count)
+            start = end
+        return result, solved
+
+    def trimmed_assignment_distances(self, matrixes, distances):
+        """
+        Trim zero distances of every phrase like permutation mode trims them (see assignment.trimmed_zero_distances),
+        so class_distances of trimmed distances are same as permutation mode class distances
+        :param matrixes: phrase matrixes (without padding)
+        :type matrixes: list[numpy.ndarray]
+        :param distances: squared distances (indexes - exampleNumber, phraseNumber; see assignment_distances_many)
+        :type distances: numpy.ndarray
+        :return: trimmed distances
+        :rtype: numpy.ndarray
+        """
+        vector_size = self.matrixes.shape[2]
+        result = numpy.array(distances, dtype=numpy.float64)
+        for i, matrix in enumerate(matrixes):
+            zero = numpy.nonzero(result[:, i] == 0.0)[0]
+            if len(zero) == 0:
+                continue
+            examples = dequantize(self.matrixes[zero], self.scales[zero] if self.scales is not None else None)
+            result[:, i] = trimmed_zero_distances(
+                numpy.reshape(numpy.asarray(matrix, dtype=self.dtype), (-1, vector_size)), result[:, i],
+                examples, self.lengths, self.offsets, self.row_norms[zero], self.tolerance
+            )
+        return result
+
+    def subset(self, indexes):
+        """
+        Get stack of given examples only (every class must keep at least one example)
+        :param indexes: sorted example indexes
+        :type indexes: numpy.ndarray
+        :rtype: ClassMatrixStack
+        """
+        return ClassMatrixStack.from_stacked(
+            self.class_names, self.matrixes[indexes], self.lengths[indexes],
+            numpy.searchsorted(indexes, self.offsets), self.row_norms[indexes],
+            self.scales[indexes] if self.scales is not None else None
+        )
+
+    def class_stack(self, index):
+        """
+        Get stack of one class (views of stacked arrays, so padded length is same)
+        :param index: class index
+        :type index: int
+        :rtype: ClassMatrixStack
+        """
+        start, end = self.offsets[index], self.offsets[index + 1]
+        return ClassMatrixStack.from_stacked(
+            [self.class_names[index]], self.matrixes[start:end], self.lengths[start:end], [0, end - start],
+            self.row_norms[start:end], self.scales[start:end] if self.scales is not None else None
+        )
+
+    def replace_class(self, class_name, matrixes, lengths, scales=None):
+        """
+        Replace class examples in place: class is added if it's new and removed if there are no examples
+        (class names are kept sorted). Examples of following classes are moved inside stack arrays,
+        which keep SPARE_ROWS share of spare rows, so arrays are reallocated only when there are no spare rows,
+        padded length grows or they are read-only (e.g. memory-mapped).
+        Norms (and signatures, if they are calculated) are calculated for given examples only.
+        :param class_name: class name
+        :type class_name: str
+        :param matrixes: class example matrixes (in storage dtype)
+        :type matrixes: numpy.ndarray
+        :param lengths: class example word counts
+        :type lengths: numpy.ndarray
+        :param scales: int8 row scales of class examples
+        :type scales: numpy.ndarray|NoneType
+        """
+        counts = numpy.diff(self.offsets).tolist()
+        if class_name in self.class_names:
+            index = self.class_names.index(class_name)
+            start, end = self.offsets[index], self.offsets[index + 1]
+        else:
+            index = bisect.bisect(self.class_names, class_name)
+            start = end = self.offsets[index]
+        count = len(self.matrixes)
+        class_end = start + len(matrixes)
+        new_count = count + class_end - end
+        length = max(self.matrixes.shape[1], matrixes.shape[1])
+        if self._buffers is None and new_count <= count and length == self.matrixes.shape[1]:
+            self._adopt()
+        if self._buffers is None or new_count > len(self._buffers['matrixes']) or length > self.matrixes.shape[1]:
+            spare = 0 if new_count <= count else int(new_count * self.SPARE_ROWS)
+            self._allocate(new_count + spare, length)
+        buffers = self._buffers
+        for buffer in buffers.values():
+            buffer[class_end:new_count] = buffer[end:count]
+        rows = dequantize(matrixes, scales)
+        class_length = matrixes.shape[1]
+        buffers['matrixes'][start:class_end] = 0
+        buffers['matrixes'][start:class_end, :class_length] = matrixes
+        buffers['lengths'][start:class_end] = lengths
+        buffers['row_norms'][start:class_end] = 0.0
+        buffers['row_norms'][start:class_end, :class_length] = (rows * rows).sum(2)
+        buffers['norms'][start:class_end] = buffers['row_norms'][start:class_end].sum(1)
+        if 'scales' in buffers:
+            buffers['scales'][start:class_end] = 0.0
+            buffers['scales'][start:class_end, :class_length] = scales
+        if 'signatures' in buffers:
+            buffers['signatures'][start:class_end] = rows.sum(1)
+        if len(matrixes) == 0:
+            if start != end:
+                del self.class_names[index]
+                del counts[index]
+        elif start == end and class_name not in self.class_names:
+            self.class_names.insert(index, class_name)
+            counts.insert(index, len(matrixes))
+        else:
+            counts[index] = len(matrixes)
+        self.offsets = numpy.cumsum([0] + counts)
+        self._set_views(new_count)
+
+    def _allocate(self, rows, length):
+        """
+        Move stack arrays to new writable buffers (replace_class changes them in place)
+        :param rows: buffer example count
+        :type rows: int
+        :param length: padded length
+        :type length: int
+        """
+        count, old_length, vector_size = self.matrixes.shape
+        arrays = {
+            'matrixes': (self.matrixes, (length, vector_size), self.matrixes.dtype),
+            'lengths': (self.lengths, (), self.lengths.dtype),
+            'row_norms': (self.row_norms, (length,), numpy.float64),
+            'norms': (self.norms, (), numpy.float64),
+        }
+        if self.scales is not None:
+            arrays['scales'] = (self.scales, (length,), numpy.float32)
+        if self._signatures is not None:
+            arrays['signatures'] = (self._signatures, (vector_size,), numpy.float64)
+        self._buffers = {}
+        for name, (array, shape, dtype) in arrays.items():
+            buffer = numpy.zeros((rows,) + shape, dtype=dtype)
+            if len(shape) > 0 and name != 'signatures':
+                buffer[:count, :old_length] = array
+            else:
+                buffer[:count] = array
+            self._buffers[name] = buffer
+        self._set_views(count)
+
+    def _adopt(self):
+        """
+        Use stack arrays as buffers if all of them are writable (so removing examples doesn't copy them)
+        """
+        arrays = {'matrixes': self.matrixes, 'lengths': self.lengths, 'row_norms': self.row_norms, 'norms': self.norms}
+        if self.scales is not None:
+            arrays['scales'] = self.scales
+        if self._signatures is not None:
+            arrays['signatures'] = self._signatures
+        if all(isinstance(array, numpy.ndarray) and array.flags.writeable for array in arrays.values()):
+            self._buffers = arrays
+
+    def _set_views(self, count):
+        """
+        Make stack arrays views of first count examples of buffers
+        :param count: example count
+        :type count: int
+        """
+        self.matrixes = self._buffers['matrixes'][:count]
+        self.lengths = self._buffers['lengths'][:count]
+        self.row_norms = self._buffers['row_norms'][:count]
+        self.norms = self._buffers['norms'][:count]
+        self.scales = self._buffers['scales'][:count] if 'scales' in self._buffers else None
+        self._signatures = self._buffers['signatures'][:count] if 'signatures' in self._buffers else None
+
+    def class_matrixes(self):
+        """
+        Get matrixes of every class (views of stacked matrix)
+        :rtype: dict[str, numpy.ndarray]
+        """
+        return {
+            class_name: self.matrixes[self.offsets[i]:self.offsets[i + 1]]
+            for i, class_name in enumerate(self.class_names)
+        }
+
+    def class_arrays(self, array):
+        """
+        Split stacked per-example array (lengths, scales) by class
+        :param array: stacked array
+        :type array: numpy.ndarray
+        :rtype: dict[str, numpy.ndarray]
+        """
+        return {
+            class_name: array[self.offsets[i]:self.offsets[i + 1]]
+            for i, class_name in enumerate(self.class_names)
+        }
+
+    def _trimmed(self, diff_sums):
+        """
+        Replace leading and trailing zeros of every class (like numpy.trim_zeros) with infinity.
+        Class with zero distances only isn't changed.
+        :param diff_sums: squared distances to every example (indexes - exampleNumber[, matrixNumber])
+        :type diff_sums: numpy.ndarray
+        :return: trimmed distances
+        :rtype: numpy.ndarray
+        """
+        nonzero = (diff_sums != 0).astype(int)
+        counts = numpy.concatenate([numpy.zeros((1,) + diff_sums.shape[1:], dtype=int), numpy.cumsum(nonzero, 0)])
+        segments = numpy.repeat(numpy.arange(len(self.class_names)), numpy.diff(self.offsets))
+        starts = self.offsets[:-1][segments]
+        ends = self.offsets[1:][segments]
+        positions = numpy.arange(len(diff_sums))
+        leading = counts[positions + 1] - counts[starts] == 0
+        trailing = counts[ends] - counts[positions] == 0
+        all_zero = counts[ends] - counts[starts] == 0
+        result = diff_sums.copy()
+        result[(leading | trailing) & ~all_zero] = numpy.inf
+        return result
+
+    def class_distances(self, diff_sums, trim_zeros=False):
+        """
+        Get distance to every class (minimal example distance, infinity for class without examples)
+        :param diff_sums: squared distances to every example (indexes - exampleNumber[, matrixNumber])
+        :type diff_sums: numpy.ndarray
+        :param trim_zeros: trim leading and trailing zero distances of every class?
+        :type trim_zeros: bool
+        :return: distances (indexes - classNumber in class_names order[, matrixNumber])
+        :rtype: numpy.ndarray
+        """
+        if trim_zeros:
+            diff_sums = self._trimmed(diff_sums)
+        return numpy.sqrt(segment_minimums(diff_sums, self.offsets))
+
+    @staticmethod
+    def permutation_lengths(lengths):
+        """
+        Get word counts of permutation-expanded class matrix
+        :param lengths: example word counts
+        :type lengths: numpy.ndarray
+        :return: expanded word counts
+        :rtype: numpy.ndarray
+        """
+        return numpy.repeat(lengths, [math.factorial(length) for length in lengths])
@@ -0,0 +1,136 @@
+import math
+from itertools import permutations
+from unittest import TestCase
+import numpy
+from .class_matrix_builder import ClassMatrixBuilder
+from .class_matrix_stack import ClassMatrixStack
+
+
+class ClassMatrixStackTest(TestCase):
+    def setUp(self):
+        random = numpy.random.RandomState(0)
+        self.matrixes = [random.normal(size=(count, 3, 2)) for count in (4, 1, 6)]
+        self.lengths = [numpy.full(len(matrix), 3) for matrix in self.matrixes]
+        self.stack = ClassMatrixStack(['a', 'b', 'c'], self.matrixes, self.lengths)
+
+    def _loop_distances(self, matrix):
+        result = []
+        for class_matrix in self.matrixes:
+            diffs = class_matrix - matrix
+            diff_sums = numpy.trim_zeros(numpy.sum(diffs * diffs, (1, 2,)))
+            result.append(math.sqrt(diff_sums.min()))
+        return result
+
+    def testSameAsLoop(self):
+        matrix = numpy.random.RandomState(1).normal(size=(3, 2))
+        distances = self.stack.class_distances(self.stack.matrix_distances(matrix), trim_zeros=True)
+        numpy.testing.assert_allclose(distances, self._loop_distances(matrix))
+
+    def testTrimZeros(self):
+        for i in (0, 2, 5):
+            matrix = self.matrixes[2][i]
+            distances = self.stack.class_distances(self.stack.matrix_distances(matrix), trim_zeros=True)
+            numpy.testing.assert_allclose(distances, self._loop_distances(matrix))
+        distances = self.stack.class_distances(self.stack.matrix_distances(self.matrixes[1][0]), trim_zeros=True)
+        self.assertEqual(distances[1], 0.0)
+
+    @staticmethod
+    def _permutation_distances(matrixes, lengths, matrix):
+        """
+        Class distances of permutation mode: minimum over phrase permutations with trimmed zeros
+        """
+        stack = ClassMatrixStack(
+            [str(i) for i in range(len(matrixes))],
+            [ClassMatrixBuilder.permutation_matrix(item, length) for item, length in zip(matrixes, lengths)],
+            [ClassMatrixStack.permutation_lengths(length) for length in lengths]
+        )
+        parts = numpy.zeros((math.factorial(len(matrix)),) + matrixes[0].shape[1:])
+        for i, permutation in enumerate(permutations(range(len(matrix)))):
+            parts[i, :len(matrix)] = matrix[list(permutation)]
+        return stack.class_distances(stack.matrix_distances(parts), trim_zeros=True).min(1)
+
+    def testEmptyClass(self):
+        empty = numpy.zeros((0, 3, 2))
+        stack = ClassMatrixStack(['a', 'b', 'c', 'd', 'e'],
+                                 [self.matrixes[0], empty, self.matrixes[1], self.matrixes[2], empty],
+                                 [self.lengths[0], numpy.zeros(0, dtype=int), self.lengths[1], self.lengths[2],
+                                  numpy.zeros(0, dtype=int)])
+        for matrix in [numpy.random.RandomState(1).normal(size=(3, 2)), self.matrixes[2][5]]:
+            distances = stack.class_distances(stack.matrix_distances(matrix), trim_zeros=True)
+            numpy.testing.assert_allclose(distances[[0, 2, 3]], self._loop_distances(matrix))
+            self.assertEqual(distances[[1, 4]].tolist(), [numpy.inf, numpy.inf])
+            pruned, _ = stack.pruned_assignment_distances_many([matrix])
+            numpy.testing.assert_allclose(stack.class_distances(pruned)[[0, 2, 3], 0],
+                                          stack.class_distances(stack.assignment_distances_many([matrix]))[[0, 2, 3], 0])
+        batch = stack.class_distances(stack.matrix_distances(self.matrixes[0][:2]))
+        self.assertEqual(batch.shape, (5, 2))
+        self.assertTrue(numpy.isinf(batch[[1, 4]]).all())
+        shortlist = stack.shortlist(stack.signatures[[0]], 2)[0]
+        self.assertEqual(sorted(set((numpy.searchsorted(stack.offsets, shortlist, side='right') - 1).tolist())),
+                         [0, 2, 3])
+
+    def testTrimmedAssignment(self):
+        pair = numpy.zeros((1, 3, 2))
+        pair[0, :2] = self.matrixes[0][0, :2]
+        matrixes = self.matrixes + [pair]
+        lengths = self.lengths + [numpy.array([2])]
+        stack = ClassMatrixStack(['a', 'b', 'c', 'd'], matrixes, lengths)
+        for matrix in [self.matrixes[0][2], self.matrixes[1][0][::-1], self.matrixes[2][5][:2], pair[0, 1::-1]]:
+            expected = self._permutation_distances(matrixes, lengths, matrix)
+            trimmed = stack.trimmed_assignment_distances([matrix], stack.assignment_distances_many([matrix]))
+            numpy.testing.assert_allclose(stack.class_distances(trimmed)[:, 0], expected)
+        # both permutations of only example are leading or trailing zeros
+        self.assertGreater(expected[3], 0.0)
+        self.assertEqual(self._permutation_distances(matrixes, lengths, self.matrixes[1][0])[1], 0.0)
+
+    def testReplaceClass(self):
+        random = numpy.random.RandomState(2)
+        longer = random.normal(size=(2, 4, 2))
+        stack = self.stack
+        stack.signatures
+        matrixes = stack.matrixes
+        matrixes.flags.writeable = False
+        stack.replace_class('ab', longer, numpy.array([4, 2]))
+        expected = ClassMatrixStack(
+            ['a', 'ab', 'b', 'c'],
+            [numpy.pad(self.matrixes[0], ((0, 0), (0, 1), (0, 0))), longer,
+             numpy.pad(self.matrixes[1], ((0, 0), (0, 1), (0, 0))), numpy.pad(self.matrixes[2], ((0, 0), (0, 1), (0, 0)))],
+            [self.lengths[0], numpy.array([4, 2]), self.lengths[1], self.lengths[2]]
+        )
+        # read-only arrays aren't changed
+        numpy.testing.assert_array_equal(matrixes, numpy.concatenate(self.matrixes))
+        self.assertEqual(stack.class_names, expected.class_names)
+        numpy.testing.assert_array_equal(stack.matrixes, expected.matrixes)
+        numpy.testing.assert_array_equal(stack.lengths, expected.lengths)
+        numpy.testing.assert_array_equal(stack.offsets, expected.offsets)
+        numpy.testing.assert_allclose(stack.row_norms, expected.row_norms)
+        numpy.testing.assert_allclose(stack.norms, expected.norms)
+        numpy.testing.assert_allclose(stack.signatures, expected.signatures)
+        # spare rows are used, removed examples are moved in place
+        buffer = stack.matrixes.base
+        stack.replace_class('b', self.matrixes[1][:0], numpy.zeros(0, dtype=int))
+        stack.replace_class('ab', longer[:1], numpy.array([4]))
+        self.assertIs(stack.matrixes.base, buffer)
+        self.assertEqual(stack.class_names, ['a', 'ab', 'c'])
+        numpy.testing.assert_array_equal(stack.offsets, [0, 4, 5, 11])
+        numpy.testing.assert_array_equal(stack.matrixes[4], longer[0])
+        numpy.testing.assert_array_equal(stack.matrixes[5:, :3], self.matrixes[2])
+        numpy.testing.assert_allclose(stack.norms[5:], (self.matrixes[2] ** 2).sum((1, 2)))
+        numpy.testing.assert_allclose(stack.signatures[5:], self.matrixes[2].sum(1))
+        one = stack.class_stack(2)
+        self.assertEqual(one.class_names, ['c'])
+        numpy.testing.assert_allclose(
+            one.class_distances(one.matrix_distances(stack.matrixes[0]), trim_zeros=True),
+            stack.class_distances(stack.matrix_distances(stack.matrixes[0]), trim_zeros=True)[2:]
+        )
+
+    def testShortlist(self):
+        numpy.testing.assert_allclose(self.stack.signatures[4], self.matrixes[1][0].sum(0))
+        signatures = self.stack.signatures[[2, 7]]
+        shortlists = self.stack.shortlist(signatures, 2)
+        for signatures_index, shortlist in zip([2, 7], shortlists):
+            self.assertIn(signatures_index, shortlist)
+            classes = numpy.searchsorted(self.stack.offsets, shortlist, side='right') - 1
+            self.assertEqual(sorted(set(classes.tolist())), [0, 1, 2])
+            self.assertLessEqual(len(shortlist), 2 + 3)
+        self.assertEqual(len(self.stack.shortlist(signatures, 100)[0]), 11)
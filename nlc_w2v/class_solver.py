@@ -1,5 +1,4 @@
 import math
-import keras
 import numpy
 
 
@@ -10,20 +9,26 @@ class ClassSolver:
     preconfidence(class_weights) = class_weights[0] + sum(class_distance[i] * class_weights[i+1])
     preconfidence(FAKE) = 0.1
     confidence = preconfidence.normal() ^ 4
+    Keras model is used (and imported) for training only, confidences are calculated with NumPy
+    from model weights.
     """
     _FAKE_LEN = 0.1
+    _HIDDEN_PER_CLASS = 10
 
     def __init__(self, class_count, weights=None):
         """
         Initialize new empty solver
         :param class_count: class count
         :type class_count: int
+        :param weights: model weights (see weights)
+        :type weights: list[numpy.ndarray]|NoneType
         """
         self.class_count = 0
-        self.model = keras.models.Sequential()
+        self._model = None
+        self._weights = None
         self.resize(class_count)
         if weights is not None:
-            self.model.weights = weights
+            self.weights = [numpy.asarray(item) for item in weights]
 
     def resize(self, class_count):
         """
@@ -32,19 +37,99 @@ class ClassSolver:
         :type class_count: int
         """
         self.class_count = class_count
-        self.model.layers.clear()
-        if class_count > 0:
-            self.model.add(keras.layers.Dense(10 * self.class_count, input_shape=(self.class_count,), activation='softmax'))
-            self.model.add(keras.layers.Dense(self.class_count, activation='softmax'))
-            self.model.compile('sgd', 'mse', metrics=['accuracy'])
+        self._model = None
+        self._weights = None
+
+    @property
+    def model(self):
+        """
+        Keras model (built on first use with current weights)
+        :rtype: keras.models.Sequential
+        """
+        if self._model is None:
+            import keras
+            self._model = keras.models.Sequential()
+            if self.class_count > 0:
+                self._model.add(keras.layers.Dense(ClassSolver._HIDDEN_PER_CLASS * self.class_count, input_shape=(self.class_count,), activation='softmax'))
+                self._model.add(keras.layers.Dense(self.class_count, activation='softmax'))
+                self._model.compile('sgd', 'mse', metrics=['accuracy'])
+                if self._weights is not None:
+                    self._model.set_weights(self._weights)
+        return self._model
+
+    def remap(self, class_indexes):
+        """
+        Resize solver keeping weights of remaining classes, so next train continues from them.
+        Hidden layer has _HIDDEN_PER_CLASS units per class, units of remaining classes are kept too,
+        weights of new classes are initialized as by resize.
+        :param class_indexes: old index of every new class (-1 for new class)
+        :type class_indexes: list[int]
+        """
+        old_weights = self.weights if self.class_count > 0 else None
+        self.resize(len(class_indexes))
+        if old_weights is None or self.class_count == 0:
+            return
+        class_indexes = numpy.asarray(class_indexes, dtype=int)
+        kept = numpy.flatnonzero(class_indexes >= 0)
+        old = class_indexes[kept]
+        hidden = numpy.arange(ClassSolver._HIDDEN_PER_CLASS)
+        kept_units = (kept[:, None] * ClassSolver._HIDDEN_PER_CLASS + hidden[None, :]).ravel()
+        old_units = (old[:, None] * ClassSolver._HIDDEN_PER_CLASS + hidden[None, :]).ravel()
+        weights = self.weights
+        weights[0][numpy.ix_(kept, kept_units)] = old_weights[0][numpy.ix_(old, old_units)]
+        weights[1][kept_units] = old_weights[1][old_units]
+        weights[2][numpy.ix_(kept_units, kept)] = old_weights[2][numpy.ix_(old_units, old)]
+        weights[3][kept] = old_weights[3][old]
+        self.weights = weights
 
     @property
     def weights(self):
-        return self.model.get_weights()
+        """
+        Model weights (first layer kernel and bias, second layer kernel and bias)
+        :rtype: list[numpy.ndarray]
+        """
+        if self._weights is None:
+            self._weights = self.model.get_weights()
+        return [item.copy() for item in self._weights]
 
     @weights.setter
-    def _set_weights(self, weights):
-        self.model.set_weights(weights)
+    def weights(self, weights):
+        self._weights = [numpy.asarray(item) for item in weights]
+        if self._model is not None:
+            self._model.set_weights(self._weights)
+
+    @property
+    def nbytes(self):
+        """
+        Size of weights known without building model
+        :rtype: int
+        """
+        return int(sum(item.nbytes for item in self._weights)) if self._weights is not None else 0
+
+    @staticmethod
+    def _softmax(values):
+        """
+        Softmax of every row
+        :param values: values (indexes - rowNumber, unitNumber)
+        :type values: numpy.ndarray
+        :rtype: numpy.ndarray
+        """
+        exponents = numpy.exp(values - values.max(1)[:, None])
+        return exponents / exponents.sum(1)[:, None]
+
+    def predict(self, distances):
+        """
+        Calculate model outputs (two dense softmax layers) with NumPy
+        :param distances: class distances (indexes - rowNumber, classNumber)
+        :type distances: numpy.ndarray
+        :return: outputs (indexes - rowNumber, classNumber)
+        :rtype: numpy.ndarray
+        """
+        if self._weights is None:
+            self._weights = self.model.get_weights()
+        kernel1, bias1, kernel2, bias2 = self._weights
+        hidden = self._softmax(numpy.asarray(distances, dtype=numpy.float64).dot(kernel1) + bias1)
+        return self._softmax(hidden.dot(kernel2) + bias2)
 
     def calculate(self, distances):
         """
@@ -59,10 +144,21 @@ class ClassSolver:
         :return: confidences
         :rtype: numpy.ndarray
         """
-        predicted = self.model.predict(numpy.array([distances]))[0]
+        return self.calculate_many(numpy.array([distances]))[0]
+
+    def calculate_many(self, distances):
+        """
+        Get calculated confidences for batch of distance vectors (see calculate)
+        with one model prediction.
+        :param distances: class distances (indexes - rowNumber, classNumber)
+        :type distances: numpy.ndarray
+        :return: confidences (indexes - rowNumber, classNumber)
+        :rtype: numpy.ndarray
+        """
+        predicted = self.predict(distances)
         vec = predicted * predicted
-        size = numpy.linalg.norm(vec) + math.pow(ClassSolver._FAKE_LEN, 2.0)
-        return vec / size
+        size = numpy.linalg.norm(vec, axis=1) + math.pow(ClassSolver._FAKE_LEN, 2.0)
+        return vec / size[:, None]
 
     def _calculate_class(self, distances, class_index):
         """
@@ -107,6 +203,7 @@ class ClassSolver:
         :type verbose: bool
         """
         self.model.fit(distances, confidences, verbose={True: 1, False: 0}[verbose])
+        self._weights = self.model.get_weights()
 
     @property
     def config(self):
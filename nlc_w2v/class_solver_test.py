@@ -33,3 +33,34 @@ class ClassSolverTest(TestCase):
             self.assertTrue(
                 abs(y2_real - y2_approx) < 0.3
             )
+
+    def testCalculateMany(self):
+        distances = numpy.array([[i / 10.0, 1.0 - i / 10.0] for i in range(0, 10)])
+        confidences = self.solver.calculate_many(distances)
+        self.assertEqual(confidences.shape, (10, 2))
+        for row, row_confidences in zip(distances, confidences):
+            numpy.testing.assert_allclose(self.solver.calculate(row), row_confidences, rtol=1e-5)
+
+    def testRemap(self):
+        distances = numpy.array([[0.1, 0.9], [0.8, 0.3]])
+        weights = self.solver.weights
+        self.solver.remap([1, -1, 0])
+        self.assertEqual(self.solver.class_count, 3)
+        remapped = self.solver.weights
+        self.assertEqual(remapped[0].shape, (3, 30))
+        numpy.testing.assert_allclose(remapped[0][0, :10], weights[0][1, 10:])
+        numpy.testing.assert_allclose(remapped[0][2, 20:], weights[0][0, :10])
+        numpy.testing.assert_allclose(remapped[2][20:, 0], weights[2][:10, 1])
+        numpy.testing.assert_allclose(remapped[3][[0, 2]], weights[3][[1, 0]])
+        self.solver.remap([2, 0])
+        restored = self.solver.weights
+        for item, restored_item in zip(weights, restored):
+            numpy.testing.assert_allclose(item, restored_item)
+        self.assertEqual(self.solver.calculate_many(distances).shape, (2, 2))
+
+    def testNumpyForward(self):
+        distances = numpy.random.RandomState(0).uniform(size=(20, 2))
+        numpy.testing.assert_allclose(self.solver.predict(distances), self.solver.model.predict(distances), rtol=1e-5)
+        loaded = ClassSolver(**self.solver.config)
+        numpy.testing.assert_allclose(loaded.calculate_many(distances), self.solver.calculate_many(distances))
+        self.assertIsNone(loaded._model)
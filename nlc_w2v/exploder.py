@@ -1,3 +1,6 @@
+import re
+
+
 class Exploder:
     """
     Words extractor
@@ -14,6 +17,35 @@ class Exploder:
         self.stop_words = stop_words
         self.delimeters = delimeters
 
+    @property
+    def stop_words(self):
+        """
+        Stop words
+        :rtype: list[str]
+        """
+        return self._stop_words
+
+    @stop_words.setter
+    def stop_words(self, stop_words):
+        self._stop_words = stop_words
+        self._stop_words_set = frozenset(stop_words)
+
+    @property
+    def delimeters(self):
+        """
+        Delimeter chars
+        :rtype: str
+        """
+        return self._delimeters
+
+    @delimeters.setter
+    def delimeters(self, delimeters):
+        self._delimeters = delimeters
+        if delimeters:
+            self._word_regex = re.compile("[^" + "".join(re.escape(char) for char in delimeters) + "]+")
+        else:
+            self._word_regex = re.compile(".+", re.DOTALL)
+
     def explode(self, text):
         """
         Explode text
@@ -22,11 +54,5 @@ class Exploder:
         :return: words
         :rtype: list[str]
         """
-        items = [""]
-        for char in text.lower():
-            if char in self.delimeters:
-                items.append("")
-            else:
-                items[-1] += char
-        items = [item for item in items if item != ""]
-        return [item for item in items if item not in self.stop_words]
+        stop_words = self._stop_words_set
+        return [item for item in self._word_regex.findall(text.lower()) if item not in stop_words]
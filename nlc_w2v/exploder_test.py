@@ -1,4 +1,5 @@
 import unittest
+from random import Random
 from .exploder import Exploder
 
 
@@ -74,3 +75,51 @@ class ExploderTest(unittest.TestCase):
         exploder = Exploder(stop_words)
         self.assertEqual(exploder.explode("So, what you can do?"),
                          ["what", "can", "do"])
+
+    @staticmethod
+    def _reference_explode(exploder, text):
+        """
+        Per-character implementation, which explode must stay equal to
+        """
+        items = [""]
+        for char in text.lower():
+            if char in exploder.delimeters:
+                items.append("")
+            else:
+                items[-1] += char
+        items = [item for item in items if item != ""]
+        return [item for item in items if item not in exploder.stop_words]
+
+    def test_regression_corpus(self):
+        corpus = [
+            "",
+            "   ",
+            "So, what you can do?",
+            "Hello,World!!  multiple   spaces\tand\ttabs\r\nnew lines",
+            "e-mail: user_name@example.com; path C:\\dir\\file.txt [x]{y}(z)",
+            "№5 costs $10 & 5% off ^^ ~tilde `tick` \"quoted\" <tag> a|b a/b a+b a=b",
+            "Don't STOP me now... it's THE end",
+            "Привет, мир! Как дела?",
+            "ÄÖÜ straße İstanbul ΣΊΣΥΦΟΣ",
+            "tokens-with-dashes_and_underscores",
+            "trailing delimeters,,,",
+            ",,,leading delimeters",
+            "emoji 🙂 between words",
+        ]
+        exploders = [
+            Exploder(["the", "it's", "me", "what", "don't", "a"]),
+            Exploder([], delimeters=" ]^-\\"),
+            Exploder(["x"], delimeters=""),
+        ]
+        random = Random(0)
+        alphabet = "abcXYZ ,.-_\t\n№'ß]^\\[" + "ДЖ"
+        for _ in range(500):
+            corpus.append("".join(random.choice(alphabet) for _ in range(random.randint(0, 30))))
+        for exploder in exploders:
+            for text in corpus:
+                self.assertEqual(exploder.explode(text), self._reference_explode(exploder, text), text)
+
+    def test_changing_stop_words(self):
+        exploder = Exploder(["what"])
+        exploder.stop_words = ["can"]
+        self.assertEqual(exploder.explode("So, what you can do?"), ["so", "what", "you", "do"])
@@ -0,0 +1,26 @@
+import json
+import os
+import subprocess
+import sys
+from unittest import TestCase
+
+IMPORT_TIME_BUDGET = 1.0
+HEAVY_MODULES = ['keras', 'theano', 'tensorflow', 'gensim', 'scipy.optimize']
+_IMPORT_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import nlc_w2v
+elapsed = time.perf_counter() - start
+print(json.dumps({'time': elapsed, 'modules': [name for name in %r if name in sys.modules]}))
+""" % HEAVY_MODULES
+
+
+class ImportTest(TestCase):
+    def testImport(self):
+        package_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        environment = dict(os.environ, PYTHONPATH=os.pathsep.join([package_root] + sys.path))
+        output = subprocess.check_output([sys.executable, "-c", _IMPORT_SCRIPT], env=environment)
+        result = json.loads(output.decode('utf-8').strip().split('\n')[-1])
+        print("nlc_w2v import time {0:.3f}s".format(result['time']))
+        self.assertEqual(result['modules'], [])
+        self.assertLess(result['time'], IMPORT_TIME_BUDGET)
@@ -0,0 +1,140 @@
+import threading
+import time
+
+
+class _NullStage:
+    """
+    Stage context which does nothing
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+class Instrumentation:
+    """
+    Classification and training hooks. This one records nothing (so disabled instrumentation costs
+    one method call per hook) and prints log messages of verbose calls only.
+    Stages are named like 'classify.distances', values like 'classify.cache_hits'.
+    """
+    enabled = False
+
+    def stage(self, name):
+        """
+        Context measuring stage
+        :param name: stage name
+        :type name: str
+        :return: context manager
+        """
+        return _NULL_STAGE
+
+    def observe(self, name, value):
+        """
+        Record value (count, size)
+        :param name: value name
+        :type name: str
+        :param value: value
+        :type value: float
+        """
+        pass
+
+    def log(self, verbose, message, *args):
+        """
+        Log progress message
+        :param verbose: print message?
+        :type verbose: bool
+        :param message: message format (see str.format)
+        :type message: str
+        :param args: format arguments
+        """
+        if verbose:
+            print(message.format(*args))
+
+
+NULL_INSTRUMENTATION = Instrumentation()
+
+
+class _Stage:
+    """
+    Stage context recording elapsed time to registry
+    """
+
+    def __init__(self, registry, name):
+        self.registry = registry
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.registry.observe(self.name + '.seconds', time.perf_counter() - self.start)
+        return False
+
+
+class MetricsRegistry(Instrumentation):
+    """
+    Instrumentation collecting count, total, minimum and maximum of every value
+    (stage times are recorded as '<stage>.seconds') and passing every observation to callbacks
+    """
+    enabled = True
+
+    def __init__(self, callbacks=None, log_messages=False):
+        """
+        Initialize registry
+        :param callbacks: functions called with value name and value on every observation
+        :type callbacks: list[callable]|NoneType
+        :param log_messages: pass log messages of non-verbose calls to callbacks too (as 'log' observations)?
+        :type log_messages: bool
+        """
+        self.callbacks = list(callbacks or [])
+        self.log_messages = log_messages
+        self.metrics = {}
+        self._lock = threading.Lock()
+
+    def stage(self, name):
+        return _Stage(self, name)
+
+    def observe(self, name, value):
+        with self._lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                self.metrics[name] = {'count': 1, 'total': value, 'min': value, 'max': value}
+            else:
+                metric['count'] += 1
+                metric['total'] += value
+                metric['min'] = min(metric['min'], value)
+                metric['max'] = max(metric['max'], value)
+        for callback in self.callbacks:
+            callback(name, value)
+
+    def log(self, verbose, message, *args):
+        if verbose or self.log_messages:
+            text = message.format(*args)
+            if verbose:
+                print(text)
+            for callback in self.callbacks:
+                callback('log', text)
+
+    def snapshot(self):
+        """
+        Get copy of collected metrics
+        :return: metric name - count, total, min, max
+        :rtype: dict[str, dict[str, float]]
+        """
+        with self._lock:
+            return {name: dict(metric) for name, metric in self.metrics.items()}
+
+    def reset(self):
+        """
+        Remove collected metrics
+        """
+        with self._lock:
+            self.metrics.clear()
@@ -0,0 +1,32 @@
+from unittest import TestCase
+from .instrumentation import MetricsRegistry, NULL_INSTRUMENTATION
+
+
+class InstrumentationTest(TestCase):
+    def testRegistry(self):
+        observed = []
+        registry = MetricsRegistry([lambda name, value: observed.append((name, value))])
+        with registry.stage('classify'):
+            registry.observe('classify.words', 3)
+            registry.observe('classify.words', 5)
+        metrics = registry.snapshot()
+        self.assertEqual(metrics['classify.words'], {'count': 2, 'total': 8, 'min': 3, 'max': 5})
+        self.assertEqual(metrics['classify.seconds']['count'], 1)
+        self.assertGreaterEqual(metrics['classify.seconds']['total'], 0.0)
+        self.assertEqual([name for name, _ in observed], ['classify.words', 'classify.words', 'classify.seconds'])
+        registry.reset()
+        self.assertEqual(registry.snapshot(), {})
+
+    def testLog(self):
+        observed = []
+        registry = MetricsRegistry([lambda name, value: observed.append((name, value))])
+        registry.log(False, "Building fit {0} of {1}", 1, 2)
+        self.assertEqual(observed, [])
+        registry.log_messages = True
+        registry.log(False, "Building fit {0} of {1}", 1, 2)
+        self.assertEqual(observed, [('log', "Building fit 1 of 2")])
+
+    def testNull(self):
+        with NULL_INSTRUMENTATION.stage('classify'):
+            NULL_INSTRUMENTATION.observe('classify.words', 3)
+        self.assertFalse(NULL_INSTRUMENTATION.enabled)
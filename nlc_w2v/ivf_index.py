@@ -0,0 +1,258 @@
+import math
+import numpy
+
+
+class IVFIndex:
+    """
+    Inverted file index over class examples.
+    Examples of every class are clustered (k-means) by their summed word vectors (which don't depend on word order),
+    search gives examples of probes nearest clusters of every class, so every class gets candidates
+    and exact distances are calculated only for them.
+    More probes - better recall, slower search. probes >= clusters count gives exact search.
+    """
+    # Changed class is clustered again if its desired list count differs from current one more than this times
+    LIST_COUNT_SLACK = 2.0
+    # or some centroid moved further than this times mean squared distance from class examples to their centroids
+    MAX_DRIFT = 1.0
+
+    def __init__(self, centroids, centroid_classes, list_offsets, list_examples):
+        """
+        Initialize index
+        :param centroids: cluster centroids (sorted by class)
+        :type centroids: numpy.ndarray
+        :param centroid_classes: class index of every centroid
+        :type centroid_classes: numpy.ndarray
+        :param list_offsets: cluster i examples are list_examples[list_offsets[i]:list_offsets[i + 1]]
+        :type list_offsets: numpy.ndarray
+        :param list_examples: example indexes (in stack) grouped by cluster
+        :type list_examples: numpy.ndarray
+        """
+        self.centroids = numpy.asarray(centroids)
+        self.centroid_classes = numpy.asarray(centroid_classes)
+        self.list_offsets = numpy.asarray(list_offsets)
+        self.list_examples = numpy.asarray(list_examples)
+        self.centroid_norms = (self.centroids * self.centroids).sum(1)
+        self.class_offsets = numpy.searchsorted(
+            self.centroid_classes, numpy.arange(self.centroid_classes.max() + 2 if len(self.centroid_classes) else 1)
+        )
+
+    @staticmethod
+    def signatures(matrixes):
+        """
+        Get example signatures (summed word vectors)
+        :param matrixes: sentence matrixes (indexes - matrixNumber, wordNumber, wordVectorComponentNumber)
+        :type matrixes: numpy.ndarray
+        :rtype: numpy.ndarray
+        """
+        return numpy.asarray(matrixes).sum(1)
+
+    @staticmethod
+    def _kmeans(points, count, iterations, random):
+        """
+        Cluster points with Lloyd's algorithm
+        :param points: points
+        :type points: numpy.ndarray
+        :param count: cluster count
+        :type count: int
+        :param iterations: iteration count
+        :type iterations: int
+        :param random: random state
+        :type random: numpy.random.RandomState
+        :return: centroids and point clusters (empty clusters are removed)
+        :rtype: tuple[numpy.ndarray, numpy.ndarray]
+        """
+        centroids = points[random.choice(len(points), count, replace=False)]
+        labels = numpy.zeros(len(points), dtype=int)
+        point_norms = (points * points).sum(1)
+        for _ in range(iterations):
+            distances = point_norms[:, None] - 2.0 * points.dot(centroids.T) + (centroids * centroids).sum(1)[None, :]
+            labels = distances.argmin(1)
+            sums = numpy.zeros_like(centroids)
+            numpy.add.at(sums, labels, points)
+            counts = numpy.bincount(labels, minlength=count)
+            filled = counts > 0
+            centroids[filled] = sums[filled] / counts[filled][:, None]
+        used, labels = numpy.unique(labels, return_inverse=True)
+        return centroids[used], labels
+
+    @classmethod
+    def _cluster(cls, signatures, list_size, iterations, random):
+        """
+        Cluster class examples
+        :param signatures: class example signatures
+        :type signatures: numpy.ndarray
+        :param list_size: desired examples per cluster
+        :type list_size: int
+        :param iterations: k-means iterations
+        :type iterations: int
+        :param random: random state
+        :type random: numpy.random.RandomState
+        :return: centroids and examples of every cluster (indexes in class)
+        :rtype: tuple[numpy.ndarray, list[numpy.ndarray]]
+        """
+        count = max(1, int(math.ceil(len(signatures) / float(list_size))))
+        centroids, labels = cls._kmeans(signatures, count, iterations, random)
+        return centroids, [numpy.flatnonzero(labels == list_index) for list_index in range(len(centroids))]
+
+    @classmethod
+    def _assemble(cls, class_lists):
+        """
+        Make index of clusters of every class
+        :param class_lists: centroids and examples of every cluster (indexes in stack) of every class
+        :type class_lists: list[tuple[numpy.ndarray, list[numpy.ndarray]]]
+        :rtype: IVFIndex
+        """
+        centroid_classes = [class_index for class_index, (centroids, _) in enumerate(class_lists)
+                            for _ in range(len(centroids))]
+        lists = [examples for _, class_examples in class_lists for examples in class_examples]
+        return cls(numpy.concatenate([centroids for centroids, _ in class_lists]),
+                   numpy.array(centroid_classes, dtype=int),
+                   numpy.cumsum([0] + [len(examples) for examples in lists]).astype(int),
+                   numpy.concatenate(lists).astype(int))
+
+    def _class_lists(self, class_index):
+        """
+        Get clusters of class
+        :param class_index: class index
+        :type class_index: int
+        :return: centroids and examples of every cluster (indexes in stack)
+        :rtype: tuple[numpy.ndarray, list[numpy.ndarray]]
+        """
+        start, end = self.class_offsets[class_index], self.class_offsets[class_index + 1]
+        return self.centroids[start:end], [
+            self.list_examples[self.list_offsets[i]:self.list_offsets[i + 1]] for i in range(start, end)
+        ]
+
+    @classmethod
+    def build(cls, stack, list_size, iterations=10, seed=0):
+        """
+        Build index for stacked class matrixes
+        :param stack: class matrixes
+        :type stack: ClassMatrixStack
+        :param list_size: desired examples per cluster
+        :type list_size: int
+        :param iterations: k-means iterations
+        :type iterations: int
+        :param seed: k-means random seed
+        :type seed: int
+        :rtype: IVFIndex
+        """
+        random = numpy.random.RandomState(seed)
+        class_lists = []
+        for class_index in range(len(stack.class_names)):
+            start, end = stack.offsets[class_index], stack.offsets[class_index + 1]
+            signatures = cls.signatures(stack.dequantized(start, end)).astype(numpy.float64)
+            centroids, lists = cls._cluster(signatures, list_size, iterations, random)
+            class_lists.append((centroids, [start + examples for examples in lists]))
+        return cls._assemble(class_lists)
+
+    def replace_class(self, stack, class_name, class_names, offsets, list_size, iterations=10, seed=0):
+        """
+        Get index after examples of one class were replaced in stack (see ClassMatrixStack.replace_class).
+        Clusters of other classes are kept (only their example indexes are shifted), examples of changed class
+        are assigned to its nearest centroids, which are moved to means of their examples.
+        Changed class is clustered again only if it's new, its desired list count is off by LIST_COUNT_SLACK times
+        or some centroid moved further than MAX_DRIFT allows.
+        :param stack: class matrixes after change
+        :type stack: ClassMatrixStack
+        :param class_name: changed class
+        :type class_name: str
+        :param class_names: class names before change (index classes)
+        :type class_names: list[str]
+        :param offsets: class offsets before change
+        :type offsets: numpy.ndarray
+        :param list_size: desired examples per cluster
+        :type list_size: int
+        :param iterations: k-means iterations
+        :type iterations: int
+        :param seed: k-means random seed
+        :type seed: int
+        :rtype: IVFIndex
+        """
+        previous = {name: class_index for class_index, name in enumerate(class_names)}
+        class_lists = []
+        for class_index, name in enumerate(stack.class_names):
+            start, end = stack.offsets[class_index], stack.offsets[class_index + 1]
+            if name != class_name:
+                centroids, lists = self._class_lists(previous[name])
+                class_lists.append((centroids, [examples - offsets[previous[name]] + start for examples in lists]))
+                continue
+            signatures = self.signatures(stack.dequantized(start, end)).astype(numpy.float64)
+            clusters = None
+            if name in previous:
+                clusters = self._reassigned(self._class_lists(previous[name])[0], signatures, list_size)
+            if clusters is None:
+                clusters = self._cluster(signatures, list_size, iterations, numpy.random.RandomState(seed))
+            centroids, lists = clusters
+            class_lists.append((centroids, [start + examples for examples in lists]))
+        return self._assemble(class_lists)
+
+    def _reassigned(self, centroids, signatures, list_size):
+        """
+        Assign class examples to nearest class centroids and move centroids to means of their examples
+        :param centroids: class centroids
+        :type centroids: numpy.ndarray
+        :param signatures: class example signatures
+        :type signatures: numpy.ndarray
+        :param list_size: desired examples per cluster
+        :type list_size: int
+        :return: centroids and examples of every cluster (indexes in class), None - class must be clustered again
+        :rtype: tuple[numpy.ndarray, list[numpy.ndarray]]|NoneType
+        """
+        count = max(1, int(math.ceil(len(signatures) / float(list_size))))
+        if count > len(centroids) * self.LIST_COUNT_SLACK or count * self.LIST_COUNT_SLACK < len(centroids):
+            return None
+        distances = (centroids * centroids).sum(1)[None, :] - 2.0 * signatures.dot(centroids.T)
+        used, labels = numpy.unique(distances.argmin(1), return_inverse=True)
+        sums = numpy.zeros((len(used), signatures.shape[1]))
+        numpy.add.at(sums, labels, signatures)
+        means = sums / numpy.bincount(labels)[:, None]
+        spread = ((signatures - means[labels]) ** 2).sum(1).mean()
+        if (((means - centroids[used]) ** 2).sum(1) > self.MAX_DRIFT * spread).any():
+            return None
+        return means, [numpy.flatnonzero(labels == list_index) for list_index in range(len(used))]
+
+    def search(self, signatures, probes):
+        """
+        Get candidate examples of every phrase
+        :param signatures: phrase signatures (indexes - phraseNumber, wordVectorComponentNumber)
+        :type signatures: numpy.ndarray
+        :param probes: clusters to check per class
+        :type probes: int
+        :return: sorted candidate example indexes of every phrase
+        :rtype: list[numpy.ndarray]
+        """
+        signatures = numpy.asarray(signatures, dtype=numpy.float64)
+        distances = self.centroid_norms[None, :] - 2.0 * signatures.dot(self.centroids.T)
+        result = []
+        for row in distances:
+            order = numpy.lexsort((row, self.centroid_classes))
+            ranks = numpy.arange(len(order)) - self.class_offsets[self.centroid_classes[order]]
+            lists = order[ranks < probes]
+            starts = self.list_offsets[lists]
+            sizes = self.list_offsets[lists + 1] - starts
+            positions = numpy.repeat(starts - numpy.cumsum(sizes) + sizes, sizes) + numpy.arange(sizes.sum())
+            result.append(numpy.sort(self.list_examples[positions]))
+        return result
+
+    @property
+    def max_lists(self):
+        """
+        Maximal cluster count of one class (probes above it give exact search)
+        :rtype: int
+        """
+        return int(numpy.diff(self.class_offsets).max()) if len(self.centroids) else 0
+
+    @property
+    def config(self):
+        """
+        Get config
+        :return: config
+        :rtype: dict
+        """
+        return {
+            'centroids': self.centroids.tolist(),
+            'centroid_classes': self.centroid_classes.tolist(),
+            'list_offsets': self.list_offsets.tolist(),
+            'list_examples': self.list_examples.tolist()
+        }
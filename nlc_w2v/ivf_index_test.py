@@ -0,0 +1,78 @@
+from unittest import TestCase
+import numpy
+from .class_matrix_stack import ClassMatrixStack
+from .ivf_index import IVFIndex
+
+
+class IVFIndexTest(TestCase):
+    def setUp(self):
+        random = numpy.random.RandomState(0)
+        matrixes = [random.normal(size=(count, 3, 4)) for count in (30, 5, 12)]
+        lengths = [numpy.full(len(matrix), 3) for matrix in matrixes]
+        self.stack = ClassMatrixStack(['a', 'b', 'c'], matrixes, lengths)
+        self.index = IVFIndex.build(self.stack, 4)
+
+    def testEveryExampleIndexed(self):
+        self.assertEqual(sorted(self.index.list_examples.tolist()), list(range(len(self.stack.matrixes))))
+
+    def testExactWithAllProbes(self):
+        signatures = numpy.random.RandomState(1).normal(size=(3, 4))
+        for candidates in self.index.search(signatures, self.index.max_lists):
+            self.assertEqual(candidates.tolist(), list(range(len(self.stack.matrixes))))
+
+    def testEveryClassHasCandidates(self):
+        signatures = numpy.random.RandomState(1).normal(size=(3, 4))
+        for candidates in self.index.search(signatures, 1):
+            self.assertLess(len(candidates), len(self.stack.matrixes))
+            offsets = numpy.searchsorted(candidates, self.stack.offsets)
+            self.assertTrue((numpy.diff(offsets) > 0).all())
+
+    def testNearestClusterFound(self):
+        example = 17
+        signature = IVFIndex.signatures(self.stack.matrixes[example:example + 1])
+        self.assertIn(example, self.index.search(signature, 1)[0].tolist())
+
+    def _assert_kept(self, index, class_name, shift):
+        old_index = self.stack_class_names.index(class_name)
+        centroids, lists = self.index._class_lists(old_index)
+        new_centroids, new_lists = index._class_lists(self.stack.class_names.index(class_name))
+        numpy.testing.assert_array_equal(new_centroids, centroids)
+        self.assertEqual([examples.tolist() for examples in new_lists],
+                         [(examples + shift).tolist() for examples in lists])
+
+    def _replace(self, class_name, matrixes):
+        self.stack_class_names, offsets = list(self.stack.class_names), self.stack.offsets
+        self.stack.replace_class(class_name, matrixes, numpy.full(len(matrixes), 3))
+        index = self.index.replace_class(self.stack, class_name, self.stack_class_names, offsets, 4)
+        self.assertEqual(sorted(index.list_examples.tolist()), list(range(len(self.stack.matrixes))))
+        return index
+
+    def testReplaceClass(self):
+        # copies of examples don't move centroids far, so class keeps its clusters
+        index = self._replace('b', self.stack.matrixes[[30, 31, 32, 33, 34, 30, 31]])
+        self._assert_kept(index, 'a', 0)
+        self._assert_kept(index, 'c', 2)
+        centroids = self.index._class_lists(1)[0]
+        self.assertEqual(index._class_lists(1)[0].shape, centroids.shape)
+        signatures = IVFIndex.signatures(self.stack.matrixes[35:37])
+        nearest = ((signatures[:, None, :] - centroids[None, :, :]) ** 2).sum(2).argmin(1)
+        lists = index._class_lists(1)[1]
+        for i, list_index in enumerate(nearest):
+            self.assertIn(35 + i, lists[list_index].tolist())
+
+    def testReplaceClassGrowth(self):
+        # list count can't follow class size any more, so class is clustered again
+        matrixes = numpy.random.RandomState(2).normal(size=(40, 3, 4))
+        index = self._replace('a', numpy.concatenate([self.stack.matrixes[:30], matrixes]))
+        self._assert_kept(index, 'b', 40)
+        self.assertGreater(len(index._class_lists(0)[0]),
+                           len(self.index._class_lists(0)[0]) * IVFIndex.LIST_COUNT_SLACK)
+
+    def testAddRemoveClass(self):
+        index = self._replace('bb', numpy.random.RandomState(2).normal(size=(6, 3, 4)))
+        self.assertEqual(len(index._class_lists(2)[0]), 2)
+        self._assert_kept(index, 'c', 6)
+        self.index = index
+        index = self._replace('b', self.stack.matrixes[:0])
+        self._assert_kept(index, 'bb', -5)
+        self._assert_kept(index, 'c', -5)
@@ -0,0 +1,87 @@
+import threading
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class LRUCache:
+    """
+    Bounded cache: least recently used items are evicted when it's full,
+    items older than ttl seconds (if given) are treated as missing.
+    Counts hits and misses.
+    """
+
+    def __init__(self, max_size, ttl=None):
+        """
+        Initialize cache
+        :param max_size: maximal item count
+        :type max_size: int
+        :param ttl: item lifetime in seconds (None - unlimited)
+        :type ttl: float|NoneType
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """
+        Get cached item and mark it as recently used
+        :param key: key
+        :type key: collections.Hashable
+        :param default: value returned if there is no (alive) item
+        :return: item
+        """
+        with self._lock:
+            item = self._items.get(key, _MISSING)
+            if item is not _MISSING:
+                value, created = item
+                if self.ttl is None or time.monotonic() - created <= self.ttl:
+                    self._items.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._items[key]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        """
+        Cache item (least recently used one is evicted if cache is full)
+        :param key: key
+        :type key: collections.Hashable
+        :param value: item
+        """
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._items[key] = (value, time.monotonic())
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        """
+        Remove every item (counters are kept)
+        """
+        with self._lock:
+            self._items.clear()
+
+    def __len__(self):
+        return len(self._items)
+
+    @property
+    def stats(self):
+        """
+        Get cache statistics
+        :return: size, max_size, hits and misses
+        :rtype: dict
+        """
+        return {
+            'size': len(self._items),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses
+        }
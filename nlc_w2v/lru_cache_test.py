@@ -0,0 +1,36 @@
+import time
+from unittest import TestCase
+from .lru_cache import LRUCache
+
+
+class LRUCacheTest(TestCase):
+    def testEviction(self):
+        cache = LRUCache(2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.put('c', 3)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('c'), 3)
+        self.assertEqual(cache.stats, {'size': 2, 'max_size': 2, 'hits': 3, 'misses': 1})
+
+    def testTtl(self):
+        cache = LRUCache(2, ttl=0.05)
+        cache.put('a', 1)
+        self.assertEqual(cache.get('a'), 1)
+        time.sleep(0.1)
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(len(cache), 0)
+
+    def testDisabled(self):
+        cache = LRUCache(0)
+        cache.put('a', 1)
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.misses, 1)
+
+    def testClear(self):
+        cache = LRUCache(2)
+        cache.put('a', 1)
+        cache.clear()
+        self.assertEqual(cache.get('a', 0), 0)
@@ -0,0 +1,53 @@
+import numpy
+
+STORAGE_DTYPES = ('float64', 'float32', 'float16', 'int8')
+_INT8_MAX = 127.0
+
+
+def quantize(matrixes, dtype):
+    """
+    Convert sentence matrixes to storage dtype.
+    int8 rows are stored with per-row scales (row = int8_row * scale).
+    :param matrixes: sentence matrixes (indexes - exampleNumber, wordNumber, wordVectorComponentNumber)
+    :type matrixes: numpy.ndarray
+    :param dtype: storage dtype (one of STORAGE_DTYPES)
+    :type dtype: str
+    :return: stored matrixes and row scales (None if dtype isn't int8)
+    :rtype: tuple[numpy.ndarray, numpy.ndarray|NoneType]
+    """
+    if dtype not in STORAGE_DTYPES:
+        raise AttributeError("Unknown storage dtype {0}".format(dtype))
+    if dtype != 'int8':
+        return numpy.asarray(matrixes, dtype=dtype), None
+    matrixes = numpy.asarray(matrixes, dtype=numpy.float32)
+    scales = numpy.abs(matrixes).max(axis=-1) / _INT8_MAX
+    safe_scales = numpy.where(scales > 0, scales, 1.0)
+    stored = numpy.rint(matrixes / safe_scales[..., None]).astype(numpy.int8)
+    return stored, scales.astype(numpy.float32)
+
+
+def compute_dtype(stored):
+    """
+    Get dtype distances are calculated in for stored matrixes
+    :param stored: stored matrixes
+    :type stored: numpy.ndarray
+    :rtype: numpy.dtype
+    """
+    if stored.dtype == numpy.float64:
+        return numpy.dtype(numpy.float64)
+    return numpy.dtype(numpy.float32)
+
+
+def dequantize(stored, scales=None):
+    """
+    Convert stored matrixes to compute dtype (float64 storage isn't copied)
+    :param stored: stored matrixes
+    :type stored: numpy.ndarray
+    :param scales: int8 row scales
+    :type scales: numpy.ndarray|NoneType
+    :rtype: numpy.ndarray
+    """
+    result = numpy.asarray(stored, dtype=compute_dtype(stored))
+    if scales is not None:
+        result = result * scales[..., None]
+    return result
@@ -0,0 +1,23 @@
+from unittest import TestCase
+import numpy
+from .quantization import quantize, dequantize
+
+
+class QuantizationTest(TestCase):
+    def setUp(self):
+        self.matrixes = numpy.random.RandomState(0).normal(size=(5, 3, 50))
+        self.matrixes[1, 2] = 0.0
+
+    def testDtypes(self):
+        for dtype, tolerance in (('float64', 0.0), ('float32', 1e-6), ('float16', 1e-2), ('int8', 2e-2)):
+            stored, scales = quantize(self.matrixes, dtype)
+            self.assertEqual(stored.dtype, numpy.dtype(dtype))
+            self.assertEqual(scales is not None, dtype == 'int8')
+            restored = dequantize(stored, scales)
+            relative = numpy.abs(restored - self.matrixes).max() / numpy.abs(self.matrixes).max()
+            print("{0}: {1} bytes, max relative error {2}".format(dtype, stored.nbytes, relative))
+            self.assertLessEqual(relative, tolerance)
+            self.assertEqual(restored[1, 2].tolist(), [0.0] * 50)
+
+    def testUnknownDtype(self):
+        self.assertRaises(AttributeError, quantize, self.matrixes, 'int4')
@@ -0,0 +1,301 @@
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from .binary_storage import read_header
+from .word2vec_classifier import Word2VecClassifier
+from .word2vec_loader import load as load_word2vec, unload as unload_word2vec, content_hash, MappedWord2Vec
+
+
+class _Embedding:
+    """
+    Loaded word vectors shared by resident classifiers
+    """
+
+    def __init__(self, key, model, paths):
+        self.key = key
+        self.model = model
+        self.paths = set(paths)
+        self.references = 0
+        self.nbytes = int(model.syn0.nbytes)
+
+
+class _Loading:
+    """
+    Classifier load in progress, concurrent requests of same classifier wait for it
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.done = threading.Event()
+        self.classifier = None
+        self.error = None
+
+
+class ClassifierRegistry:
+    """
+    Many classifiers (e.g. one per customer) in one process.
+    Classifiers are registered by binary storage path (see Word2VecClassifier.save_binary) and loaded on first request.
+    Word vectors are loaded once per content (classifiers referring same vectors by different paths share them)
+    and are unloaded (from word2vec_loader too) when their last resident classifier is evicted.
+    When classifiers and their vectors exceed memory budget, least recently used classifiers which aren't in use
+    (see acquire) are evicted.
+    Registry is thread-safe. Files are read outside its lock, so requests of resident classifiers don't wait for loads,
+    and concurrent requests of classifier which isn't resident wait for one load.
+    """
+
+    def __init__(self, memory_budget=0, mmap=True, **classifier_kwargs):
+        """
+        Initialize registry
+        :param memory_budget: bytes of resident classifiers and word vectors (memory-mapped ones included),
+                              0 - unlimited
+        :type memory_budget: int
+        :param mmap: memory-map classifier arrays (see Word2VecClassifier.load_binary)
+        :type mmap: bool
+        :param classifier_kwargs: additional constructor arguments of every classifier (e.g. cache_size)
+        """
+        self.memory_budget = memory_budget
+        self.mmap = mmap
+        self.classifier_kwargs = classifier_kwargs
+        self.paths = {}
+        self.hits = 0
+        self.misses = 0
+        self.loads = 0
+        self.load_seconds = 0.0
+        self.evictions = 0
+        self._resident = OrderedDict()
+        self._classifier_bytes = {}
+        self._classifier_embeddings = {}
+        self._in_use = {}
+        self._embeddings = {}
+        self._loading = {}
+        self._lock = threading.RLock()
+        # word vectors are resolved (converted, hashed and loaded) by one thread at a time
+        self._embedding_lock = threading.Lock()
+
+    def register(self, name, path):
+        """
+        Register classifier (resident one with same name is evicted, so next request loads new path)
+        :param name: classifier name
+        :type name: str
+        :param path: binary storage directory
+        :type path: str
+        """
+        with self._lock:
+            if name in self._resident:
+                self._evict(name)
+            self.paths[name] = path
+
+    def unregister(self, name):
+        """
+        Evict classifier and forget it
+        :param name: classifier name
+        :type name: str
+        """
+        with self._lock:
+            if name not in self.paths:
+                raise AttributeError("Unknown classifier {0}".format(name))
+            if name in self._resident:
+                self._evict(name)
+            del self.paths[name]
+
+    def get(self, name):
+        """
+        Get classifier (loaded on first request). Classifier may be evicted after return,
+        use acquire to keep it resident while it's used.
+        :param name: classifier name
+        :type name: str
+        :rtype: Word2VecClassifier
+        """
+        with self._lock:
+            classifier = self._resident.get(name)
+            if classifier is not None:
+                self.hits += 1
+                self._resident.move_to_end(name)
+                return classifier
+            if name not in self.paths:
+                raise AttributeError("Unknown classifier {0}".format(name))
+            loading = self._loading.get(name)
+            if loading is None:
+                self.misses += 1
+                loading = self._loading[name] = _Loading(self.paths[name])
+                owner = True
+            else:
+                self.hits += 1
+                owner = False
+        if owner:
+            self._load(name, loading)
+        else:
+            loading.done.wait()
+        if loading.error is not None:
+            raise loading.error
+        return loading.classifier
+
+    @contextmanager
+    def acquire(self, name):
+        """
+        Context giving classifier which isn't evicted until context exits
+        :param name: classifier name
+        :type name: str
+        """
+        with self._lock:
+            # classifier is in use before it's loaded, so it isn't evicted between load and yield
+            self._in_use[name] = self._in_use.get(name, 0) + 1
+        try:
+            yield self.get(name)
+        finally:
+            with self._lock:
+                self._in_use[name] -= 1
+                if self._in_use[name] == 0:
+                    del self._in_use[name]
+                self._shrink()
+
+    def evict(self, name):
+        """
+        Unload classifier (if it's resident and isn't in use)
+        :param name: classifier name
+        :type name: str
+        :return: is classifier evicted?
+        :rtype: bool
+        """
+        with self._lock:
+            if name not in self._resident or name in self._in_use:
+                return False
+            self._evict(name)
+            return True
+
+    def _embedding(self, path, mapped_path):
+        """
+        Get shared word vectors (loaded if there are no vectors with same content) and add reference to them.
+        Vectors are found by content hash of mapped files (or binary model, if there is no mapped path),
+        so converted copies of same model (e.g. pruned exports of different classifiers) are different vectors,
+        and rewritten files are loaded again.
+        :param path: word2vec path
+        :type path: str
+        :param mapped_path: converted model path
+        :type mapped_path: str|NoneType
+        :rtype: _Embedding
+        """
+        with self._embedding_lock:
+            if mapped_path is not None and not MappedWord2Vec.exists(mapped_path):
+                # model is converted before hashing, so its content is always hashed in mapped format
+                load_word2vec(path, mapped_path)
+            key = content_hash(path, mapped_path)
+            with self._lock:
+                embedding = self._embeddings.get(key)
+                if embedding is not None:
+                    embedding.paths.add((path, mapped_path))
+                    embedding.references += 1
+                    return embedding
+                for other in self._embeddings.values():
+                    if (path, mapped_path) in other.paths:
+                        # files were rewritten, so loaded model has old vectors
+                        other.paths.discard((path, mapped_path))
+                        unload_word2vec(path, mapped_path)
+            model = load_word2vec(path, mapped_path)
+            with self._lock:
+                embedding = _Embedding(key, model, [(path, mapped_path)])
+                embedding.references += 1
+                self._embeddings[key] = embedding
+                return embedding
+
+    def _load(self, name, loading):
+        """
+        Load classifier (without registry lock) and make it resident, unless it was registered again meanwhile
+        :param name: classifier name
+        :type name: str
+        :param loading: load of classifier, it's done when method returns
+        :type loading: _Loading
+        """
+        start = time.perf_counter()
+        embedding = None
+        try:
+            header = read_header(loading.path)
+            embedding = self._embedding(header['word2vec_path'], header.get('word2vec_mapped_path'))
+            loading.classifier = Word2VecClassifier.load_binary(loading.path, self.mmap, word2vec=embedding.model,
+                                                                **self.classifier_kwargs)
+        except Exception as error:
+            loading.error = error
+        with self._lock:
+            del self._loading[name]
+            if loading.error is None and self.paths.get(name) == loading.path:
+                self._resident[name] = loading.classifier
+                self._classifier_bytes[name] = loading.classifier.nbytes
+                self._classifier_embeddings[name] = embedding
+                self.loads += 1
+                self.load_seconds += time.perf_counter() - start
+                self._shrink(name)
+            elif embedding is not None:
+                embedding.references -= 1
+                if embedding.references == 0:
+                    self._release(embedding)
+        loading.done.set()
+
+    def _evict(self, name):
+        """
+        Remove classifier from resident ones, unload its word vectors if no other classifier uses them
+        :param name: classifier name
+        :type name: str
+        """
+        del self._resident[name]
+        del self._classifier_bytes[name]
+        embedding = self._classifier_embeddings.pop(name)
+        embedding.references -= 1
+        if embedding.references == 0:
+            self._release(embedding)
+        self.evictions += 1
+
+    def _release(self, embedding):
+        """
+        Unload word vectors (they are freed when classifiers returned earlier are dropped)
+        :param embedding: word vectors
+        :type embedding: _Embedding
+        """
+        del self._embeddings[embedding.key]
+        for path, mapped_path in embedding.paths:
+            unload_word2vec(path, mapped_path)
+
+    def _shrink(self, keep=None):
+        """
+        Evict least recently used idle classifiers while budget is exceeded
+        :param keep: classifier which mustn't be evicted (e.g. just loaded one)
+        :type keep: str|NoneType
+        """
+        if self.memory_budget <= 0:
+            return
+        for name in list(self._resident.keys()):
+            if self.nbytes <= self.memory_budget:
+                break
+            if name != keep and name not in self._in_use:
+                self._evict(name)
+
+    @property
+    def nbytes(self):
+        """
+        Size of resident classifiers and word vectors
+        :rtype: int
+        """
+        return sum(self._classifier_bytes.values()) + sum(item.nbytes for item in self._embeddings.values())
+
+    @property
+    def stats(self):
+        """
+        Get registry statistics
+        :return: registered, resident and in use classifier counts, loaded word vectors count,
+                 bytes (and memory_budget), hits, misses, loads, load_seconds (total), evictions
+        :rtype: dict
+        """
+        with self._lock:
+            return {
+                'registered': len(self.paths),
+                'resident': len(self._resident),
+                'in_use': len(self._in_use),
+                'embeddings': len(self._embeddings),
+                'bytes': self.nbytes,
+                'memory_budget': self.memory_budget,
+                'hits': self.hits,
+                'misses': self.misses,
+                'loads': self.loads,
+                'load_seconds': self.load_seconds,
+                'evictions': self.evictions,
+            }
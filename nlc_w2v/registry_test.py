@@ -0,0 +1,160 @@
+import os
+import tempfile
+import threading
+from unittest import TestCase
+import numpy
+from .benchmark import synthetic_classes, synthetic_word2vec
+from .exploder import Exploder
+from .registry import ClassifierRegistry
+from .word2vec_classifier import Word2VecClassifier
+from .word2vec_loader import load as load_word2vec, unload as unload_word2vec, get_path, MappedWord2Vec, loaded
+
+
+class _GatedRegistry(ClassifierRegistry):
+    """
+    Registry whose loads wait for gate
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.gate = threading.Event()
+        self.gate.set()
+        self.started = threading.Event()
+
+    def _load(self, name, loading):
+        self.started.set()
+        self.gate.wait()
+        super()._load(name, loading)
+
+
+class RegistryTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        random = numpy.random.RandomState(0)
+        words = ['w{0}'.format(i) for i in range(100)]
+        vectors = random.normal(size=(100, 5))
+        self.word2vec_paths = {}
+        # "same" vectors are stored twice under different paths
+        for name, matrix in [('first', vectors), ('same', vectors), ('other', random.normal(size=(100, 5)))]:
+            mapped_path = os.path.join(self.directory.name, name)
+            MappedWord2Vec.write(words, matrix, mapped_path)
+            self.word2vec_paths[name] = (mapped_path + '.bin', mapped_path)
+        self.registry = _GatedRegistry()
+        self.expected = {}
+        for name in ['first', 'same', 'other']:
+            word2vec = load_word2vec(*self.word2vec_paths[name])
+            classes = synthetic_classes(word2vec, 2, 4, 3)
+            classifier = Word2VecClassifier(word2vec=word2vec, exploder=Exploder([]))
+            classifier.train(classes)
+            path = os.path.join(self.directory.name, name + '_classifier')
+            classifier.save_binary(path)
+            self.registry.register(name, path)
+            self.expected[name] = list(classifier.classify('w1 w2 w3').items())
+            unload_word2vec(*self.word2vec_paths[name])
+
+    def tearDown(self):
+        for path, mapped_path in self.word2vec_paths.values():
+            unload_word2vec(path, mapped_path)
+        self.directory.cleanup()
+
+    def testSharedEmbeddings(self):
+        for name in ['first', 'same', 'other', 'first']:
+            self.assertEqual(list(self.registry.get(name).classify('w1 w2 w3').items()), self.expected[name])
+        self.assertIs(self.registry.get('first').matrix_builder.word2vec,
+                      self.registry.get('same').matrix_builder.word2vec)
+        stats = self.registry.stats
+        self.assertEqual((stats['resident'], stats['embeddings'], stats['loads']), (3, 2, 3))
+        self.assertEqual((stats['hits'], stats['misses']), (3, 3))
+        self.assertEqual(get_path(self.registry.get('other').matrix_builder.word2vec), self.word2vec_paths['other'][0])
+        self.assertTrue(self.registry.evict('first'))
+        self.assertEqual(self.registry.stats['embeddings'], 2)
+        self.assertTrue(self.registry.evict('same'))
+        self.assertEqual(self.registry.stats['embeddings'], 1)
+        self.assertNotIn(self.word2vec_paths['first'], loaded)
+
+    def testMemoryBudget(self):
+        self.registry.memory_budget = 1
+        with self.registry.acquire('first') as first:
+            self.registry.get('other')
+            self.registry.get('same')
+            self.assertEqual(self.registry.stats['resident'], 2)
+            self.assertEqual(self.registry.stats['in_use'], 1)
+            self.assertEqual(list(first.classify('w1 w2 w3').items()), self.expected['first'])
+        # nothing fits into budget, so every classifier is evicted when it's not used
+        stats = self.registry.stats
+        self.assertEqual((stats['resident'], stats['in_use'], stats['evictions'], stats['bytes']), (0, 0, 3, 0))
+        self.assertGreater(stats['load_seconds'], 0.0)
+        self.registry.memory_budget = 0
+        self.registry.get('same')
+        self.assertGreater(self.registry.stats['bytes'], 0)
+        self.registry.unregister('same')
+        self.assertEqual(self.registry.stats['resident'], 0)
+        with self.assertRaises(AttributeError):
+            self.registry.get('same')
+
+    def testPrunedExports(self):
+        # tenants export different pruned copies of one binary model (it isn't read, since copies are converted)
+        path = os.path.join(self.directory.name, 'vectors.bin')
+        full = synthetic_word2vec(os.path.join(self.directory.name, 'full'), 100, 5)
+        words = {'a': ['w1', 'w2', 'w3', 'w4'], 'b': ['w1', 'w2', 'w5', 'w6']}
+        expected = {}
+        for name in ['a', 'b']:
+            mapped_path = os.path.join(self.directory.name, name + '_vectors')
+            MappedWord2Vec.prune(full, words[name], mapped_path)
+            classifier = Word2VecClassifier(word2vec_path=path, word2vec_mapped_path=mapped_path, exploder=Exploder([]))
+            classifier.train({'first': ['w1 w2'], 'second': [' '.join(words[name][2:])]})
+            classifier.save_binary(os.path.join(self.directory.name, name + '_classifier'))
+            self.registry.register(name, os.path.join(self.directory.name, name + '_classifier'))
+            expected[name] = list(classifier.classify('w1 w5 w3').items())
+            unload_word2vec(path, mapped_path)
+        for name in ['a', 'b', 'a']:
+            classifier = self.registry.get(name)
+            self.assertEqual(classifier.matrix_builder.word2vec.index2word, words[name])
+            self.assertEqual(list(classifier.classify('w1 w5 w3').items()), expected[name])
+        # export rewritten in place is loaded again
+        self.registry.evict('b')
+        MappedWord2Vec.prune(full, ['w1', 'w2', 'w5'], os.path.join(self.directory.name, 'b_vectors'))
+        self.assertEqual(self.registry.get('b').matrix_builder.word2vec.index2word, ['w1', 'w2', 'w5'])
+        self.assertEqual(self.registry.get('a').matrix_builder.word2vec.index2word, words['a'])
+        for name in ['a', 'b']:
+            self.registry.unregister(name)
+            self.assertNotIn((path, os.path.join(self.directory.name, name + '_vectors')), loaded)
+
+    def testConcurrentLoads(self):
+        other = self.registry.get('other')
+        self.registry.gate.clear()
+        self.registry.started.clear()
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(self.registry.get('first'))) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        self.assertTrue(self.registry.started.wait(10))
+        # resident classifier is given while other one is loaded
+        self.assertIs(self.registry.get('other'), other)
+        with self.registry.acquire('other') as classifier:
+            self.assertIs(classifier, other)
+        self.registry.gate.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(results), 4)
+        self.assertTrue(all(classifier is results[0] for classifier in results))
+        self.assertIs(self.registry.get('first'), results[0])
+        stats = self.registry.stats
+        self.assertEqual((stats['loads'], stats['misses'], stats['hits']), (2, 2, 6))
+        self.assertEqual(list(results[0].classify('w1 w2 w3').items()), self.expected['first'])
+
+    def testReregisteredWhileLoading(self):
+        self.registry.gate.clear()
+        self.registry.started.clear()
+        results = []
+        thread = threading.Thread(target=lambda: results.append(self.registry.get('first')))
+        thread.start()
+        self.assertTrue(self.registry.started.wait(10))
+        self.registry.register('first', os.path.join(self.directory.name, 'other_classifier'))
+        self.registry.gate.set()
+        thread.join()
+        # classifier of old path is given to its request, but isn't resident
+        self.assertEqual(list(results[0].classify('w1 w2 w3').items()), self.expected['first'])
+        self.assertEqual(self.registry.stats['resident'], 0)
+        self.assertEqual(self.registry.stats['embeddings'], 0)
+        self.assertEqual(list(self.registry.get('first').classify('w1 w2 w3').items()), self.expected['other'])
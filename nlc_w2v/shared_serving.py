@@ -0,0 +1,86 @@
+"""
+Serving mode for pre-forked worker processes: parent publishes classifier once
+(word vectors, stacked class matrixes, norms, solver weights and index arrays) as raw files in shared memory
+directory, every worker attaches read-only memory-mapped views of them.
+So all workers use same physical pages, and extra worker costs its Python objects only
+(word index dict, class names), not copies of arrays.
+"""
+import json
+import os
+import shutil
+import tempfile
+from .word2vec_loader import MappedWord2Vec
+from .word2vec_classifier import Word2VecClassifier
+
+SHARED_MEMORY_DIRECTORY = '/dev/shm'
+MANIFEST_FILE = 'shared.json'
+CLASSIFIER_DIRECTORY = 'classifier'
+VECTORS_PATH = 'vectors'
+
+
+def publish(classifier, path=None):
+    """
+    Write classifier for workers (see attach).
+    Word vectors of memory-mapped model are used from their files, other models are converted to mapped format.
+    Files are written to temporary directory next to path, which is renamed to path at once,
+    so workers never attach partially written directory. Published directory is never overwritten
+    (attached workers map its files), so publish changed classifier to new path and release old one.
+    :param classifier: trained classifier
+    :type classifier: Word2VecClassifier
+    :param path: new (or empty) directory path (new directory in SHARED_MEMORY_DIRECTORY, if it exists,
+                 or in temporary directory)
+    :type path: str|NoneType
+    :return: directory path
+    :rtype: str
+    """
+    if path is None:
+        directory = SHARED_MEMORY_DIRECTORY if os.path.isdir(SHARED_MEMORY_DIRECTORY) else None
+        path = tempfile.mkdtemp(prefix='nlc_w2v_', dir=directory)
+    path = os.path.abspath(path)
+    if os.path.exists(path) and (not os.path.isdir(path) or len(os.listdir(path)) > 0):
+        raise AttributeError("{0} already exists, publish to new path".format(path))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    staging = tempfile.mkdtemp(prefix='.' + os.path.basename(path) + '.', dir=os.path.dirname(path))
+    try:
+        word2vec = classifier.matrix_builder.word2vec
+        mapped_path = getattr(word2vec, 'mapped_path', None)
+        if mapped_path is None:
+            MappedWord2Vec.convert(word2vec, os.path.join(staging, VECTORS_PATH))
+            mapped_path = os.path.join(path, VECTORS_PATH)
+        classifier.save_binary(os.path.join(staging, CLASSIFIER_DIRECTORY))
+        with open(os.path.join(staging, MANIFEST_FILE), 'w', encoding='utf-8') as manifest_file:
+            json.dump({'word2vec_mapped_path': os.path.abspath(mapped_path)}, manifest_file)
+        # empty directory is replaced, existing files make rename fail
+        os.rename(staging, path)
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    return path
+
+
+def attach(path, **kwargs):
+    """
+    Open published classifier. Arrays are read-only memory-mapped views,
+    so training attached classifier builds its own arrays (published ones are never changed).
+    Attach in parent before forking to share word index dict too.
+    :param path: directory path (see publish)
+    :type path: str
+    :param kwargs: additional constructor arguments (e.g. cache_size)
+    :rtype: Word2VecClassifier
+    """
+    with open(os.path.join(path, MANIFEST_FILE), encoding='utf-8') as manifest_file:
+        manifest = json.load(manifest_file)
+    word2vec = MappedWord2Vec(manifest['word2vec_mapped_path'])
+    return Word2VecClassifier.load_binary(
+        os.path.join(path, CLASSIFIER_DIRECTORY), mmap=True,
+        word2vec=word2vec, word2vec_mapped_path=manifest['word2vec_mapped_path'], **kwargs
+    )
+
+
+def release(path):
+    """
+    Remove published classifier (workers which attached it keep their mappings until they exit)
+    :param path: directory path (see publish)
+    :type path: str
+    """
+    shutil.rmtree(path, ignore_errors=True)
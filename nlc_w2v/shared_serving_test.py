@@ -0,0 +1,68 @@
+import multiprocessing
+import os
+import tempfile
+from unittest import TestCase
+from .benchmark import synthetic_word2vec, synthetic_classes, synthetic_phrases
+from .exploder import Exploder
+from .shared_serving import publish, attach, release
+from .word2vec_classifier import Word2VecClassifier, MATCHING_PERMUTATIONS, MATCHING_ASSIGNMENT
+
+
+def _classify_attached(path, texts):
+    classifier = attach(path)
+    return [list(result.items()) for result in classifier.classify_many(texts)]
+
+
+class SharedServingTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.word2vec = synthetic_word2vec(os.path.join(self.directory.name, 'vectors'), 300, 10)
+        self.classes = synthetic_classes(self.word2vec, 3, 5, 3)
+        self.texts = synthetic_phrases(self.word2vec, 5, 3) + [self.classes['class1'][0]]
+
+    def tearDown(self):
+        del self.word2vec
+        self.directory.cleanup()
+
+    def _check(self, classifier):
+        classifier.train(self.classes)
+        expected = [list(result.items()) for result in classifier.classify_many(self.texts)]
+        path = publish(classifier, os.path.join(self.directory.name, 'shared'))
+        try:
+            attached = attach(path)
+            self.assertFalse(attached._matrix_stack.matrixes.flags.writeable)
+            self.assertFalse(attached.matrix_builder.word2vec.syn0.flags.writeable)
+            self.assertEqual([list(result.items()) for result in attached.classify_many(self.texts)], expected)
+            with multiprocessing.get_context('fork').Pool(2) as pool:
+                results = pool.starmap(_classify_attached, [(path, self.texts)] * 2)
+            self.assertEqual(results, [expected, expected])
+        finally:
+            release(path)
+        self.assertFalse(os.path.exists(path))
+
+    def testAssignment(self):
+        self._check(Word2VecClassifier(word2vec=self.word2vec, exploder=Exploder([]), matching=MATCHING_ASSIGNMENT,
+                                       cascade_shortlist=4))
+
+    def testPermutations(self):
+        classifier = Word2VecClassifier(word2vec=self.word2vec, exploder=Exploder([]),
+                                        matching=MATCHING_PERMUTATIONS)
+        self._check(classifier)
+
+    def testRepublish(self):
+        classifier = Word2VecClassifier(word2vec=self.word2vec, exploder=Exploder([]))
+        classifier.train(self.classes)
+        expected = [list(result.items()) for result in classifier.classify_many(self.texts)]
+        path = os.path.join(self.directory.name, 'published')
+        os.makedirs(path)
+        self.assertEqual(publish(classifier, path), path)
+        attached = attach(path)
+        classifier.add_class('other', ['w1 w2 w3'])
+        with self.assertRaises(AttributeError):
+            publish(classifier, path)
+        # files of attached classifier aren't changed, failed publish leaves nothing
+        self.assertEqual([list(result.items()) for result in attached.classify_many(self.texts)], expected)
+        self.assertEqual(sorted(os.listdir(self.directory.name)), ['published', 'vectors.lock', 'vectors.npy', 'vectors.vocab'])
+        changed = attach(publish(classifier, os.path.join(self.directory.name, 'changed')))
+        self.assertIn('other', changed.classify('w1 w2 w3'))
+        release(path)
@@ -1,4 +1,17 @@
+from .assignment_test import AssignmentTest
+from .async_classifier_test import AsyncClassifierTest
+from .benchmark_test import BenchmarkTest
+from .class_matrix_builder_test import ClassMatrixBuilderTest
+from .class_matrix_stack_test import ClassMatrixStackTest
 from .class_solver_test import ClassSolverTest
 from .exploder_test import ExploderTest
+from .import_test import ImportTest
+from .instrumentation_test import InstrumentationTest
+from .ivf_index_test import IVFIndexTest
+from .lru_cache_test import LRUCacheTest
+from .quantization_test import QuantizationTest
+from .registry_test import RegistryTest
+from .shared_serving_test import SharedServingTest
 from .word2vec_loader_test import LoaderTest
-from .word2vec_classifier_test import Word2VecClassifierTest
+from .word2vec_classifier_test import Word2VecClassifierTest, Word2VecAssignmentClassifierTest, \
+    SyntheticWord2VecClassifierTest
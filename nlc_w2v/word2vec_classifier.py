@@ -1,13 +1,33 @@
 from collections import OrderedDict
-import math
-from itertools import permutations
+import multiprocessing
 import numpy
-from gensim.models import Word2Vec
 from nlc import BaseClassifier
 from .exploder import Exploder
 from .class_solver import ClassSolver
-from .word2vec_loader import load as load_word2vec, get_path as get_word2vec_path
+from .word2vec_loader import load as load_word2vec, get_path as get_word2vec_path, MappedWord2Vec
 from .class_matrix_builder import ClassMatrixBuilder
+from .assignment import permutation_examples
+from .class_matrix_stack import ClassMatrixStack
+from .binary_storage import write_arrays, read_arrays
+from .ivf_index import IVFIndex
+from .instrumentation import NULL_INSTRUMENTATION
+from .lru_cache import LRUCache
+from .quantization import STORAGE_DTYPES, quantize, dequantize
+
+MATCHING_PERMUTATIONS = 'permutations'
+MATCHING_ASSIGNMENT = 'assignment'
+
+_fits_classifier = None
+
+
+def _fits_block(block):
+    """
+    Process pool task: build fits block with classifier of parent process
+    :param block: first and after last example, compared class (see Word2VecClassifier._fits_block)
+    :type block: tuple[int, int, int|NoneType]
+    :rtype: numpy.ndarray
+    """
+    return _fits_classifier._fits_block(*block)
 
 
 class Word2VecClassifier(BaseClassifier):
@@ -24,20 +44,88 @@ class Word2VecClassifier(BaseClassifier):
     class distance - distance to nearest sentence matrix of given class
     matrix to matrix distance - sqrt(sum(matrix1 - matrix2 ^ 2))
     classes distance - distance to all stored classes
+    matching - how word order is ignored:
+      'permutations' - minimize over every phrase and example word permutation (default)
+      'assignment' - same distances, allows approximate nearest neighbour search, cascade and pruning
+      both are calculated as linear assignment problem per stored example (permutations aren't expanded)
     class confidence - value in [0.0:1.0] (0.0 - sentence is n't part of given class, 1.0 - is part)
     """
+    FIT_BLOCK_SIZE = 256
 
     def __init__(self, word2vec=None, exploder=None,
                  word2vec_path=None, exploder_stop_words=None,
                  class_sentence_matrixed=None,
                  confidence_converter_config=None,
-                 sentence_matrix_length=0):
+                 sentence_matrix_length=0,
+                 matching=MATCHING_PERMUTATIONS,
+                 class_sentence_lengths=None,
+                 word2vec_mapped_path=None,
+                 vocabulary=None,
+                 ann_list_size=0,
+                 ann_probes=1,
+                 ann_index=None,
+                 storage_dtype='float64',
+                 class_sentence_scales=None,
+                 train_processes=1,
+                 cache_size=1024,
+                 cache_ttl=None,
+                 word_cache_size=0,
+                 instrumentation=None,
+                 cascade_shortlist=0,
+                 pruning=False):
         """
         :param word2vec: word2vec model
-        :type word2vec: Word2Vec|NoneType
+        :type word2vec: Word2Vec|MappedWord2Vec|NoneType
         :param exploder: exploder
         :type exploder: Exploder|NoneType
+        :param matching: matching mode ('permutations' or 'assignment')
+        :type matching: str
+        :param class_sentence_lengths: example word counts of every class
+        :type class_sentence_lengths: dict[str, list[int]]|NoneType
+        :param word2vec_mapped_path: path of memory-mapped word2vec copy (see word2vec_loader.load)
+        :type word2vec_mapped_path: str|NoneType
+        :param vocabulary: words of training examples
+        :type vocabulary: list[str]|NoneType
+        :param ann_list_size: examples per cluster of approximate nearest neighbour index built on train
+                              (assignment matching only), 0 - no index
+        :type ann_list_size: int
+        :param ann_probes: index clusters checked per class (more - better recall, slower)
+        :type ann_probes: int
+        :param ann_index: index config (see IVFIndex.config)
+        :type ann_index: dict|NoneType
+        :param storage_dtype: class matrixes dtype ('float64', 'float32', 'float16' or 'int8' with row scales)
+        :type storage_dtype: str
+        :param class_sentence_scales: int8 row scales of every class matrix
+        :type class_sentence_scales: dict[str, list[list[float]]]|NoneType
+        :param train_processes: worker processes of class matrix building (see ClassMatrixBuilder.stacked_class_matrix)
+        :type train_processes: int
+        :param cache_size: classification result cache size (by exploded phrase words), 0 - no cache
+        :type cache_size: int
+        :param cache_ttl: classification result lifetime in seconds (None - unlimited)
+        :type cache_ttl: float|NoneType
+        :param word_cache_size: phrase word vector cache size, 0 - no cache
+        :type word_cache_size: int
+        :param instrumentation: classification and training hooks (see MetricsRegistry), None - disabled
+        :type instrumentation: Instrumentation|NoneType
+        :param cascade_shortlist: examples nearest by summed word vectors compared exactly
+                                  (plus nearest example of every class; assignment matching only), 0 - compare all
+        :type cascade_shortlist: int
+        :param pruning: skip assignment of examples whose lower bound can't beat best example of their class
+                        (same results, assignment matching only)?
+        :type pruning: bool
         """
+        if matching not in (MATCHING_PERMUTATIONS, MATCHING_ASSIGNMENT):
+            raise AttributeError("Unknown matching {0}".format(matching))
+        if matching != MATCHING_ASSIGNMENT and (ann_list_size > 0 or ann_index is not None):
+            raise AttributeError("Nearest neighbour index needs assignment matching")
+        if matching != MATCHING_ASSIGNMENT and cascade_shortlist > 0:
+            raise AttributeError("Cascade needs assignment matching")
+        if matching != MATCHING_ASSIGNMENT and pruning:
+            raise AttributeError("Pruning needs assignment matching")
+        if storage_dtype not in STORAGE_DTYPES:
+            raise AttributeError("Unknown storage dtype {0}".format(storage_dtype))
+        self.matching = matching
+        self.storage_dtype = storage_dtype
         if exploder_stop_words is not None:
             exploder = Exploder(exploder_stop_words)
         elif exploder is None:
@@ -45,20 +133,75 @@ class Word2VecClassifier(BaseClassifier):
         if word2vec is not None:
             self.matrix_builder = ClassMatrixBuilder(word2vec, exploder)
             self.word2vec_path = get_word2vec_path(word2vec)
+            self.word2vec_mapped_path = getattr(word2vec, 'mapped_path', None)
         elif word2vec_path is not None:
-            self.matrix_builder = ClassMatrixBuilder(load_word2vec(word2vec_path), exploder)
+            self.matrix_builder = ClassMatrixBuilder(load_word2vec(word2vec_path, word2vec_mapped_path), exploder)
             self.word2vec_path = word2vec_path
+            self.word2vec_mapped_path = word2vec_mapped_path
         else:
             raise AttributeError("Need word2vec or word2vec_path")
         self.class_sentence_matrixed = {}
         if class_sentence_matrixed is not None:
             for key, matrix in class_sentence_matrixed.items():
-                self.class_sentence_matrixed[key] = numpy.array(matrix)
+                self.class_sentence_matrixed[key] = numpy.asarray(matrix)
+        self.class_sentence_lengths = {}
+        for key, matrix in list(self.class_sentence_matrixed.items()):
+            if class_sentence_lengths is not None and key in class_sentence_lengths:
+                self.class_sentence_lengths[key] = numpy.asarray(class_sentence_lengths[key], dtype=int)
+            else:
+                # Configs without lengths store every example permutation, only first one of every example is kept
+                indexes, self.class_sentence_lengths[key] = permutation_examples(matrix)
+                self.class_sentence_matrixed[key] = matrix[indexes]
+        self.class_sentence_scales = None
+        self.result_cache = LRUCache(cache_size, cache_ttl)
+        self.matrix_builder.word_cache = LRUCache(word_cache_size) if word_cache_size > 0 else None
+        self._matrix_stack = None
+        self._fit_distances = None
+        self._store_class_matrixes(class_sentence_scales)
         if confidence_converter_config is None:
             self.confidence_converter = ClassSolver(0)
         else:
             self.confidence_converter = ClassSolver(**confidence_converter_config)
         self.matrix_builder.sentence_matrix_length = sentence_matrix_length
+        if vocabulary is not None:
+            self.matrix_builder.vocabulary = set(vocabulary)
+        self.instrumentation = instrumentation
+        self.train_processes = train_processes
+        self.ann_list_size = ann_list_size
+        self.ann_probes = ann_probes
+        self.cascade_shortlist = cascade_shortlist
+        self.pruning = pruning
+        self.ann_index = None
+        if ann_index is not None:
+            self.ann_index = IVFIndex(**ann_index)
+
+    @property
+    def instrumentation(self):
+        """
+        Classification and training hooks (shared with matrix builder)
+        :rtype: Instrumentation
+        """
+        return self.matrix_builder.instrumentation
+
+    @instrumentation.setter
+    def instrumentation(self, instrumentation):
+        self.matrix_builder.instrumentation = instrumentation if instrumentation is not None else NULL_INSTRUMENTATION
+
+    @property
+    def nbytes(self):
+        """
+        Size of class matrix stack, index arrays and solver weights (word vectors aren't counted)
+        :rtype: int
+        """
+        result = self.confidence_converter.nbytes
+        if self._matrix_stack is not None:
+            result += self._matrix_stack.nbytes
+        if self.ann_index is not None:
+            index = self.ann_index
+            result += sum(array.nbytes for array in [
+                index.centroids, index.centroid_norms, index.list_offsets, index.list_examples
+            ])
+        return int(result)
 
     @property
     def _axis(self):
@@ -71,67 +214,180 @@ class Word2VecClassifier(BaseClassifier):
         lst.sort()
         return lst
 
-    def _class_matrix_distance(self, class_name, matrix, trim_zeros=False):
+    def _set_matrix_stack(self, stack):
         """
-        Get distance from matrix to class matrix
-        :param class_name: class name
-        :type class_name: str
-        :param matrix: matrix
-        :type matrix: numpy.ndarray
-        :param trim_zeros: trim zero distances?
-        :type trim_zeros: bool
-        :return: distance
-        :rtype: float
-        """
-        # Get list of difference between class record and given
-        diffs = self.class_sentence_matrixed[class_name] - matrix
-        diffs_sqr = diffs * diffs
-        diff_sums = numpy.sum(diffs_sqr, (1, 2,))  # Transform difference to linear
-        if trim_zeros:
-            diff_sums = numpy.trim_zeros(diff_sums)
-        return math.sqrt(diff_sums.min())  # Get distance
+        Use stacked class matrixes, class matrix dicts become views of it
+        :param stack: stored class matrixes
+        :type stack: ClassMatrixStack
+        """
+        self._matrix_stack = stack
+        self._fit_distances = None
+        self._update_class_views()
+
+    def _update_class_views(self):
+        """
+        Make class matrix dicts views of stacked class matrixes again (after stack is changed), clear result cache
+        """
+        stack = self._matrix_stack
+        self.result_cache.clear()
+        self.class_sentence_matrixed = stack.class_matrixes()
+        self.class_sentence_lengths = stack.class_arrays(stack.lengths)
+        self.class_sentence_scales = stack.class_arrays(stack.scales) if stack.scales is not None else None
+
+    def _store_class_matrixes(self, class_sentence_scales=None):
+        """
+        Convert class matrixes to storage dtype and stack them
+        :param class_sentence_scales: int8 row scales of given class matrixes
+        :type class_sentence_scales: dict[str, numpy.ndarray]|NoneType
+        """
+        self._matrix_stack = None
+        if len(self.class_sentence_matrixed) == 0:
+            return
+        axis = self._axis
+        matrixes = []
+        scales = []
+        for class_name in axis:
+            matrix = self.class_sentence_matrixed[class_name]
+            if class_sentence_scales is not None:
+                matrix = dequantize(
+                    numpy.asarray(matrix, dtype=numpy.int8),
+                    numpy.asarray(class_sentence_scales[class_name], dtype=numpy.float32)
+                )
+            stored, matrix_scales = quantize(matrix, self.storage_dtype)
+            matrixes.append(stored)
+            scales.append(matrix_scales)
+        lengths = [self.class_sentence_lengths[class_name] for class_name in axis]
+        self._set_matrix_stack(ClassMatrixStack(
+            axis, matrixes, lengths, scales if self.storage_dtype == 'int8' else None
+        ))
 
     def _matrix_distances(self, matrix):
         """
-        Get distance from matrix to classes
-        :param matrix: matrix
+        Get distance from matrix to classes (minimum over phrase and example word permutations).
+        Zero distances of every class are trimmed like permutation mode trims leading and trailing ones
+        (see ClassMatrixStack.trimmed_assignment_distances). If class has zero distances only distance is zero.
+        :param matrix: matrix (without padding)
         :type matrix: numpy.ndarray
-        :return: distances
-        :rtype: dict[str, float]
+        :return: distances (in axis order)
+        :rtype: numpy.ndarray
         """
-        result = {}
-        for class_name in self.class_sentence_matrixed:
-            result[class_name] = self._class_matrix_distance(class_name, matrix, True)
-        return result
+        stack = self._matrix_stack
+        return self._trimmed_class_distances(stack, [matrix], stack.assignment_distances_many([matrix]))[0]
 
     def _fits(self, verbose):
         """
-        Get distance to confidence converter train fits
+        Get distance to confidence converter train fits: class distances of every stored example
+        :param verbose: verbose process?
+        :type verbose: bool
+        :return: examples
+        :rtype: tuple[numpy.ndarray, numpy.ndarray]
+        """
+        stack = self._matrix_stack
+        distances = self._fits_distances([(0, len(stack.matrixes))], None, verbose)
+        return distances, self._fit_confidences()
+
+    def _updated_fits(self, class_name, class_names, offsets, verbose):
+        """
+        Get fits after class examples were replaced (see _update_class) from fits before it.
+        Only class distances of changed class examples and distances of other examples to changed class
+        are calculated: distances to other classes don't change, since zero distances are trimmed per class.
+        :param class_name: changed class
+        :type class_name: str
+        :param class_names: class names before change
+        :type class_names: list[str]
+        :param offsets: class offsets of fitted stack before change
+        :type offsets: numpy.ndarray
         :param verbose: verbose process?
         :type verbose: bool
         :return: examples
         :rtype: tuple[numpy.ndarray, numpy.ndarray]
         """
-        distances = []
-        confidences = []
-        for class_name, class_matrix in self.class_sentence_matrixed.items():
-            if verbose:
-                print("Building fits for {0}".format(class_name))
-            for i, item in enumerate(class_matrix):
-                if verbose:
-                    print("Building fit {0} of {1}".format(i+1, len(class_matrix)))
-                class_distances = self._matrix_distances(item)
-                x_fit = []
-                y_fit = []
-                for axis in self._axis:
-                    x_fit.append(class_distances[axis])
-                    if axis == class_name:
-                        y_fit.append(1.0)
-                    else:
-                        y_fit.append(0.0)
-                distances.append(x_fit)
-                confidences.append(y_fit)
-        return numpy.array(distances), numpy.array(confidences)
+        stack = self._matrix_stack
+        previous = self._fit_distances
+        count = len(stack.matrixes)
+        distances = numpy.zeros((count, len(stack.class_names)))
+        kept = [i for i, name in enumerate(stack.class_names) if name != class_name]
+        previous_kept = [class_names.index(stack.class_names[i]) for i in kept]
+        for i, previous_i in zip(kept, previous_kept):
+            rows = previous[offsets[previous_i]:offsets[previous_i + 1]]
+            distances[stack.offsets[i]:stack.offsets[i + 1], kept] = rows[:, previous_kept]
+        if class_name in stack.class_names:
+            index = stack.class_names.index(class_name)
+            start, end = stack.offsets[index], stack.offsets[index + 1]
+            distances[start:end] = self._fits_distances([(start, end)], None, verbose)
+            distances[numpy.r_[0:start, end:count], index] = \
+                self._fits_distances([(0, start), (end, count)], index, verbose)[:, 0]
+        return distances, self._fit_confidences()
+
+    def _fit_confidences(self):
+        """
+        Get fit confidences: every stored example belongs to its class only
+        :return: confidences (indexes - exampleNumber, classNumber)
+        :rtype: numpy.ndarray
+        """
+        stack = self._matrix_stack
+        return numpy.repeat(numpy.eye(len(stack.class_names)), numpy.diff(stack.offsets), axis=0)
+
+    def _fits_distances(self, ranges, class_index, verbose):
+        """
+        Get class distances of stored examples.
+        Examples are compared with stack by blocks of FIT_BLOCK_SIZE (bounded memory),
+        blocks are spread over train_processes forked processes.
+        Count of calculated distances is observed as 'train.fit_distances'.
+        :param ranges: example ranges (first and after last example)
+        :type ranges: list[tuple[int, int]]
+        :param class_index: compared class (None - every class)
+        :type class_index: int|NoneType
+        :param verbose: verbose process?
+        :type verbose: bool
+        :return: distances (indexes - exampleNumber in ranges order, classNumber)
+        :rtype: numpy.ndarray
+        """
+        global _fits_classifier
+        stack = self._matrix_stack
+        total = len(stack.matrixes)
+        blocks = [
+            (start, min(start + self.FIT_BLOCK_SIZE, end), class_index)
+            for range_start, end in ranges for start in range(range_start, end, self.FIT_BLOCK_SIZE)
+        ]
+        if self.train_processes > 1 and len(blocks) > 1:
+            self.instrumentation.log(verbose, "Building fits of {0} blocks in {1} processes",
+                                     len(blocks), self.train_processes)
+            _fits_classifier = self
+            try:
+                with multiprocessing.get_context('fork').Pool(self.train_processes) as pool:
+                    parts = pool.map(_fits_block, blocks)
+            finally:
+                _fits_classifier = None
+        else:
+            parts = []
+            for block in blocks:
+                self.instrumentation.log(verbose, "Building fits {0}-{1} of {2}", block[0] + 1, block[1], total)
+                parts.append(self._fits_block(*block))
+        class_count = len(stack.class_names) if class_index is None else 1
+        distances = numpy.concatenate(parts) if len(parts) > 0 else numpy.zeros((0, class_count))
+        self.instrumentation.observe('train.fit_distances', distances.size)
+        return distances
+
+    def _fits_block(self, start, end, class_index=None):
+        """
+        Get class distances of stored examples block (every example is compared with whole stack at once)
+        :param start: first example
+        :type start: int
+        :param end: example after last
+        :type end: int
+        :param class_index: compared class (None - every class)
+        :type class_index: int|NoneType
+        :return: distances (indexes - exampleNumber, classNumber in axis order)
+        :rtype: numpy.ndarray
+        """
+        stack = self._matrix_stack
+        compared = stack if class_index is None else stack.class_stack(class_index)
+        block = stack.dequantized(start, end)
+        matrixes = [matrix[:length] for matrix, length in zip(block, stack.lengths[start:end])]
+        return self._trimmed_class_distances(
+            compared, matrixes, self._stack_assignment_distances(compared, matrixes, 'train')
+        )
 
     def train(self, classes, verbose=False):
         """
@@ -141,42 +397,355 @@ class Word2VecClassifier(BaseClassifier):
         :param verbose: verbose
         :type verbose: bool
         """
-        if verbose:
-            print("Building class matrixes")
-        self.class_sentence_matrixed = self.matrix_builder.class_sentence_matrixs(classes, verbose)
-        distances, confidences = self._fits(verbose)
-        self.confidence_converter.resize(len(classes))
-        self.confidence_converter.train(distances, confidences, verbose)
+        instrumentation = self.instrumentation
+        with instrumentation.stage('train'):
+            instrumentation.log(verbose, "Building class matrixes")
+            # Matrixes are built straight into one stacked array of storage dtype (float32 before int8 quantization)
+            class_names, matrixes, lengths, offsets = self.matrix_builder.stacked_class_matrix(
+                classes, verbose, self.train_processes,
+                numpy.float32 if self.storage_dtype == 'int8' else self.storage_dtype
+            )
+            stored, scales = quantize(matrixes, self.storage_dtype)
+            self._set_matrix_stack(ClassMatrixStack.from_stacked(class_names, stored, lengths, offsets, scales=scales))
+            self._build_ann_index(verbose)
+            if self.cascade_shortlist > 0 and self.matching == MATCHING_ASSIGNMENT:
+                with instrumentation.stage('train.signatures'):
+                    self._matrix_stack.signatures
+            self.confidence_converter.resize(len(classes))
+            self._train_confidence_converter(verbose)
 
-    def classify(self, text):
+    def _train_confidence_converter(self, verbose, change=None):
         """
-        Classify text
-        :param text: text
-        :type text: str
+        Build fits and train confidence converter with them.
+        Fit distances are kept, so after incremental change only distances of changed class are calculated.
+        :param verbose: verbose
+        :type verbose: bool
+        :param change: changed class, class names and fitted stack offsets before change (None - build all fits)
+        :type change: tuple[str, list[str], numpy.ndarray]|NoneType
+        """
+        with self.instrumentation.stage('train.fits'):
+            if change is not None and self._fit_distances is not None:
+                distances, confidences = self._updated_fits(*change, verbose=verbose)
+            else:
+                distances, confidences = self._fits(verbose)
+        self._fit_distances = distances
+        with self.instrumentation.stage('train.solver'):
+            self.confidence_converter.train(distances, confidences, verbose)
+        self.result_cache.clear()
+
+    def _build_ann_index(self, verbose):
+        """
+        Build nearest neighbour index if it's enabled (assignment matching only)
+        :param verbose: verbose
+        :type verbose: bool
+        """
+        self.ann_index = None
+        if self.ann_list_size > 0 and self.matching == MATCHING_ASSIGNMENT:
+            self.instrumentation.log(verbose, "Building nearest neighbour index")
+            with self.instrumentation.stage('train.ann_index'):
+                self.ann_index = IVFIndex.build(self._matrix_stack, self.ann_list_size)
+
+    def _class_examples(self, class_name):
+        """
+        Get stored examples of class
+        :param class_name: class name
+        :type class_name: str
+        :return: example matrixes, word counts and int8 row scales (empty if there is no such class)
+        :rtype: tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray|NoneType]
+        """
+        stack = self._matrix_stack
+        if class_name in stack.class_names:
+            index = stack.class_names.index(class_name)
+            start, end = stack.offsets[index], stack.offsets[index + 1]
+        else:
+            start, end = 0, 0
+        scales = stack.scales[start:end] if stack.scales is not None else None
+        return stack.matrixes[start:end], stack.lengths[start:end], scales
+
+    def _stored_examples(self, examples, verbose, update_vocabulary=True):
+        """
+        Build example matrixes in storage dtype
+        :param examples: examples
+        :type examples: list[str]
+        :param verbose: verbose
+        :type verbose: bool
+        :param update_vocabulary: add example words to vocabulary?
+        :type update_vocabulary: bool
+        :return: example matrixes, word counts and int8 row scales
+        :rtype: tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray|NoneType]
+        """
+        matrixes, lengths = self.matrix_builder.examples_matrix(
+            examples, verbose, numpy.float32 if self.storage_dtype == 'int8' else self.storage_dtype, update_vocabulary
+        )
+        stored, scales = quantize(matrixes, self.storage_dtype)
+        return stored, lengths, scales
+
+    @staticmethod
+    def _example_keys(matrixes, lengths, scales):
+        """
+        Get keys of stored examples (equal for same example word sets)
+        :param matrixes: example matrixes
+        :type matrixes: numpy.ndarray
+        :param lengths: example word counts
+        :type lengths: numpy.ndarray
+        :param scales: int8 row scales
+        :type scales: numpy.ndarray|NoneType
+        :rtype: list[bytes]
+        """
+        return [
+            matrixes[i, :length].tobytes() + (scales[i, :length].tobytes() if scales is not None else b'')
+            for i, length in enumerate(lengths)
+        ]
+
+    def _update_class(self, class_name, matrixes, lengths, scales, verbose):
+        """
+        Replace class examples in stack (in place), update nearest neighbour index and retrain confidence converter starting from its current weights
+        :param class_name: class name
+        :type class_name: str
+        :param matrixes: class example matrixes (no examples - class is removed)
+        :type matrixes: numpy.ndarray
+        :param lengths: class example word counts
+        :type lengths: numpy.ndarray
+        :param scales: int8 row scales
+        :type scales: numpy.ndarray|NoneType
+        :param verbose: verbose
+        :type verbose: bool
+        """
+        stack = self._matrix_stack
+        old_class_names = list(stack.class_names)
+        change = (class_name, old_class_names, stack.offsets)
+        stack.replace_class(class_name, matrixes, lengths, scales)
+        self._update_class_views()
+        self.matrix_builder.sentence_matrix_length = stack.matrixes.shape[1]
+        if self.ann_index is not None and self.ann_list_size > 0 and self.matching == MATCHING_ASSIGNMENT:
+            # only changed class is assigned to its clusters (see IVFIndex.replace_class)
+            with self.instrumentation.stage('train.ann_index'):
+                self.ann_index = self.ann_index.replace_class(
+                    stack, class_name, old_class_names, change[2], self.ann_list_size
+                )
+        else:
+            self._build_ann_index(verbose)
+        self.confidence_converter.remap([
+            old_class_names.index(name) if name in old_class_names else -1
+            for name in stack.class_names
+        ])
+        self._train_confidence_converter(verbose, change)
+
+    def add_examples(self, class_name, examples, verbose=False):
+        """
+        Add examples to class (class is created if there is no such class) without full retrain:
+        only new examples are embedded, confidence converter continues training from its current weights.
+        Example word sets which class already has are skipped.
+        :param class_name: class name
+        :type class_name: str
+        :param examples: examples
+        :type examples: list[str]
+        :param verbose: verbose
+        :type verbose: bool
+        """
+        if len(self.class_sentence_matrixed) == 0:
+            self.train({class_name: examples}, verbose)
+            return
+        matrixes, lengths, scales = self._class_examples(class_name)
+        new_matrixes, new_lengths, new_scales = self._stored_examples(examples, verbose)
+        keys = set(self._example_keys(matrixes, lengths, scales))
+        added = [
+            i for i, key in enumerate(self._example_keys(new_matrixes, new_lengths, new_scales))
+            if key not in keys
+        ]
+        if len(added) == 0:
+            return
+        length = max(matrixes.shape[1], new_matrixes.shape[1])
+        result = numpy.zeros((len(matrixes) + len(added), length, matrixes.shape[2]), dtype=matrixes.dtype)
+        result[:len(matrixes), :matrixes.shape[1]] = matrixes
+        result[len(matrixes):, :new_matrixes.shape[1]] = new_matrixes[added]
+        result_scales = None
+        if scales is not None:
+            result_scales = numpy.zeros(result.shape[:2], dtype=numpy.float32)
+            result_scales[:len(matrixes), :matrixes.shape[1]] = scales
+            result_scales[len(matrixes):, :new_matrixes.shape[1]] = new_scales[added]
+        result_lengths = numpy.concatenate([lengths, new_lengths[added]])
+        self._update_class(class_name, result, result_lengths, result_scales, verbose)
+
+    def add_class(self, class_name, examples, verbose=False):
+        """
+        Add new class without full retrain (see add_examples)
+        :param class_name: class name
+        :type class_name: str
+        :param examples: examples
+        :type examples: list[str]
+        :param verbose: verbose
+        :type verbose: bool
+        """
+        if class_name in self.class_sentence_matrixed:
+            raise AttributeError("Class {0} already exists".format(class_name))
+        self.add_examples(class_name, examples, verbose)
+
+    def remove_examples(self, class_name, examples, verbose=False):
+        """
+        Remove examples (with same word sets) from class without full retrain,
+        class without examples is removed.
+        Vocabulary isn't changed (removed words can be used by other examples).
+        :param class_name: class name
+        :type class_name: str
+        :param examples: examples
+        :type examples: list[str]
+        :param verbose: verbose
+        :type verbose: bool
+        """
+        if class_name not in self.class_sentence_matrixed:
+            raise AttributeError("Unknown class {0}".format(class_name))
+        matrixes, lengths, scales = self._class_examples(class_name)
+        removed = set(self._example_keys(*self._stored_examples(examples, verbose, False)))
+        kept = [i for i, key in enumerate(self._example_keys(matrixes, lengths, scales)) if key not in removed]
+        if len(kept) == len(matrixes):
+            return
+        self._update_class(
+            class_name, matrixes[kept], lengths[kept], scales[kept] if scales is not None else None, verbose
+        )
+
+    def _assignment_distances_many(self, matrixes, exact=False):
+        """
+        Get class distances of every phrase with word orderings matched as linear assignment problem
+        :param matrixes: phrase matrixes
+        :type matrixes: list[numpy.ndarray]
+        :param exact: compare with every example even if index or cascade is enabled?
+        :type exact: bool
+        :return: distances (indexes - phraseNumber, classNumber in axis order)
+        :rtype: numpy.ndarray
+        """
+        vector_size = self.matrix_builder.word2vec.vector_size
+        matrixes = [numpy.asarray(matrix).reshape((len(matrix), vector_size,)) for matrix in matrixes]
+        stack = self._matrix_stack
+        candidates = self._candidates(matrixes) if not exact else None
+        if candidates is not None:
+            return self._candidate_distances(matrixes, candidates)
+        self.instrumentation.observe('classify.examples', len(stack.matrixes))
+        distances = self._stack_assignment_distances(stack, matrixes, 'classify')
+        return self._trimmed_class_distances(stack, matrixes, distances)
+
+    def _stack_assignment_distances(self, stack, matrixes, stage):
+        """
+        Get squared distances of every phrase to stack examples.
+        With pruning (assignment matching only) abandoned examples get infinite distance,
+        solved and abandoned example counts of every phrase are observed as '<stage>.solved' and '<stage>.pruned'.
+        :param stack: examples
+        :type stack: ClassMatrixStack
+        :param matrixes: phrase matrixes
+        :type matrixes: list[numpy.ndarray]
+        :param stage: observed values prefix
+        :type stage: str
+        :return: squared distances (indexes - exampleNumber, phraseNumber)
+        :rtype: numpy.ndarray
+        """
+        if not self.pruning or self.matching != MATCHING_ASSIGNMENT:
+            return stack.assignment_distances_many(matrixes)
+        distances, solved = stack.pruned_assignment_distances_many(matrixes)
+        for count in solved:
+            self.instrumentation.observe(stage + '.solved', count)
+            self.instrumentation.observe(stage + '.pruned', len(stack.matrixes) - count)
+        return distances
+
+    @staticmethod
+    def _trimmed_class_distances(stack, matrixes, distances):
+        """
+        Get class distances of every phrase from its squared example distances with zero distances trimmed
+        like in permutation mode
+        :param stack: examples
+        :type stack: ClassMatrixStack
+        :param matrixes: phrase matrixes
+        :type matrixes: list[numpy.ndarray]
+        :param distances: squared distances (indexes - exampleNumber, phraseNumber)
+        :type distances: numpy.ndarray
+        :return: distances (indexes - phraseNumber, classNumber in stack order)
+        :rtype: numpy.ndarray
+        """
+        return stack.class_distances(stack.trimmed_assignment_distances(matrixes, distances)).T
+
+    def _candidates(self, matrixes):
+        """
+        Get candidate examples of every phrase from nearest neighbour index or cascade shortlist
+        (permutation matching always compares every example)
+        :param matrixes: phrase matrixes
+        :type matrixes: list[numpy.ndarray]
+        :return: sorted candidate example indexes of every phrase (None - every example is candidate)
+        :rtype: list[numpy.ndarray]|NoneType
+        """
+        if self.matching != MATCHING_ASSIGNMENT:
+            return None
+        stack = self._matrix_stack
+        vector_size = stack.matrixes.shape[2]
+        signatures = numpy.array([matrix.sum(0) for matrix in matrixes]).reshape((len(matrixes), vector_size))
+        if self.ann_index is not None and self.ann_probes < self.ann_index.max_lists:
+            return self.ann_index.search(signatures, self.ann_probes)
+        if 0 < self.cascade_shortlist < len(stack.matrixes):
+            return stack.shortlist(signatures, self.cascade_shortlist)
+        return None
+
+    def _candidate_distances(self, matrixes, candidates):
+        """
+        Get class distances of every phrase calculated with its candidate examples only
+        :param matrixes: phrase matrixes
+        :type matrixes: list[numpy.ndarray]
+        :param candidates: sorted candidate example indexes of every phrase (every class must have candidate)
+        :type candidates: list[numpy.ndarray]
+        :return: distances (indexes - phraseNumber, classNumber in axis order)
+        :rtype: numpy.ndarray
+        """
+        stack = self._matrix_stack
+        result = []
+        for matrix, phrase_candidates in zip(matrixes, candidates):
+            self.instrumentation.observe('classify.candidates', len(phrase_candidates))
+            # other examples are treated as far ones, so zero distances are trimmed by their places in whole stack
+            distances = numpy.full((len(stack.matrixes), 1), numpy.inf)
+            distances[phrase_candidates] = self._stack_assignment_distances(
+                stack.subset(phrase_candidates), [matrix], 'classify'
+            )
+            result.append(self._trimmed_class_distances(stack, [matrix], distances)[0])
+        return numpy.array(result)
+
+    def cascade_recall(self, texts):
+        """
+        Compare approximate (cascade or index) class distances with exhaustive search
+        :param texts: texts (e.g. sample of real queries)
+        :type texts: list[str]
+        :return: class_recall - part of (text, class) pairs with exact class distance,
+                 top_class_recall - part of texts with same nearest class,
+                 candidates - mean candidate examples per text, examples - stored example count
+        :rtype: dict[str, float]
+        """
+        vector_size = self.matrix_builder.word2vec.vector_size
+        matrixes = [
+            numpy.reshape(self.matrix_builder.words_matrix(self.matrix_builder.exploder.explode(text)), (-1, vector_size))
+            for text in texts
+        ]
+        example_count = len(self._matrix_stack.matrixes)
+        candidates = self._candidates(matrixes)
+        exact = self._assignment_distances_many(matrixes, exact=True)
+        if candidates is None:
+            approximate = exact
+            candidate_count = float(example_count)
+        else:
+            approximate = self._candidate_distances(matrixes, candidates)
+            candidate_count = float(numpy.mean([len(item) for item in candidates]))
+        return {
+            'class_recall': float(numpy.isclose(approximate, exact).mean()),
+            'top_class_recall': float((approximate.argmin(1) == exact.argmin(1)).mean()),
+            'candidates': candidate_count,
+            'examples': example_count,
+        }
+
+    def _classes_confidences(self, confidences):
+        """
+        Get classes sorted by confidence
+        :param confidences: confidences (in axis order)
+        :type confidences: numpy.ndarray
         :return: classes
         :rtype: OrderedDict[str, float]
         """
         def class_confidence_pair_comparer(pair):
             _, conf = pair
             return conf
-        matrix = self.matrix_builder.phrase_matrix(text)
-        class_distances = []
-        for permutation in [list(item) for item in permutations(matrix)]:
-            permutation_part = numpy.array(permutation[:self.matrix_builder.sentence_matrix_length])
-            add_rows = self.matrix_builder.sentence_matrix_length - len(permutation_part)
-            right_shape = (self.matrix_builder.sentence_matrix_length, self.matrix_builder.word2vec.vector_size,)
-            if add_rows > 0:
-                empty_rows = numpy.zeros((add_rows, self.matrix_builder.word2vec.vector_size,))
-                permutation_part = numpy.append(permutation_part, empty_rows)\
-                    .reshape(right_shape)
-            matrix_distances = self._matrix_distances(permutation_part)
-            class_distances.append([matrix_distances[axis] for axis in self._axis])
-        class_distances = numpy.array(class_distances)
-        distances = []
-        for i in range(0, len(self._axis)):
-            column = class_distances[:, i]
-            distances.append(column.min())
-        confidences = self.confidence_converter.calculate(numpy.array(distances))
         class_confidence_pairs = []
         for i, class_name in enumerate(self._axis):
             class_confidence_pairs.append((class_name, confidences[i],))
@@ -187,6 +756,101 @@ class Word2VecClassifier(BaseClassifier):
             result[class_name] = confidence
         return result
 
+    def classify(self, text):
+        """
+        Classify text
+        :param text: text
+        :type text: str
+        :return: classes
+        :rtype: OrderedDict[str, float]
+        """
+        return self.classify_many([text])[0]
+
+    def classify_many(self, texts):
+        """
+        Classify batch of texts.
+        Distances of all texts are calculated together and confidences are predicted with one solver call.
+        Results are cached by exploded text words (cache is cleared on train).
+        :param texts: texts
+        :type texts: list[str]
+        :return: classes of every text
+        :rtype: list[OrderedDict[str, float]]
+        """
+        instrumentation = self.instrumentation
+        with instrumentation.stage('classify'):
+            results = [None] * len(texts)
+            pending = OrderedDict()
+            with instrumentation.stage('classify.explode'):
+                for i, text in enumerate(texts):
+                    key = (self.matching, self.ann_probes, self.cascade_shortlist,
+                           tuple(self.matrix_builder.exploder.explode(text)))
+                    results[i] = self.result_cache.get(key)
+                    if results[i] is None:
+                        pending.setdefault(key, []).append(i)
+            instrumentation.observe('classify.texts', len(texts))
+            instrumentation.observe('classify.cache_hits', len(texts) - sum(len(indexes) for indexes in pending.values()))
+            if len(pending) > 0:
+                self._classify_pending(pending, results)
+        return [OrderedDict(result) for result in results]
+
+    def _classify_pending(self, pending, results):
+        """
+        Classify texts missing in result cache and cache results
+        :param pending: cache key (matching, ann_probes, cascade_shortlist, exploded words) - indexes of texts
+        :type pending: OrderedDict[tuple, list[int]]
+        :param results: results of every text (filled here)
+        :type results: list[OrderedDict[str, float]|NoneType]
+        """
+        instrumentation = self.instrumentation
+        with instrumentation.stage('classify.embed'):
+            matrixes = [self.matrix_builder.words_matrix(list(key[-1])) for key in pending.keys()]
+        instrumentation.observe('classify.words', sum(len(matrix) for matrix in matrixes))
+        with instrumentation.stage('classify.distances'):
+            distances = self._assignment_distances_many(matrixes)
+        with instrumentation.stage('classify.solver'):
+            confidences = self.confidence_converter.calculate_many(distances)
+        for (key, indexes), row in zip(pending.items(), confidences):
+            result = self._classes_confidences(row)
+            self.result_cache.put(key, result)
+            for i in indexes:
+                results[i] = result
+
+    def export_word2vec(self, mapped_path, top_words=0):
+        """
+        Write pruned word2vec model (training words and top_words most frequent words) in mapped format
+        and use it in config, so deployed classifier loads few megabytes of vectors instead of whole model.
+        Words out of pruned model get zero vectors.
+        :param mapped_path: pruned model path (without extensions)
+        :type mapped_path: str
+        :param top_words: count of most frequent words to keep
+        :type top_words: int
+        """
+        MappedWord2Vec.prune(self.matrix_builder.word2vec, self.matrix_builder.vocabulary, mapped_path, top_words)
+        self.word2vec_mapped_path = mapped_path
+
+    def _config_header(self):
+        """
+        Get config part without class matrixes and solver
+        :return: config
+        :rtype: dict
+        """
+        return {
+            'word2vec_path': self.word2vec_path,
+            'word2vec_mapped_path': self.word2vec_mapped_path,
+            'exploder_stop_words': self.matrix_builder.exploder.stop_words,
+            'sentence_matrix_length': self.matrix_builder.sentence_matrix_length,
+            'matching': self.matching,
+            'vocabulary': sorted(self.matrix_builder.vocabulary),
+            'storage_dtype': self.storage_dtype,
+            'ann_list_size': self.ann_list_size,
+            'ann_probes': self.ann_probes,
+            'cascade_shortlist': self.cascade_shortlist,
+            'pruning': self.pruning,
+            'cache_size': self.result_cache.max_size,
+            'cache_ttl': self.result_cache.ttl,
+            'word_cache_size': self.matrix_builder.word_cache.max_size if self.matrix_builder.word_cache else 0
+        }
+
     def _get_config(self):
         """
         Get config dict
@@ -194,14 +858,92 @@ class Word2VecClassifier(BaseClassifier):
         :rtype: dict
         """
         class_sentence_matrixed = {}
+        class_sentence_lengths = {}
         for class_name, matrix in self.class_sentence_matrixed.items():
             class_sentence_matrixed[class_name] = matrix.tolist()
-        return {
-            'word2vec_path': self.word2vec_path,
-            'exploder_stop_words': self.matrix_builder.exploder.stop_words,
+            class_sentence_lengths[class_name] = self.class_sentence_lengths[class_name].tolist()
+        config = self._config_header()
+        config.update({
             'class_sentence_matrixed': class_sentence_matrixed,
             'confidence_converter_config': self.confidence_converter.config,
-            'sentence_matrix_length': self.matrix_builder.sentence_matrix_length
+            'class_sentence_lengths': class_sentence_lengths,
+            'ann_index': self.ann_index.config if self.ann_index is not None else None,
+            'class_sentence_scales': {
+                class_name: scales.tolist() for class_name, scales in self.class_sentence_scales.items()
+            } if self.class_sentence_scales is not None else None
+        })
+        return config
+
+    def save_binary(self, path):
+        """
+        Save classifier to directory: small JSON header and raw arrays
+        of stacked class matrixes, example word counts and norms, and solver weights
+        (plus example signatures if cascade uses them). Only canonical examples are stored:
+        permutation mode computes its distances from them after loading
+        :param path: directory path
+        :type path: str
+        """
+        stack = self._matrix_stack
+        weights = self.confidence_converter.weights
+        header = self._config_header()
+        header.update({
+            'class_names': stack.class_names,
+            'offsets': stack.offsets.tolist(),
+            'solver_class_count': self.confidence_converter.class_count,
+            'solver_weight_count': len(weights)
+        })
+        arrays = {
+            'matrixes': stack.matrixes,
+            'lengths': stack.lengths,
+            'row_norms': stack.row_norms
+        }
+        if stack.scales is not None:
+            arrays['scales'] = stack.scales
+        for i, weight in enumerate(weights):
+            arrays['solver_{0}'.format(i)] = weight
+        if self.ann_index is not None:
+            arrays.update({
+                'ann_centroids': self.ann_index.centroids,
+                'ann_centroid_classes': self.ann_index.centroid_classes,
+                'ann_list_offsets': self.ann_index.list_offsets,
+                'ann_list_examples': self.ann_index.list_examples
+            })
+        if self.cascade_shortlist > 0 and self.matching == MATCHING_ASSIGNMENT:
+            arrays['signatures'] = stack.signatures
+        write_arrays(path, header, arrays)
+
+    @classmethod
+    def load_binary(cls, path, mmap=True, **kwargs):
+        """
+        Load classifier saved by save_binary. Class matrixes are memory-mapped (if mmap) and used without copying.
+        :param path: directory path
+        :type path: str
+        :param mmap: memory-map arrays instead of reading them
+        :type mmap: bool
+        :param kwargs: additional constructor arguments (e.g. word2vec)
+        :rtype: Word2VecClassifier
+        """
+        header, arrays = read_arrays(path, mmap)
+        stack = ClassMatrixStack.from_stacked(
+            header.pop('class_names'), arrays['matrixes'], arrays['lengths'], header.pop('offsets'),
+            arrays['row_norms'], arrays.get('scales')
+        )
+        solver_config = {
+            'class_count': header.pop('solver_class_count'),
+            'weights': [arrays['solver_{0}'.format(i)] for i in range(header.pop('solver_weight_count'))]
         }
+        if 'word2vec' in kwargs:
+            header.pop('word2vec_path')
+        header.update(kwargs)
+        classifier = cls(confidence_converter_config=solver_config, **header)
+        if 'signatures' in arrays:
+            stack._signatures = arrays['signatures']
+        classifier._set_matrix_stack(stack)
+        if 'ann_centroids' in arrays:
+            classifier.ann_index = IVFIndex(
+                arrays['ann_centroids'], arrays['ann_centroid_classes'],
+                arrays['ann_list_offsets'], arrays['ann_list_examples']
+            )
+        return classifier
 
 BaseClassifier.register('word2vec', Word2VecClassifier)
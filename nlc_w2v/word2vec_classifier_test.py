@@ -1,7 +1,16 @@
+import math
 import unittest
 import os
-from .word2vec_classifier import Word2VecClassifier
+import tempfile
+from itertools import permutations
+import numpy
+from .word2vec_classifier import Word2VecClassifier, MATCHING_ASSIGNMENT, MATCHING_PERMUTATIONS
 from .exploder import Exploder
+from .class_matrix_builder import ClassMatrixBuilder
+from .class_matrix_stack import ClassMatrixStack
+from .benchmark import synthetic_word2vec, synthetic_classes, synthetic_phrases
+from .instrumentation import MetricsRegistry
+from .lru_cache import LRUCache
 from .word2vec_loader import load as word2vec_load
 from nlc import BaseClassifier
 from nlc.classifier_test import ClassifierTest
@@ -75,3 +84,293 @@ class Word2VecClassifierTest(ClassifierTest):
         ]
         path = os.path.join(os.path.dirname(__file__), "test", "glove.6B.50d.bin")
         return Word2VecClassifier(word2vec_path=path, exploder=Exploder(stop_words))
+
+
+class Word2VecAssignmentClassifierTest(Word2VecClassifierTest):
+    def build_classifier(self):
+        classifier = super().build_classifier()
+        classifier.matching = MATCHING_ASSIGNMENT
+        return classifier
+
+
+class SyntheticWord2VecClassifierTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.word2vec = synthetic_word2vec(os.path.join(self.directory.name, "vectors"), 300, 10)
+        self.classes = synthetic_classes(self.word2vec, 3, 5, 3)
+        # permutations of only two word example are leading and trailing zeros of its class
+        self.classes["pair"] = ["w1 w2"]
+        self.texts = synthetic_phrases(self.word2vec, 10, 3) + ["w2 w1", "w1 unknown w2"] + \
+            [example for examples in self.classes.values() for example in examples]
+
+    def tearDown(self):
+        del self.word2vec
+        self.directory.cleanup()
+
+    def build_classifier(self, **kwargs):
+        return Word2VecClassifier(word2vec=self.word2vec, exploder=Exploder([]), **kwargs)
+
+    def assert_same_results(self, expected, actual, places=5):
+        for expected_classes, actual_classes in zip(expected.classify_many(self.texts), actual.classify_many(self.texts)):
+            self.assertEqual(list(expected_classes.keys()), list(actual_classes.keys()))
+            for class_name, confidence in expected_classes.items():
+                self.assertAlmostEqual(confidence, actual_classes[class_name], places=places)
+
+    @staticmethod
+    def permutation_distances(classifier, matrix):
+        """
+        Class distances of permutation matching with every example and phrase permutation expanded
+        (phrase permutations are cut to sentence matrix length)
+        """
+        stack = classifier._matrix_stack
+        ranges = list(zip(stack.offsets[:-1], stack.offsets[1:]))
+        expanded = ClassMatrixStack(
+            stack.class_names,
+            [ClassMatrixBuilder.permutation_matrix(stack.dequantized(start, end), stack.lengths[start:end])
+             for start, end in ranges],
+            [ClassMatrixStack.permutation_lengths(stack.lengths[start:end]) for start, end in ranges]
+        )
+        length = stack.matrixes.shape[1]
+        parts = numpy.zeros((math.factorial(len(matrix)), length, matrix.shape[1]))
+        for i, permutation in enumerate(permutations(range(len(matrix)))):
+            part = matrix[list(permutation[:length])]
+            parts[i, :len(part)] = part
+        return expanded.class_distances(expanded.matrix_distances(parts), trim_zeros=True).min(1)
+
+    def test_binary_storage(self):
+        for matching in [MATCHING_PERMUTATIONS, MATCHING_ASSIGNMENT]:
+            classifier = self.build_classifier(matching=matching)
+            classifier.train(self.classes)
+            path = os.path.join(self.directory.name, matching)
+            classifier.save_binary(path)
+            self.assertFalse([name for name in os.listdir(path) if name.startswith("permutation")])
+            self.assert_same_results(classifier, Word2VecClassifier.load_binary(path, word2vec=self.word2vec))
+
+    def test_storage_dtypes(self):
+        # whether rounded copy of only example is zero distance (and trimmed) depends on rounding
+        classes = {class_name: examples for class_name, examples in self.classes.items() if class_name != "pair"}
+        for matching in [MATCHING_PERMUTATIONS, MATCHING_ASSIGNMENT]:
+            classifier = self.build_classifier(matching=matching)
+            classifier.train(classes)
+            config = dict(classifier._get_config(), word2vec=self.word2vec)
+            expected = classifier.classify_many(self.texts)
+            for dtype in ["float32", "float16", "int8"]:
+                stored = Word2VecClassifier(**dict(config, storage_dtype=dtype))
+                delta = 0.0
+                for expected_classes, actual_classes in zip(expected, stored.classify_many(self.texts)):
+                    for class_name, confidence in expected_classes.items():
+                        delta = max(delta, abs(confidence - actual_classes[class_name]))
+                self.assertLess(delta, 0.05)
+
+    def test_parallel_train(self):
+        classifier = self.build_classifier()
+        classifier.train(self.classes)
+        parallel = self.build_classifier(train_processes=2)
+        parallel.train(self.classes)
+        for class_name, matrix in classifier.class_sentence_matrixed.items():
+            numpy.testing.assert_array_equal(matrix, parallel.class_sentence_matrixed[class_name])
+            numpy.testing.assert_array_equal(classifier.class_sentence_lengths[class_name],
+                                             parallel.class_sentence_lengths[class_name])
+        self.assertEqual(classifier.matrix_builder.vocabulary, parallel.matrix_builder.vocabulary)
+        numpy.testing.assert_allclose(parallel._fits(False)[0], classifier._fits(False)[0])
+
+    def test_duplicate_statistics(self):
+        classifier = self.build_classifier()
+        duplicate = " ".join(reversed(self.classes["class0"][0].split())).upper()
+        classes = dict(self.classes, class0=self.classes["class0"] + [duplicate, self.classes["class1"][0]])
+        classifier.train(classes)
+        statistics = classifier.matrix_builder.statistics
+        self.assertEqual(statistics["examples"], 18)
+        self.assertEqual(statistics["duplicates"], 1)
+        self.assertEqual(statistics["class_duplicates"]["class0"], 1)
+        self.assertEqual(statistics["unique_examples"], 17)
+        self.assertEqual(statistics["conflicting_word_sets"], 1)
+        self.assertEqual(statistics["conflicting_examples"], 2)
+
+    def test_result_cache(self):
+        classifier = self.build_classifier()
+        classifier.matrix_builder.word_cache = LRUCache(100)
+        classifier.train(self.classes)
+        first = classifier.classify("W1 w5?")
+        second = classifier.classify("w1, w5")
+        self.assertEqual(list(first.items()), list(second.items()))
+        self.assertEqual(classifier.result_cache.hits, 1)
+        self.assertEqual(classifier.result_cache.misses, 1)
+        second["class0"] = -1.0
+        self.assertNotEqual(classifier.classify("w1 w5")["class0"], -1.0)
+        # retrained solver starts from new weights, so only cache state is compared
+        classifier.train(self.classes)
+        self.assertEqual(len(classifier.result_cache), 0)
+        hits, misses = classifier.result_cache.hits, classifier.result_cache.misses
+        classifier.classify("w1 w5")
+        self.assertEqual((classifier.result_cache.hits, classifier.result_cache.misses), (hits, misses + 1))
+
+    def test_instrumentation(self):
+        classifier = self.build_classifier(instrumentation=MetricsRegistry())
+        classifier.train(self.classes)
+        classifier.classify_many(["w1 w5", "w7 w9", "w1 w5"])
+        classifier.classify("w7 w9")
+        metrics = classifier.instrumentation.snapshot()
+        for stage in ["train", "train.explode", "train.embed", "train.fits", "train.solver",
+                      "classify", "classify.explode", "classify.embed", "classify.distances", "classify.solver"]:
+            self.assertIn(stage + ".seconds", metrics)
+        self.assertEqual(metrics["classify.texts"]["total"], 4)
+        self.assertEqual(metrics["classify.cache_hits"]["total"], 1)
+        self.assertEqual(metrics["classify.solver.seconds"]["count"], 1)
+
+    def test_cascade(self):
+        classifier = self.build_classifier(matching=MATCHING_ASSIGNMENT, cascade_shortlist=3)
+        classifier.train(self.classes)
+        recall = classifier.cascade_recall(self.texts)
+        self.assertLessEqual(recall["candidates"], 3 + len(self.classes))
+        self.assertGreater(recall["top_class_recall"], 0.5)
+        classifier.cascade_shortlist = 100
+        self.assertEqual(classifier.cascade_recall(self.texts)["class_recall"], 1.0)
+
+    def test_pruning(self):
+        classifier = self.build_classifier(matching=MATCHING_ASSIGNMENT)
+        classifier.train(self.classes)
+        builder = classifier.matrix_builder
+        matrixes = [builder.words_matrix(builder.exploder.explode(text)) for text in self.texts]
+        expected = classifier._assignment_distances_many(matrixes)
+        classifier.pruning = True
+        classifier.instrumentation = MetricsRegistry()
+        numpy.testing.assert_array_equal(classifier._assignment_distances_many(matrixes), expected)
+        metrics = classifier.instrumentation.snapshot()
+        self.assertEqual(metrics["classify.solved"]["total"] + metrics["classify.pruned"]["total"],
+                         len(self.texts) * len(classifier._matrix_stack.matrixes))
+
+    def test_incremental_train(self):
+        added = ["w3 w4 w5"]
+        classes = dict(self.classes, class1=self.classes["class1"] + added, travel=["w6 w7", "w8 w9 w10"])
+        for matching in [MATCHING_PERMUTATIONS, MATCHING_ASSIGNMENT]:
+            classifier = self.build_classifier(matching=matching)
+            classifier.train(self.classes)
+            classifier.add_examples("class1", added)
+            classifier.add_class("travel", classes["travel"])
+            trained = self.build_classifier(matching=matching)
+            trained.train(classes)
+            for class_name, matrix in trained.class_sentence_matrixed.items():
+                numpy.testing.assert_array_equal(matrix, classifier.class_sentence_matrixed[class_name])
+            self.assertEqual(classifier.confidence_converter.class_count, 5)
+            self.assertEqual(set(classifier.classify("w6 w8").keys()), set(classes.keys()))
+            classifier.remove_examples("travel", classes["travel"])
+            self.assertEqual(set(classifier.class_sentence_matrixed.keys()), set(self.classes.keys()))
+            self.assertEqual(classifier.confidence_converter.class_count, 4)
+            with self.assertRaises(AttributeError):
+                classifier.add_class("class1", ["w1"])
+
+    def test_default_matching(self):
+        classifier = self.build_classifier()
+        self.assertEqual(classifier.matching, MATCHING_PERMUTATIONS)
+        classifier.matching = MATCHING_ASSIGNMENT
+        classifier.train(self.classes)
+        config = classifier._get_config()
+        del config["matching"]
+        self.assertEqual(Word2VecClassifier(**dict(config, word2vec=self.word2vec)).matching, MATCHING_PERMUTATIONS)
+
+    def test_assignment_only_options(self):
+        for name, value in [("ann_list_size", 2), ("cascade_shortlist", 3), ("pruning", True)]:
+            with self.assertRaises(AttributeError):
+                self.build_classifier(**{name: value})
+            # options set after construction are ignored in permutation matching
+            classifier = self.build_classifier(instrumentation=MetricsRegistry())
+            setattr(classifier, name, value)
+            classifier.train(self.classes)
+            self.assertIsNone(classifier.ann_index)
+            self.assertIsNone(classifier._matrix_stack._signatures)
+            recall = classifier.cascade_recall(self.texts)
+            self.assertEqual(recall["candidates"], recall["examples"])
+            classifier.classify_many(self.texts)
+            self.assertNotIn("classify.pruned", classifier.instrumentation.metrics)
+
+    def test_legacy_config(self):
+        # "w8 zz" ends with out of vocabulary word: its zero row looks like padding
+        classes = dict(self.classes, legacy=["w1 w2 w3 w4 w5", "w6 w7", "w8 zz"])
+        classifier = self.build_classifier()
+        classifier.train(classes)
+        config = dict(classifier._get_config(), word2vec=self.word2vec)
+        lengths = config.pop("class_sentence_lengths")
+        # configs without example word counts store every permutation of every example
+        config["class_sentence_matrixed"] = {
+            class_name: ClassMatrixBuilder.permutation_matrix(numpy.array(matrix), lengths[class_name]).tolist()
+            for class_name, matrix in config["class_sentence_matrixed"].items()
+        }
+        self.assertEqual(len(config["class_sentence_matrixed"]["legacy"]), 124)
+        legacy = Word2VecClassifier(**config)
+        for class_name, matrix in classifier.class_sentence_matrixed.items():
+            numpy.testing.assert_array_equal(legacy.class_sentence_matrixed[class_name], matrix)
+            numpy.testing.assert_array_equal(legacy.class_sentence_lengths[class_name],
+                                             classifier.class_sentence_lengths[class_name])
+        self.assert_same_results(classifier, legacy)
+
+    def test_matching_modes(self):
+        classifier = self.build_classifier(matching=MATCHING_PERMUTATIONS)
+        classifier.train(self.classes)
+        for text in self.texts:
+            matrix = classifier.matrix_builder.words_matrix(classifier.matrix_builder.exploder.explode(text))
+            matrix = numpy.reshape(matrix, (len(matrix), -1))
+            expected = self.permutation_distances(classifier, matrix)
+            numpy.testing.assert_allclose(classifier._matrix_distances(matrix), expected, rtol=1e-6)
+            if text in self.classes["class0"]:
+                self.assertEqual(expected[classifier._axis.index("class0")], 0.0)
+            if text == "w2 w1":
+                self.assertGreater(expected[classifier._axis.index("pair")], 0.0)
+        classifier.matching = MATCHING_PERMUTATIONS
+        nbytes = classifier.nbytes
+        expected = classifier.classify_many(self.texts)
+        # permutations are never expanded
+        self.assertEqual(classifier.nbytes, nbytes)
+        classifier.matching = MATCHING_ASSIGNMENT
+        for expected_classes, actual_classes in zip(expected, classifier.classify_many(self.texts)):
+            self.assertEqual(list(expected_classes.keys()), list(actual_classes.keys()))
+            for class_name, confidence in expected_classes.items():
+                self.assertAlmostEqual(confidence, actual_classes[class_name], places=5)
+
+    def test_incremental_ann_index(self):
+        classifier = self.build_classifier(matching=MATCHING_ASSIGNMENT, ann_list_size=2)
+        classifier.train(self.classes)
+        index = classifier.ann_index
+        classifier.add_examples("class1", ["w3 w4 w5"])
+        stack = classifier._matrix_stack
+        self.assertEqual(sorted(classifier.ann_index.list_examples.tolist()), list(range(len(stack.matrixes))))
+        # clusters of other classes are kept
+        for class_name in ["class0", "pair"]:
+            class_index = stack.class_names.index(class_name)
+            numpy.testing.assert_array_equal(classifier.ann_index._class_lists(class_index)[0],
+                                             index._class_lists(class_index)[0])
+        classifier.ann_probes = classifier.ann_index.max_lists
+        self.assertEqual(classifier.cascade_recall(self.texts)["class_recall"], 1.0)
+
+    def test_incremental_fits(self):
+        added = ["w3 w4 w5", "w6 w7"]
+        classes = dict(self.classes, class1=self.classes["class1"] + added, longer=["w8 w9 w10 w11"])
+        del classes["pair"]
+        for matching in [MATCHING_PERMUTATIONS, MATCHING_ASSIGNMENT]:
+            classifier = self.build_classifier(matching=matching, instrumentation=MetricsRegistry())
+            classifier.train(self.classes)
+            metrics = classifier.instrumentation.metrics
+            stack = classifier._matrix_stack
+            self.assertEqual(metrics["train.fit_distances"]["total"], len(stack.matrixes) * len(stack.class_names))
+            for change, class_name in [(lambda: classifier.add_examples("class1", added), "class1"),
+                                       (lambda: classifier.add_class("longer", classes["longer"]), "longer"),
+                                       (lambda: classifier.remove_examples("pair", ["w1 w2"]), None)]:
+                computed = metrics["train.fit_distances"]["total"]
+                change()
+                # only rows of changed class and column of changed class are calculated
+                expected = 0
+                if class_name is not None:
+                    index = stack.class_names.index(class_name)
+                    rows = stack.offsets[index + 1] - stack.offsets[index]
+                    expected = rows * len(stack.class_names) + len(stack.matrixes) - rows
+                self.assertEqual(metrics["train.fit_distances"]["total"] - computed, expected)
+            trained = self.build_classifier(matching=matching)
+            trained.train(classes)
+            for class_name, matrix in trained.class_sentence_matrixed.items():
+                numpy.testing.assert_array_equal(classifier.class_sentence_matrixed[class_name], matrix)
+            self.assertIs(classifier._matrix_stack, stack)
+            numpy.testing.assert_allclose(classifier._fit_distances, trained._fits(False)[0])
+            numpy.testing.assert_array_equal(classifier._fits(False)[1], trained._fits(False)[1])
+            vocabulary = set(classifier.matrix_builder.vocabulary)
+            classifier.remove_examples("class1", ["w3 unknown"])
+            self.assertEqual(classifier.matrix_builder.vocabulary, vocabulary)
@@ -1,33 +1,273 @@
-from gensim.models import Word2Vec
+from contextlib import contextmanager
+import hashlib
+import os
+import tempfile
+import numpy
+try:
+    import fcntl
+except ImportError:
+    # no advisory locks (e.g. on Windows), converted models shouldn't be replaced while they are read there
+    fcntl = None
 
+# (path, mapped_path) - model, so converted copies (e.g. pruned ones) of same binary model are different models
 loaded = {}
+# id(model) - (path, mapped_path) of every loaded model, so path is found without scanning loaded models
+loaded_paths = {}
+# (path, size, modification time) - content hash, so unchanged files are read once
+_content_hashes = {}
+HASH_BLOCK_SIZE = 2 ** 20
+# Permissions of converted model files (temporary files are created readable by owner only)
+MAPPED_FILE_MODE = 0o644
 
 
-def load(path):
+@contextmanager
+def _mapped_lock(mapped_path, exclusive=False):
     """
-    Load word2vec binary model or give loaded
+    Lock converted model files: shared while vocab and matrix are opened, exclusive while they are replaced,
+    so reader never gets vocab and matrix of different writes.
+    Reader which can't create lock file (read-only directory) reads without lock.
+    :param mapped_path: converted model path (without extensions)
+    :type mapped_path: str
+    :param exclusive: exclusive (writer) lock?
+    :type exclusive: bool
+    """
+    if fcntl is None:
+        yield
+        return
+    try:
+        lock_file = open(mapped_path + '.lock', 'a')
+    except OSError:
+        if exclusive:
+            raise
+        yield
+        return
+    with lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        yield
+
+
+class MappedWord2Vec:
+    """
+    Word vectors stored as vocab index (one word per line) and raw float32 matrix (.npy),
+    matrix is memory-mapped read-only so processes share same pages
+    """
+
+    def __init__(self, mapped_path):
+        """
+        Open converted model
+        :param mapped_path: converted model path (without extensions)
+        :type mapped_path: str
+        """
+        self.mapped_path = mapped_path
+        with _mapped_lock(mapped_path):
+            with open(mapped_path + '.vocab', encoding='utf-8') as vocab_file:
+                self.index2word = vocab_file.read().split('\n')[:-1]
+            # mapping keeps opened matrix even if it's replaced later
+            self.syn0 = numpy.load(mapped_path + '.npy', mmap_mode='r')
+        self.vocab = {word: index for index, word in enumerate(self.index2word)}
+        self.vector_size = self.syn0.shape[1]
+
+    @staticmethod
+    def write(words, matrix, mapped_path):
+        """
+        Write word vectors in mapped format
+        :param words: words
+        :type words: list[str]
+        :param matrix: word vectors (in words order)
+        :type matrix: numpy.ndarray
+        :param mapped_path: converted model path (without extensions)
+        :type mapped_path: str
+        """
+        # Write to unique temporary files of same directory (concurrent writers don't share them) and rename them,
+        # so other processes never see partial model. Matrix is renamed first: vocab is completion marker
+        # for readers checking both files exist (see exists), replacing ones are serialized by _mapped_lock
+        directory, name = os.path.split(os.path.abspath(mapped_path))
+        vocab_fd, vocab_path = tempfile.mkstemp(prefix=name + '.vocab.', suffix='.tmp', dir=directory)
+        matrix_fd, matrix_path = tempfile.mkstemp(prefix=name + '.npy.', suffix='.tmp', dir=directory)
+        try:
+            with open(vocab_fd, 'w', encoding='utf-8') as vocab_file, open(matrix_fd, 'wb') as matrix_file:
+                for word in words:
+                    vocab_file.write(word + '\n')
+                numpy.save(matrix_file, numpy.asarray(matrix, dtype=numpy.float32))
+            for path in (vocab_path, matrix_path):
+                os.chmod(path, MAPPED_FILE_MODE)
+            with _mapped_lock(mapped_path, exclusive=True):
+                os.replace(matrix_path, mapped_path + '.npy')
+                os.replace(vocab_path, mapped_path + '.vocab')
+        finally:
+            for path in (vocab_path, matrix_path):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    @staticmethod
+    def convert(model, mapped_path):
+        """
+        Write model in mapped format
+        :param model: word2vec model
+        :type model: gensim.models.Word2Vec
+        :param mapped_path: converted model path (without extensions)
+        :type mapped_path: str
+        """
+        MappedWord2Vec.write(model.index2word, model.syn0, mapped_path)
+
+    @staticmethod
+    def prune(model, words, mapped_path, top_words=0):
+        """
+        Write model subset in mapped format: given words (if model knows them)
+        and top_words first (most frequent) model words
+        :param model: word2vec model
+        :type model: Word2Vec|MappedWord2Vec
+        :param words: words to keep
+        :type words: collections.Iterable[str]
+        :param mapped_path: converted model path (without extensions)
+        :type mapped_path: str
+        :param top_words: count of most frequent words to keep
+        :type top_words: int
+        """
+        kept = list(model.index2word[:top_words])
+        kept_set = set(kept)
+        for word in sorted(words):
+            if word in model.vocab and word not in kept_set:
+                kept.append(word)
+                kept_set.add(word)
+        matrix = numpy.zeros((len(kept), model.vector_size), dtype=numpy.float32)
+        for i, word in enumerate(kept):
+            matrix[i] = model[word]
+        MappedWord2Vec.write(kept, matrix, mapped_path)
+
+    @staticmethod
+    def exists(mapped_path):
+        """
+        Is model converted?
+        :param mapped_path: converted model path (without extensions)
+        :type mapped_path: str
+        :rtype: bool
+        """
+        return os.path.exists(mapped_path + '.vocab') and os.path.exists(mapped_path + '.npy')
+
+    def __getitem__(self, word):
+        return self.syn0[self.vocab[word]]
+
+    def __contains__(self, word):
+        return word in self.vocab
+
+    def word_matrix(self, words):
+        """
+        Get matrix of word vectors (zero rows for unknown words), read directly from mapped matrix
+        :param words: words
+        :type words: list[str]
+        :return: matrix of [word, wordVectorComponent]
+        :rtype: numpy.ndarray
+        """
+        indexes = [self.vocab.get(word, -1) for word in words]
+        result = numpy.zeros((len(words), self.vector_size), dtype=self.syn0.dtype)
+        known = [i for i, index in enumerate(indexes) if index >= 0]
+        result[known] = self.syn0[[indexes[i] for i in known]]
+        return result
+
+
+def _load_binary_model(path):
+    """
+    Load word2vec binary model with gensim (imported here, so memory-mapped models are used without it)
     :param path: path
     :type path: str
     :return: model
-    :rtype: Word2Vec
+    :rtype: gensim.models.Word2Vec
     """
-    if path in loaded.keys():
-        return loaded[path]
-    else:
-        result = Word2Vec.load_word2vec_format(path, binary=True)
-        loaded[path] = result
+    from gensim.models import Word2Vec
+    return Word2Vec.load_word2vec_format(path, binary=True)
+
+
+def load(path, mapped_path=None):
+    """
+    Load word2vec binary model or give loaded.
+    If mapped_path given model is converted there once (see MappedWord2Vec)
+    and memory-mapped on every next load.
+    :param path: path
+    :type path: str
+    :param mapped_path: converted model path (without extensions)
+    :type mapped_path: str|NoneType
+    :return: model
+    :rtype: gensim.models.Word2Vec|MappedWord2Vec
+    """
+    key = (path, mapped_path)
+    # single lookup, so model unloaded by other thread meanwhile is loaded again
+    result = loaded.get(key)
+    if result is not None:
         return result
+    elif mapped_path is not None:
+        if not MappedWord2Vec.exists(mapped_path):
+            MappedWord2Vec.convert(_load_binary_model(path), mapped_path)
+        result = MappedWord2Vec(mapped_path)
+    else:
+        result = _load_binary_model(path)
+    loaded[key] = result
+    loaded_paths[id(result)] = key
+    return result
+
+
+def unload(path, mapped_path=None):
+    """
+    Forget loaded model (it's freed when its last user drops it)
+    :param path: path
+    :type path: str
+    :param mapped_path: converted model path (same as on load)
+    :type mapped_path: str|NoneType
+    """
+    key = (path, mapped_path)
+    model = loaded.pop(key, None)
+    if model is not None and loaded_paths.get(id(model)) == key:
+        del loaded_paths[id(model)]
 
 
 def get_path(model):
     """
     Get path of word2vec model
     :param model: model
-    :type model: Word2Vec
+    :type model: gensim.models.Word2Vec
     :return: path
     :rtype: str
     """
-    for path, instance in loaded.items():
-        if hash(instance) == hash(model):
-            return path
-    return ''
+    path, _ = loaded_paths.get(id(model), ('', None))
+    return path
+
+
+def content_hash(path, mapped_path=None):
+    """
+    Get hash of model files content (mapped files if they exist, else binary model),
+    so same vectors stored under different paths are recognized
+    :param path: path
+    :type path: str
+    :param mapped_path: converted model path (without extensions)
+    :type mapped_path: str|NoneType
+    :return: hex digest
+    :rtype: str
+    """
+    if mapped_path is not None and MappedWord2Vec.exists(mapped_path):
+        with _mapped_lock(mapped_path):
+            hashes = [_file_hash(mapped_path + '.vocab'), _file_hash(mapped_path + '.npy')]
+    else:
+        hashes = [_file_hash(path)]
+    digest = hashlib.sha1()
+    for file_hash in hashes:
+        digest.update(file_hash.encode('ascii'))
+    return digest.hexdigest()
+
+
+def _file_hash(path):
+    """
+    Get file content hash (cached while file size and modification time are same)
+    :param path: path
+    :type path: str
+    :return: hex digest
+    :rtype: str
+    """
+    status = os.stat(path)
+    key = (os.path.realpath(path), status.st_size, status.st_mtime_ns)
+    if key not in _content_hashes:
+        digest = hashlib.sha1()
+        with open(path, 'rb') as model_file:
+            for block in iter(lambda: model_file.read(HASH_BLOCK_SIZE), b''):
+                digest.update(block)
+        _content_hashes[key] = digest.hexdigest()
+    return _content_hashes[key]
@@ -1,6 +1,11 @@
 import os
+import tempfile
+import threading
 from unittest import TestCase
-from .word2vec_loader import load as load_word2vec, get_path as get_word2vec_path
+import numpy
+from .benchmark import synthetic_word2vec
+from .word2vec_loader import load as load_word2vec, unload as unload_word2vec, get_path as get_word2vec_path, \
+    MappedWord2Vec, _mapped_lock
 
 
 class LoaderTest(TestCase):
@@ -14,3 +19,69 @@ class LoaderTest(TestCase):
         path = os.path.join(os.path.dirname(__file__), "test", "glove.6B.50d.bin")
         model = load_word2vec(path)
         self.assertEqual(path, get_word2vec_path(model))
+
+    def testMapped(self):
+        path = os.path.join(os.path.dirname(__file__), "test", "glove.6B.50d.bin")
+        model = load_word2vec(path)
+        with tempfile.TemporaryDirectory() as directory:
+            mapped_path = os.path.join(directory, "glove")
+            MappedWord2Vec.convert(model, mapped_path)
+            mapped = MappedWord2Vec(mapped_path)
+            self.assertEqual(mapped.vector_size, model.vector_size)
+            for word in ["cat", "dog"]:
+                numpy.testing.assert_allclose(mapped[word], model[word])
+            matrix = mapped.word_matrix(["cat", "unknownword", "dog"])
+            numpy.testing.assert_allclose(matrix[0], model["cat"])
+            self.assertEqual(matrix[1].tolist(), [0.0] * model.vector_size)
+
+    def testPruned(self):
+        path = os.path.join(os.path.dirname(__file__), "test", "glove.6B.50d.bin")
+        model = load_word2vec(path)
+        with tempfile.TemporaryDirectory() as directory:
+            mapped_path = os.path.join(directory, "pruned")
+            MappedWord2Vec.prune(model, ["dog", "cat", "unknownword"], mapped_path, top_words=10)
+            pruned = MappedWord2Vec(mapped_path)
+            self.assertEqual(pruned.index2word, model.index2word[:10] + ["cat", "dog"])
+            numpy.testing.assert_allclose(pruned["dog"], model["dog"])
+
+    def testMappedCopies(self):
+        with tempfile.TemporaryDirectory() as directory:
+            # binary model isn't read, since both copies are converted already
+            path = os.path.join(directory, "vectors.bin")
+            full_path = os.path.join(directory, "full")
+            pruned_path = os.path.join(directory, "pruned")
+            MappedWord2Vec.prune(synthetic_word2vec(full_path, 20, 3), ["w15"], pruned_path, top_words=2)
+            full = load_word2vec(path, full_path)
+            pruned = load_word2vec(path, pruned_path)
+            self.assertEqual(len(full.index2word), 20)
+            self.assertEqual(pruned.index2word, ["w0", "w1", "w15"])
+            self.assertIs(load_word2vec(path, full_path), full)
+            self.assertIs(load_word2vec(path, pruned_path), pruned)
+            self.assertEqual(get_word2vec_path(pruned), path)
+            unload_word2vec(path, pruned_path)
+            self.assertIs(load_word2vec(path, full_path), full)
+            self.assertIsNot(load_word2vec(path, pruned_path), pruned)
+            unload_word2vec(path, pruned_path)
+            unload_word2vec(path, full_path)
+            self.assertEqual(get_word2vec_path(full), "")
+            del full, pruned
+
+    def testMappedRewrite(self):
+        with tempfile.TemporaryDirectory() as directory:
+            mapped_path = os.path.join(directory, "vectors")
+            MappedWord2Vec.write(["a", "b"], numpy.ones((2, 3)), mapped_path)
+            old = MappedWord2Vec(mapped_path)
+            MappedWord2Vec.write(["c"], numpy.zeros((1, 3)), mapped_path)
+            self.assertEqual(sorted(os.listdir(directory)), ["vectors.lock", "vectors.npy", "vectors.vocab"])
+            self.assertEqual(old.syn0.tolist(), [[1.0] * 3] * 2)
+            opened = []
+            # readers wait while model files are replaced
+            with _mapped_lock(mapped_path, exclusive=True):
+                reader = threading.Thread(target=lambda: opened.append(MappedWord2Vec(mapped_path)))
+                reader.start()
+                reader.join(0.2)
+                self.assertEqual(opened, [])
+            reader.join()
+            self.assertEqual(opened[0].index2word, ["c"])
+            self.assertEqual(opened[0].syn0.shape, (1, 3))
+            del old, opened